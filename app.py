@@ -1,21 +1,53 @@
 import streamlit as st
 from utils import load_custom_css
-from pages import quiz, admin
+from perf import span, profile, PROFILING_ENABLED
+from shared_state import check_for_changes
+from tenants import DEFAULT_TENANT, get_tenant, resolve_tenant, set_tenant
 
 # --- Page configuration ---
 st.set_page_config(page_title="SAF Safety Quiz", layout="centered")
 
 def main():
     """Main function to run the Streamlit app."""
+    # Drop cached data that another replica has changed since the last rerun
+    check_for_changes()
     load_custom_css()
 
+    # ?tenant=<id> picks the battalion whose quiz and data this session uses
+    tenant_id = resolve_tenant(st.query_params.get("tenant"))
+    if tenant_id is None:
+        st.error("Unknown unit link. Please check the quiz link with your unit.")
+        st.stop()
+    set_tenant(tenant_id)
+
     # Sidebar for navigation
     st.sidebar.title("Navigation")
+    if tenant_id != DEFAULT_TENANT:
+        st.sidebar.caption(get_tenant(tenant_id)["name"])
     app_mode = st.sidebar.radio("Choose a page:", ["Quiz", "Admin"])
 
+    # Opening the app with ?profile=1 captures a cProfile of every rerun in this session,
+    # on servers started with QUIZ_PROFILING=1
+    if PROFILING_ENABLED and st.query_params.get("profile") == "1":
+        st.session_state.profile_session = True
+
+    with span(f"rerun.{app_mode.lower()}"):
+        if PROFILING_ENABLED and st.session_state.get('profile_session'):
+            label = f"Quiz / {st.session_state.get('page', 'details')}" if app_mode == "Quiz" else app_mode
+            with profile(label):
+                render_page(app_mode)
+        else:
+            render_page(app_mode)
+
+def render_page(app_mode):
+    """Render the selected page."""
+    # Pages are imported on first use, so participants never load the
+    # admin dependencies (plotly, pandas, ...) just to see the details form
     if app_mode == "Quiz":
+        from pages import quiz
         quiz.main()
     elif app_mode == "Admin":
+        from pages import admin
         admin.show()
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Static assets are read from disk once per process and served from memory.
+# Anything that changes an asset on disk must call invalidate() for its path.
+
+STYLESHEET_PATH = "styles.css"
+
+# Small previews of images, generated once per image version and kept on disk
+THUMBNAIL_DIR = os.path.join("data", "thumbnails")
+THUMBNAIL_SIZE = (320, 180)
+
+# Entries kept in memory; the least recently used are dropped first
+IMAGE_CACHE_SIZE = 128  # decoded images, a few MB each
+THUMBNAIL_CACHE_SIZE = 2048  # JPEG bytes, tens of KB each
+
+_MISSING = object()
+
+_lock = threading.Lock()
+_css_cache = {}  # path -> (style tag, fingerprint) or _MISSING
+_image_cache = OrderedDict()  # path -> (image, fingerprint) or _MISSING
+_thumbnail_cache = OrderedDict()  # (path, size) -> JPEG bytes or _MISSING
+
+def _cache_put(cache, key, entry, max_entries):
+    """Store key in an LRU cache, dropping the least recently used entries past max_entries (caller holds _lock)."""
+    cache[key] = entry
+    cache.move_to_end(key)
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+
+def fingerprint(data):
+    """Short content hash used to version an asset."""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    # @import is only honoured at the top of a stylesheet
+    import_re = r"@import\s+(?:url\([^)]*\)|\"[^\"]*\"|'[^']*')[^;]*;"
+    imports = re.findall(import_re, css)
+    css = re.sub(import_re, "", css)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};:,>])\s*", r"\1", css)
+    css = css.replace(";}", "}")
+    return "".join(i.strip() for i in imports) + css.strip()
+
+def get_css_tag(path=STYLESHEET_PATH):
+    """
+    Return the minified stylesheet wrapped in a <style> tag, or None if the file is missing.
+    The same string object is returned on every call, tagged with its content fingerprint.
+    """
+    with _lock:
+        cached = _css_cache.get(path)
+    if cached is None:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            version = fingerprint(raw)
+            name = os.path.splitext(os.path.basename(path))[0]
+            tag = f'<style data-asset="{name}.{version}">{minify_css(raw.decode("utf-8"))}</style>'
+            cached = (tag, version)
+        except FileNotFoundError:
+            cached = _MISSING
+        with _lock:
+            _css_cache[path] = cached
+    return None if cached is _MISSING else cached[0]
+
+def load_image(path):
+    """Return the decoded image at path from the cache, or None if it doesn't exist."""
+    entry = _get_image_entry(path)
+    return None if entry is _MISSING else entry[0]
+
+def image_version(path):
+    """Return the content fingerprint of a cached image, or None if it doesn't exist."""
+    entry = _get_image_entry(path)
+    return None if entry is _MISSING else entry[1]
+
+def _get_image_entry(path):
+    with _lock:
+        entry = _image_cache.get(path)
+        if entry is not None:
+            _image_cache.move_to_end(path)
+            return entry
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        from io import BytesIO
+        from PIL import Image
+        image = Image.open(BytesIO(raw))
+        image.load()
+        entry = (image, fingerprint(raw))
+    except FileNotFoundError:
+        entry = _MISSING
+    with _lock:
+        _cache_put(_image_cache, path, entry, IMAGE_CACHE_SIZE)
+    return entry
+
+def load_thumbnail(path, size=THUMBNAIL_SIZE, directory=THUMBNAIL_DIR):
+    """
+    Return JPEG bytes of a preview of the image at path no larger than size, or None if it doesn't exist.
+    The full image is only decoded the first time a version of it is seen: thumbnails are
+    stored in directory under the image's content fingerprint and reused from there.
+    """
+    key = (path, tuple(size))
+    with _lock:
+        cached = _thumbnail_cache.get(key)
+        if cached is not None:
+            _thumbnail_cache.move_to_end(key)
+    if cached is None:
+        try:
+            cached = _read_thumbnail(path, size, directory)
+        except FileNotFoundError:
+            cached = _MISSING
+        with _lock:
+            _cache_put(_thumbnail_cache, key, cached, THUMBNAIL_CACHE_SIZE)
+    return None if cached is _MISSING else cached
+
+def _read_thumbnail(path, size, directory):
+    with open(path, "rb") as f:
+        raw = f.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    prefix = f"{name}-{size[0]}x{size[1]}-"
+    thumbnail_path = os.path.join(directory, f"{prefix}{fingerprint(raw)}.jpg")
+    try:
+        with open(thumbnail_path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    from io import BytesIO
+    from PIL import Image
+    from shared_state import atomic_write
+    image = Image.open(BytesIO(raw))
+    image.thumbnail(size)
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=80)
+    data = buffer.getvalue()
+    # Thumbnails of older versions of this image are no longer needed
+    if os.path.isdir(directory):
+        for old in os.listdir(directory):
+            if old.startswith(prefix):
+                try:
+                    os.remove(os.path.join(directory, old))
+                except OSError:
+                    pass
+    atomic_write(thumbnail_path, data)
+    return data
+
+def invalidate(path=None, directory=None, exclude=()):
+    """
+    Forget a cached asset, every asset under directory (except those under the
+    directories in exclude), or every asset, so it is re-read on next use.
+    """
+    if directory is not None:
+        prefix = os.path.join(directory, "")
+        excluded = tuple(os.path.join(d, "") for d in exclude)
+
+        def under(key):
+            return key.startswith(prefix) and not (excluded and key.startswith(excluded))
+        with _lock:
+            for cache in (_css_cache, _image_cache):
+                for key in [k for k in cache if under(k)]:
+                    del cache[key]
+            for key in [k for k in _thumbnail_cache if under(k[0])]:
+                del _thumbnail_cache[key]
+        return
+    with _lock:
+        if path is None:
+            _css_cache.clear()
+            _image_cache.clear()
+            _thumbnail_cache.clear()
+        else:
+            _css_cache.pop(path, None)
+            _image_cache.pop(path, None)
+            for key in [k for k in _thumbnail_cache if k[0] == path]:
+                del _thumbnail_cache[key]
@@ -0,0 +1,118 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from shared_state import file_lock
+
+log = logging.getLogger(__name__)
+
+# Attempt events are appended as one JSON object per line
+DATA_DIR = "data"
+ATTEMPT_LOG_PATH = os.path.join(DATA_DIR, "attempts.jsonl")
+
+# Writer tuning: flush at least this often, and at most this many events per write
+FLUSH_INTERVAL = 0.5
+MAX_BATCH = 500
+
+EVENT_TYPES = ("start", "submit", "grade", "retry", "complete")
+
+class AttemptLogger:
+    """
+    Append-only event log for quiz attempts.
+    Callers only put events on an in-memory queue; a background thread batches
+    them and appends to the log file, so the quiz flow never waits on disk.
+    """
+
+    def __init__(self, path=ATTEMPT_LOG_PATH, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def log(self, event, attempt_id, **fields):
+        """Queue an event for writing. Returns immediately."""
+        if event not in EVENT_TYPES:
+            raise ValueError(f"Unknown attempt event: {event}")
+        record = {"ts": time.time(), "event": event, "attempt_id": attempt_id}
+        record.update(fields)
+        self._ensure_started()
+        self._queue.put(record)
+
+    def flush(self):
+        """Block until every queued event has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="attempt-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Collect whatever else arrives within the flush window
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                log.exception("Error writing %d attempt event(s)", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+        # Large batches are split into several writes; keep other replicas' lines out of them
+        with file_lock(self.path):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+def new_attempt_id():
+    """Generate a unique ID for a single quiz attempt."""
+    return uuid.uuid4().hex
+
+def read_attempt_events(path=ATTEMPT_LOG_PATH):
+    """Read all logged events, skipping any partially written lines."""
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+# Shared process-wide logger
+_logger = AttemptLogger()
+atexit.register(_logger.flush)
+
+def log_attempt_event(event, attempt_id, **fields):
+    """Record an attempt event on the shared logger."""
+    _logger.log(event, attempt_id, **fields)
+
+def flush_attempt_log():
+    """Wait for the shared logger to write out pending events."""
+    _logger.flush()
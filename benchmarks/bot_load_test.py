@@ -0,0 +1,310 @@
+"""
+Load test for the Telegram bot against a local fake Bot API.
+
+FakeBotApi serves getUpdates, sendMessage and sendPhoto over HTTP, like
+api.telegram.org does. Every chat is a simulated participant who replies to
+the bot after a random think time (straight away with --think 0):
+- picks a unit, company and platoon from the bot's keyboards
+- gives a rank and name
+- answers each question (a share of first answers fail, which exercises retries)
+
+The bot runs in this process, in a scratch data directory, with all chats
+starting at once.
+
+Reports reply latency percentiles (from a participant's message reaching the
+fake server to the bot's first reply), messages per second, photo uploads
+and peak memory. Checks that:
+- every chat completes
+- every passed answer is in the CSV once
+- each scenario image is uploaded only once
+
+Usage:
+    python benchmarks/bot_load_test.py
+    python benchmarks/bot_load_test.py --chats 3000 --fail-rate 0.3 --error-rate 0.01 --json results.json
+"""
+import argparse
+import asyncio
+import csv
+import email
+import heapq
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+TOKEN = "123456:TEST"
+GOOD_ANSWER = "I will stop, call for the platoon medic, check if he is conscious and check his breathing."
+BAD_ANSWER = "I will let him carry on."
+
+class FakeBotApi:
+    """In-memory Bot API: queues participants' messages as updates and hands bot replies to them."""
+
+    def __init__(self, chats, prompts, fail_rate=0.0, error_rate=0.0, think=0.0, tenant="", seed=0):
+        self.prompts = prompts
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.think = think
+        self.rng = random.Random(seed)
+        self._lock = threading.Condition()
+        self._updates = []
+        self._thinking = []  # heap of (when the message is sent, sequence number, chat, text)
+        self._sequence = itertools.count()
+        self._next_update_id = 1
+        self.sent_at = {}  # chat -> when its latest message was queued, until the bot replies
+        self.latencies = []
+        self.answered = {}  # chat -> questions answered so far (for first-try failures)
+        self.done = set()
+        self.messages = 0
+        self.uploads = 0
+        self.errors = 0
+        self.chats = list(range(1, chats + 1))
+        start = f"/start {tenant}".strip()
+        for chat in self.chats:
+            self._queue(chat, start)
+
+    # --- Participants ---
+
+    def _think(self, chat, text):
+        """Send text from chat after a think time of 0-2x the mean."""
+        if not self.think:
+            self._queue(chat, text)
+            return
+        with self._lock:
+            heapq.heappush(self._thinking, (time.monotonic() + self.rng.uniform(0, 2 * self.think),
+                                            next(self._sequence), chat, text))
+            self._lock.notify_all()
+
+    def _send_thought(self):
+        """Queue messages whose think time is over. Returns seconds until the next one, or None."""
+        now = time.monotonic()
+        while self._thinking and self._thinking[0][0] <= now:
+            _, _, chat, text = heapq.heappop(self._thinking)
+            self._queue(chat, text)
+        return self._thinking[0][0] - now if self._thinking else None
+
+    def _queue(self, chat, text):
+        with self._lock:
+            self._updates.append({
+                "update_id": self._next_update_id,
+                "message": {"message_id": self._next_update_id, "date": int(time.time()), "text": text,
+                            "chat": {"id": chat, "type": "private"},
+                            "from": {"id": chat, "is_bot": False, "username": f"sim{chat}"}},
+            })
+            self._next_update_id += 1
+            self.sent_at[chat] = time.perf_counter()
+            self._lock.notify_all()
+
+    def _reply(self, chat, text, markup):
+        """What the participant in chat sends back after the bot's message, if anything."""
+        if markup and markup.get("keyboard"):
+            return self.rng.choice([button["text"] for row in markup["keyboard"] for button in row])
+        if text == self.prompts["rank_name"]:
+            return f"PTE Sim {chat}"
+        if text.endswith(self.prompts["question"]):
+            self.answered[chat] = self.answered.get(chat, 0) + 1
+            return BAD_ANSWER if self.rng.random() < self.fail_rate else GOOD_ANSWER
+        if text.endswith(self.prompts["retry"]):
+            return GOOD_ANSWER
+        if text.startswith(self.prompts["complete"]):
+            self.done.add(chat)
+        return None
+
+    def _bot_sent(self, chat, text, markup):
+        with self._lock:
+            self.messages += 1
+            queued = self.sent_at.pop(chat, None)
+            if queued is not None:
+                self.latencies.append(time.perf_counter() - queued)
+            reply = self._reply(chat, text or "", markup)
+        if reply is not None:
+            self._think(chat, reply)
+
+    # --- Bot API methods ---
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._lock:
+            # Updates before offset have been confirmed by the bot
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            next_thought = self._send_thought()
+            while not self._updates and time.monotonic() < deadline:
+                wait = deadline - time.monotonic()
+                self._lock.wait(wait if next_thought is None else min(wait, next_thought))
+                next_thought = self._send_thought()
+            return self._updates[:int(params.get("limit") or 100)]
+
+    def send_message(self, params):
+        chat = int(params["chat_id"])
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        self._bot_sent(chat, params.get("text"), markup)
+        return {"message_id": self.messages, "chat": {"id": chat}, "text": params.get("text")}
+
+    def send_photo(self, params, uploaded):
+        chat = int(params["chat_id"])
+        if uploaded:
+            with self._lock:
+                self.uploads += 1
+                file_id = f"photo-{self.uploads}"
+        else:
+            file_id = params["photo"]
+        self._bot_sent(chat, params.get("caption"), None)
+        return {"message_id": self.messages, "chat": {"id": chat},
+                "photo": [{"file_id": f"{file_id}-small", "width": 90}, {"file_id": file_id, "width": 800}]}
+
+    def serve(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, as the bot's connection pool expects
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                token, _, method = self.path.strip("/").partition("/")
+                if token != f"bot{TOKEN}":
+                    return self._reply(401, {"ok": False, "description": "Unauthorized"})
+                if method != "getUpdates" and api.rng.random() < api.error_rate:
+                    with api._lock:
+                        api.errors += 1
+                    return self._reply(502, {"ok": False, "description": "Bad Gateway"})
+                params, uploaded = self._params(body)
+                if method == "getUpdates":
+                    result = api.get_updates(params)
+                elif method == "sendMessage":
+                    result = api.send_message(params)
+                elif method == "sendPhoto":
+                    result = api.send_photo(params, uploaded)
+                else:
+                    return self._reply(404, {"ok": False, "description": "Not Found"})
+                self._reply(200, {"ok": True, "result": result})
+
+            def _params(self, body):
+                content_type = self.headers.get("Content-Type", "")
+                if not content_type.startswith("multipart/"):
+                    return (json.loads(body) if body else {}), False
+                message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+                params, uploaded = {}, False
+                for part in message.get_payload():
+                    name = part.get_param("name", header="content-disposition")
+                    if part.get_filename():
+                        uploaded = True
+                    else:
+                        params[name] = part.get_payload(decode=True).decode("utf-8")
+                return params, uploaded
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+async def drive(api, chats, timeout):
+    import telegram_bot
+    stop = asyncio.Event()
+
+    async def watch():
+        deadline = time.monotonic() + timeout
+        while len(api.done) < chats and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        stop.set()
+
+    server = api.serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    watcher = asyncio.create_task(watch())
+    try:
+        await telegram_bot.serve(TOKEN, url, stop=stop, poll_timeout=1)
+    finally:
+        watcher.cancel()
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="share of first answers that fail")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Bot API calls answered with 502")
+    parser.add_argument("--think", type=float, default=2.0, help="mean seconds a participant takes to reply")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for every chat to finish")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz-bot-")
+    os.chdir(workdir)
+    try:
+        import telegram_bot
+        from quiz_config import list_questions
+        from submissions import flush_submissions
+        api = FakeBotApi(args.chats, telegram_bot.PROMPTS, args.fail_rate, args.error_rate, args.think)
+        started = time.perf_counter()
+        asyncio.run(drive(api, args.chats, args.timeout))
+        seconds = time.perf_counter() - started
+        flush_submissions()
+
+        with open(os.path.join("data", "participants.csv"), newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        attempt_ids = [row["Attempt ID"] for row in rows]
+        expected = sum(api.answered.values())
+        results = {
+            "chats": args.chats,
+            "completed": len(api.done),
+            "seconds": seconds,
+            "messages": api.messages,
+            "messages_per_second": api.messages / seconds,
+            "p50_ms": percentile(api.latencies, 0.50) * 1000,
+            "p95_ms": percentile(api.latencies, 0.95) * 1000,
+            "p99_ms": percentile(api.latencies, 0.99) * 1000,
+            "photo_uploads": api.uploads,
+            "injected_errors": api.errors,
+            "saved": len(rows),
+            "expected_saved": expected,
+            "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        print(f"{results['completed']}/{args.chats} chats completed in {seconds:.1f}s  "
+              f"{results['messages_per_second']:.0f} bot messages/s")
+        print(f"reply latency p50 {results['p50_ms']:.1f} ms  p95 {results['p95_ms']:.1f} ms  "
+              f"p99 {results['p99_ms']:.1f} ms")
+        print(f"saved {len(rows)}/{expected}  photo uploads {api.uploads}  injected errors {api.errors}  "
+              f"peak memory {results['peak_memory_mb']:.0f} MB")
+        failures = []
+        if results["completed"] != args.chats:
+            failures.append("not every chat completed")
+        if len(rows) != expected or len(set(attempt_ids)) != len(attempt_ids):
+            failures.append("saved rows don't match passed answers")
+        if api.uploads > sum(q.get("image_enabled", True) for q in list_questions()):
+            failures.append("scenario images were uploaded more than once each")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        print("FAIL: " + "; ".join(failures) if failures else "OK")
+        sys.exit(1 if failures else 0)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
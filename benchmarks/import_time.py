@@ -0,0 +1,93 @@
+"""
+Import-time benchmark for the app's cold start.
+
+Runs a fresh interpreter with ``python -X importtime`` for each scenario,
+parses the report from stderr and prints the total import time, the slowest
+modules, and which heavy dependencies the app loads on top of Streamlit itself.
+
+Usage:
+    python benchmarks/import_time.py            # report
+    python benchmarks/import_time.py --check    # also exit 1 if a heavy module loads on the participant path
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only load when the page that needs them renders
+HEAVY_MODULES = ["pandas", "plotly", "PIL", "requests", "google"]
+
+# Streamlit's own imports are the floor every scenario is compared against
+BASELINE = "import streamlit"
+
+SCENARIOS = {
+    # What a participant needs to see the details form
+    "participant": "import app; from pages import quiz",
+    # What the admin dashboard needs
+    "admin": "import app; from pages import admin",
+}
+
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+def measure(code, python=sys.executable):
+    """Run code in a fresh interpreter and return [(module, self_us, cumulative_us, depth)]."""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+def summarize(name, rows, baseline_rows, top=10):
+    total_ms = sum(r[1] for r in rows) / 1000
+    baseline_ms = sum(r[1] for r in baseline_rows) / 1000
+    baseline_modules = {r[0] for r in baseline_rows}
+    # A heavy package counts if the app imports its top-level module beyond what Streamlit loads
+    added = {r[0] for r in rows} - baseline_modules
+    heavy = [m for m in HEAVY_MODULES if m in added]
+
+    print(f"== {name}: {total_ms:.1f} ms across {len(rows)} modules "
+          f"({total_ms - baseline_ms:+.1f} ms over bare Streamlit)")
+    print(f"   heavy modules added by the app: {', '.join(heavy) if heavy else 'none'}")
+    print(f"   slowest top-level imports:")
+    top_level = sorted((r for r in rows if r[3] == 0), key=lambda r: r[2], reverse=True)
+    for module, _, cumulative_us, _ in top_level[:top]:
+        print(f"     {cumulative_us / 1000:8.1f} ms  {module}")
+    return total_ms, heavy
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument("--check", action="store_true",
+                        help="exit non-zero if a heavy module is imported on the participant path")
+    args = parser.parse_args()
+
+    def fastest(code):
+        # Keep the fastest run to reduce noise from disk cache and scheduling
+        runs = [measure(code) for _ in range(args.runs)]
+        return min(runs, key=lambda rows: sum(r[1] for r in rows))
+
+    baseline_rows = fastest(BASELINE)
+    failed = False
+    for name, code in SCENARIOS.items():
+        _, heavy = summarize(name, fastest(code), baseline_rows, args.top)
+        if name == "participant" and heavy:
+            failed = True
+
+    if args.check and failed:
+        print("FAIL: heavy modules are imported before the participant needs them")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Bulk ingestion throughput on synthetic answers.
+
+Writes an NDJSON file of synthetic answers (with a share of malformed rows
+mixed in) and ingests it in a scratch data directory with each batch size.
+The same answers are also saved one at a time through grade_answer(),
+check_answer() and save_participant_data(), the way hand re-keying through
+the quiz does.
+Checks that every well-formed row was accounted for and every malformed one
+rejected.
+
+Usage:
+    python benchmarks/ingest_bench.py
+    python benchmarks/ingest_bench.py --rows 20000 --batch-sizes 100 500 2000 --json results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def write_records(path, rows, bad_every):
+    import synthetic
+    good = bad = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for i, row in enumerate(synthetic.make_participants(rows)):
+            if bad_every and i % bad_every == bad_every - 1:
+                f.write('{"UNIT": "1 SIR", "Answer": \n' if i % 2 else json.dumps({**row, "UNIT": "9 SIR"}) + "\n")
+                bad += 1
+                continue
+            record = {k: row[k] for k in ("UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", "Answer")}
+            record["Question ID"] = "q1"
+            f.write(json.dumps(record) + "\n")
+            good += 1
+    return good, bad
+
+def one_at_a_time(path):
+    from datetime import datetime
+    from dedup import check_answer
+    from quiz_config import get_question_by_id, load_quiz_config
+    from submissions import flush_submissions
+    from utils import grade_answer, save_participant_data
+    import ingest
+
+    with open(path, encoding="utf-8") as f:
+        records = [record for _, record, error in ingest.parse_records(f.read(), "ndjson") if error is None]
+    config = load_quiz_config()
+    question = get_question_by_id("q1")
+    start = time.perf_counter()
+    for record in records:
+        row = {k: record.get(k, "") for k in ("UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", "Answer")}
+        row.update(grade_answer(row["Answer"], question, config))
+        duplicate = check_answer(row["Answer"], row)
+        row["Duplicate Of"] = duplicate["duplicate_of"]
+        row["Timestamp"] = datetime.now().isoformat()
+        save_participant_data(row)
+    flush_submissions()
+    return len(records), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--bad-every", type=int, default=50, help="make every Nth row malformed (0 for none)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz-ingest-")
+    results = []
+    try:
+        os.chdir(workdir)
+        records_path = os.path.join(workdir, "answers.ndjson")
+        good, bad = write_records(records_path, args.rows, args.bad_every)
+        import ingest
+        from submissions import flush_submissions
+        for size in args.batch_sizes:
+            start = time.perf_counter()
+            with open(os.devnull, "w") as quiet:
+                stdout, sys.stdout = sys.stdout, quiet
+                try:
+                    reports = ingest.load_files([records_path], batch_size=size, save_failed=True)
+                finally:
+                    sys.stdout = stdout
+            flush_submissions()
+            seconds = time.perf_counter() - start
+            saved = sum(r["saved"] for r in reports)
+            rejected = sum(len(r["rejected"]) for r in reports)
+            assert saved == good and rejected == bad, (saved, good, rejected, bad)
+            worst = min(r["rows_per_second"] for r in reports)
+            print(f"batch {size:>6}  {len(reports):>4} batches  {seconds:7.2f}s  {args.rows / seconds:9.0f} rows/s  "
+                  f"(slowest batch {worst:.0f} rows/s)  {rejected} rejected")
+            results.append({"batch_size": size, "batches": len(reports), "seconds": seconds,
+                            "rows_per_second": args.rows / seconds, "saved": saved, "rejected": rejected})
+
+        rows, seconds = one_at_a_time(records_path)
+        print(f"one at a time          {seconds:7.2f}s  {rows / seconds:9.0f} rows/s")
+        results.append({"batch_size": 1, "seconds": seconds, "rows_per_second": rows / seconds, "saved": rows})
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
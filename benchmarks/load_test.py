@@ -0,0 +1,280 @@
+"""
+Headless load test for the quiz flow.
+
+Drives many simulated participants through app.py with Streamlit's AppTest:
+details form -> question -> submit (grading) -> optional retry -> completion.
+AppTest keeps one global runtime per process, so load is generated by several
+worker processes that each keep many sessions open and step through them in
+turn. All workers share one scratch data directory (with a mocked image
+backend), so the real data/ folder is never touched.
+
+Reports p50/p95/p99 latency per step, submissions per second, saved vs
+expected submissions, and peak memory.
+
+Usage:
+    python benchmarks/load_test.py --sessions 200 --workers 4 --open-per-worker 15
+    python benchmarks/load_test.py --sessions 50 --image-latency 0.5 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from unittest import mock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+UNITS = ["1 SIR", "2 SIR", "3 SIR"]
+COYS = ["Alpha", "Bravo", "Charlie"]
+PLATOONS = ["1", "2", "3", "4"]
+PASSING_ANSWER = "Stop and assess him, check if he is conscious and breathing, and call the platoon medic for help."
+FAILING_ANSWER = "I would help him up and continue."
+
+class StepTimer:
+    """Collection of latency samples per step."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def record(self, step, seconds):
+        self.samples[step].append(seconds)
+
+    def time(self, step, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(step, time.perf_counter() - start)
+
+    def merge(self, samples):
+        for step, values in samples.items():
+            self.samples[step].extend(values)
+
+    def summary(self):
+        summary = {}
+        for step, values in self.samples.items():
+            values = sorted(values)
+            summary[step] = {
+                "count": len(values),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return summary
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def fake_image_response(latency):
+    """Build a stand-in for requests.get that returns a small PNG after a delay."""
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (800, 400), "#6b7a4a").save(buffer, "PNG")
+    png = buffer.getvalue()
+
+    def fake_get(url, *args, **kwargs):
+        time.sleep(latency)
+        response = mock.Mock()
+        response.status_code = 200
+        response.headers = {"content-type": "image/png"}
+        response.content = png
+        return response
+    return fake_get
+
+def prepare_workdir():
+    """Copy the config, question images and stylesheet into a scratch directory."""
+    workdir = tempfile.mkdtemp(prefix="quiz-load-")
+    os.makedirs(os.path.join(workdir, "data"))
+    shutil.copy(os.path.join(REPO_ROOT, "data", "quiz_config.json"), os.path.join(workdir, "data"))
+    questions_dir = os.path.join(REPO_ROOT, "data", "questions")
+    if os.path.isdir(questions_dir):
+        shutil.copytree(questions_dir, os.path.join(workdir, "data", "questions"))
+    shutil.copy(os.path.join(REPO_ROOT, "styles.css"), workdir)
+    return workdir
+
+def find_button(at, label):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise AssertionError(f"Button {label!r} not found on page {at.session_state['page']!r}")
+
+def check(at, step):
+    if at.exception:
+        raise AssertionError(f"{step}: {at.exception[0].value}")
+
+def session_steps(index, timer, fail_rate, timeout):
+    """
+    Drive one participant through the full quiz flow.
+    Yields after every step so a worker can interleave many open sessions;
+    returns the number of saved submissions.
+    """
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(index)
+    at = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=timeout)
+
+    timer.time("form", at.run)
+    check(at, "form")
+    yield
+
+    at.selectbox[0].set_value(rng.choice(UNITS))
+    at.selectbox[1].set_value(rng.choice(COYS))
+    at.selectbox[2].set_value(rng.choice(PLATOONS))
+    at.text_input[0].set_value(f"PTE Load {index}")
+    at.text_input[1].set_value(f"@load{index}")
+    timer.time("details", find_button(at, "Next").click().run)
+    check(at, "details")
+    yield
+
+    submissions = 0
+    while at.session_state["page"] == "quiz_question":
+        answer = FAILING_ANSWER if rng.random() < fail_rate else PASSING_ANSWER
+        at.text_area[0].set_value(answer)
+        timer.time("submit", find_button(at, "Submit Answer").click().run)
+        check(at, "submit")
+        yield
+        if "retake_feedback" in at.session_state:
+            timer.time("retry", find_button(at, "Retry Quiz").click().run)
+            check(at, "retry")
+            yield
+        else:
+            submissions += 1
+
+    timer.time("completion", find_button(at, "Finish").click().run)
+    check(at, "completion")
+    return submissions
+
+def run_worker(workdir, session_ids, open_sessions, fail_rate, image_latency, timeout):
+    """Run a batch of sessions in this process, keeping up to open_sessions in flight."""
+    os.chdir(workdir)
+    import attempt_log
+    import image_generator
+    import utils
+    from submissions import flush_submissions
+
+    timer = StepTimer()
+    # Time the grading and storage hot paths as seen by the quiz page
+    original_grade, original_save = utils.grade_answer, utils.save_participant_data
+    grade = lambda *a, **k: timer.time("grade_answer", original_grade, *a, **k)
+    save = lambda *a, **k: timer.time("save_participant_data", original_save, *a, **k)
+
+    submissions = 0
+    errors = []
+    pending = list(session_ids)
+    active = []
+    with mock.patch.object(image_generator.requests, "get", fake_image_response(image_latency)), \
+            mock.patch.object(utils, "grade_answer", grade), mock.patch.object(utils, "save_participant_data", save):
+        while pending or active:
+            while pending and len(active) < open_sessions:
+                active.append(session_steps(pending.pop(0), timer, fail_rate, timeout))
+            # Advance every open session by one step, round-robin
+            for session in list(active):
+                try:
+                    next(session)
+                except StopIteration as done:
+                    submissions += done.value or 0
+                    active.remove(session)
+                except Exception as e:
+                    errors.append(str(e))
+                    active.remove(session)
+    attempt_log.flush_attempt_log()
+    flush_submissions()
+    return dict(timer.samples), submissions, errors, peak_memory_mb()
+
+def peak_memory_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="total simulated participants")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes generating load")
+    parser.add_argument("--open-per-worker", type=int, default=15,
+                        help="sessions each worker keeps open at once")
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="chance an answer is a failing one")
+    parser.add_argument("--image-latency", type=float, default=0.0, help="seconds the mocked image backend takes")
+    parser.add_argument("--timeout", type=float, default=120, help="per-step AppTest timeout in seconds")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch data directory")
+    args = parser.parse_args()
+
+    workdir = prepare_workdir()
+    timer = StepTimer()
+    errors = []
+    submissions = 0
+    worker_memory = []
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(run_worker, workdir, list(range(w, args.sessions, args.workers)),
+                        args.open_per_worker, args.fail_rate, args.image_latency, args.timeout)
+            for w in range(args.workers)
+        ]
+        for future in as_completed(futures):
+            try:
+                samples, worker_submissions, worker_errors, memory = future.result()
+            except Exception as e:
+                errors.append(f"worker failed: {e}")
+                continue
+            timer.merge(samples)
+            submissions += worker_submissions
+            errors.extend(worker_errors)
+            if memory is not None:
+                worker_memory.append(memory)
+    elapsed = time.perf_counter() - start
+
+    import pandas as pd
+    saved = len(pd.read_csv(os.path.join(workdir, "data", "participants.csv")))
+    results = {
+        "sessions": args.sessions,
+        "workers": args.workers,
+        "open_sessions": args.workers * args.open_per_worker,
+        "elapsed_s": elapsed,
+        "submissions": submissions,
+        "saved_rows": saved,
+        "lost_submissions": submissions - saved,
+        "submissions_per_s": submissions / elapsed if elapsed else 0.0,
+        "peak_memory_mb_per_worker": max(worker_memory) if worker_memory else None,
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "steps": timer.summary(),
+    }
+
+    print(f"{args.sessions} sessions, {args.workers} workers x {args.open_per_worker} open, {elapsed:.1f}s")
+    print(f"{'step':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for step, stats in results["steps"].items():
+        print(f"{step:<24}{stats['count']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"submissions/s: {results['submissions_per_s']:.2f}  "
+          f"saved {saved}/{submissions}  errors: {len(errors)}")
+    if results["peak_memory_mb_per_worker"] is not None:
+        print(f"peak memory per worker: {results['peak_memory_mb_per_worker']:.1f} MB")
+    for error in errors[:5]:
+        print(f"  error: {error}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.keep:
+        print(f"scratch data kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Micro-benchmarks for the storage, grading, config and image hot paths.
+
+Each benchmark runs in a scratch directory seeded with synthetic data (see
+synthetic.py), so the real data/ folder is never touched. Results are compared
+against a stored baseline and the run fails if any benchmark regresses.
+
+Usage:
+    python benchmarks/micro_bench.py                    # run and compare with baseline.json
+    python benchmarks/micro_bench.py --save-baseline    # record a new baseline
+    python benchmarks/micro_bench.py -k grade           # only benchmarks whose name contains "grade"
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic
+
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+BENCHMARKS = {}
+# Per-benchmark overrides of --repeat and --tolerance, for benchmarks noisier than the rest
+OPTIONS = {}
+
+def benchmark(name, repeat=None, tolerance=None):
+    """Register a benchmark. The decorated function does setup and returns the callable to time."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        OPTIONS[name] = {"repeat": repeat, "tolerance": tolerance}
+        return setup
+    return register
+
+def _write_config(question_count):
+    os.makedirs("data", exist_ok=True)
+    with open(os.path.join("data", "quiz_config.json"), "w") as f:
+        json.dump(synthetic.make_config(question_count), f)
+
+# --- Storage ---
+
+def _save_benchmark(rows):
+    import utils
+    os.makedirs("data", exist_ok=True)
+    synthetic.write_participants_csv(utils.CSV_PATH, rows)
+    new_rows = synthetic.make_participants(1000, seed=1)
+    counter = iter(range(10 ** 9))
+    return lambda: utils.save_participant_data(new_rows[next(counter) % len(new_rows)])
+
+@benchmark("save_participant_data[1k rows]")
+def bench_save_1k():
+    return _save_benchmark(1000)
+
+@benchmark("save_participant_data[10k rows]")
+def bench_save_10k():
+    return _save_benchmark(10000)
+
+# --- Grading ---
+
+def _use_grading_cache(enabled):
+    """Grading benchmarks measure the graders themselves unless they ask for the cache."""
+    import grading
+    grading.grading_cache.clear()
+    grading.grading_cache.max_entries = grading.CACHE_SIZE if enabled else 0
+
+def _grade_benchmark(phrases):
+    import utils
+    _use_grading_cache(False)
+    rng = random.Random(0)
+    answers = [synthetic.make_answer(rng, phrases) for _ in range(500)]
+    counter = iter(range(10 ** 9))
+    return lambda: utils.grade_answer(answers[next(counter) % len(answers)])
+
+@benchmark("grade_answer[short]")
+def bench_grade_short():
+    return _grade_benchmark(2)
+
+@benchmark("grade_answer[long]")
+def bench_grade_long():
+    return _grade_benchmark(16)
+
+def _tfidf_benchmark(cached):
+    import grading
+    import utils
+    _use_grading_cache(cached)
+    config = synthetic.make_config(20, references=3, grading_backend="tfidf")
+    grading.prepare_references(config)
+    rng = random.Random(0)
+    answers = [synthetic.make_answer(rng, 6) for _ in range(500)]
+    questions = config["questions"]
+    counter = iter(range(10 ** 9))
+
+    def grade():
+        i = next(counter)
+        return utils.grade_answer(answers[i % len(answers)], questions[i % len(questions)], config)
+    return grade
+
+@benchmark("grade_answer[tfidf]")
+def bench_grade_tfidf():
+    return _tfidf_benchmark(cached=False)
+
+@benchmark("grade_answer[tfidf, cached]")
+def bench_grade_tfidf_cached():
+    return _tfidf_benchmark(cached=True)
+
+# --- Config ---
+
+@benchmark("load_quiz_config[3 questions]")
+def bench_config_small():
+    import quiz_config
+    _write_config(3)
+    return quiz_config.load_quiz_config
+
+@benchmark("load_quiz_config[500 questions]")
+def bench_config_large():
+    import quiz_config
+    _write_config(500)
+    return quiz_config.load_quiz_config
+
+# --- Question bank ---
+
+BANK_SIZE = 5000
+
+def _seed_bank():
+    import quiz_config
+    from question_bank import question_bank
+    _write_config(0)
+    question_bank.import_questions(synthetic.make_questions(BANK_SIZE))
+    return quiz_config
+
+@benchmark(f"list_questions[{BANK_SIZE} questions]")
+def bench_bank_list():
+    return _seed_bank().list_questions
+
+@benchmark(f"get_question_by_id[{BANK_SIZE} questions]")
+def bench_bank_get():
+    quiz_config = _seed_bank()
+    # Cycle through every question, so nearly every call misses the in-memory cache
+    ids = [f"q{i}" for i in range(1, BANK_SIZE + 1)]
+    counter = iter(range(10 ** 9))
+    return lambda: quiz_config.get_question_by_id(ids[next(counter) % len(ids)])
+
+@benchmark(f"add_question[{BANK_SIZE} questions]")
+def bench_bank_add():
+    quiz_config = _seed_bank()
+    question = synthetic.make_questions(1, seed=1)[0]
+    return lambda: quiz_config.add_question(dict(question))
+
+# --- Images ---
+
+def _image_benchmark(cold):
+    import assets
+    import quiz_config
+    os.makedirs(quiz_config.questions_dir(), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, "data", "questions", "q2_image.png"),
+                os.path.join(quiz_config.questions_dir(), "q2_image.png"))
+    assets.invalidate()
+
+    def load():
+        if cold:
+            assets.invalidate()
+        return quiz_config.load_scenario_image("q2")
+    return load
+
+@benchmark("load_scenario_image[cold]")
+def bench_image_cold():
+    return _image_benchmark(cold=True)
+
+@benchmark("load_scenario_image[warm]")
+def bench_image_warm():
+    return _image_benchmark(cold=False)
+
+@benchmark("load_scenario_thumbnail[cold]")
+def bench_thumbnail_cold():
+    import assets
+    import quiz_config
+    _image_benchmark(cold=True)
+    # Generated once; later calls read it back from the thumbnail directory
+    quiz_config.load_scenario_thumbnail("q2")
+
+    def load():
+        assets.invalidate()
+        return quiz_config.load_scenario_thumbnail("q2")
+    return load
+
+@benchmark("enhance_image_prompt[memoized]")
+def bench_enhance_prompt():
+    import prompts
+    # A stub model with Gemini-like latency; only the first call reaches it
+    client = prompts.StubLLMClient(latency=0.5)
+    prompt = synthetic.make_questions(1)[0]["image_prompt"]
+    prompts.enhance_image_prompt(prompt, client)
+    return lambda: prompts.enhance_image_prompt(prompt, client)
+
+@benchmark("create_scenario_illustration")
+def bench_illustration():
+    import image_generator
+    return image_generator.create_scenario_illustration
+
+@benchmark("render_scene[new spec]")
+def bench_render_scene():
+    import itertools
+    import scene_renderer
+    question = synthetic.make_questions(1)[0]
+    scene_renderer.render_scene(question)
+    # A different title each call misses the render cache but reuses backgrounds and sprites
+    counter = itertools.count()
+    return lambda: scene_renderer.render_scene(dict(question, scenario_title=f"Scenario {next(counter)}"))
+
+@benchmark("render_scene[cached]")
+def bench_render_scene_cached():
+    import scene_renderer
+    question = synthetic.make_questions(1)[0]
+    return lambda: scene_renderer.render_scene(question)
+
+def _roster_benchmark(size=10000):
+    from roster import roster
+    roster.save(synthetic.make_participants(size))
+    return roster
+
+@benchmark("roster.suggest[10k, platoon]")
+def bench_roster_suggest():
+    roster = _roster_benchmark()
+    # A common surname in one platoon: the slowest case, filtering many prefix matches
+    return lambda: roster.suggest("tan", unit="1 SIR", coy="Alpha", platoon="1")
+
+@benchmark("roster.find[10k]")
+def bench_roster_find():
+    roster = _roster_benchmark()
+    entry = dict(roster.entries()[5000], **{"Telegram Handle": ""})
+    return lambda: roster.find(entry)
+
+# Allocates a dict per submission, so its timing swings with the machine's memory load
+@benchmark("roster_ids[2k submissions]", repeat=15, tolerance=0.6)
+def bench_roster_ids():
+    import pandas as pd
+    import roster
+    _roster_benchmark()
+    df = pd.DataFrame(synthetic.make_participants(2000))
+    return lambda: roster.roster_ids(df)
+
+# --- Runner ---
+
+def measure(func, min_time=0.2, repeat=5):
+    """Time func, returning per-call seconds for each repeat."""
+    # Calibrate the number of calls so one repeat takes at least min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 10 ** 6:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return timings, number
+
+def run_benchmark(name, setup, min_time, repeat):
+    workdir = tempfile.mkdtemp(prefix="quiz-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        func = setup()
+        timings, number = measure(func, min_time, repeat)
+        # Let background writers finish before the scratch directory goes away
+        if "submissions" in sys.modules:
+            sys.modules["submissions"].flush_submissions()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "calls": number * repeat,
+    }
+
+def environment():
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="pattern", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save-baseline", action="store_true", help="write results to the baseline file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with or write")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown relative to baseline before failing (0.3 = 30%%)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per repeat")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats per benchmark")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored.get("results", {})
+        if stored.get("environment") != environment():
+            print(f"note: baseline was recorded on {stored.get('environment')}; comparisons may be noisy")
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<36}{'median ms':>12}{'min ms':>12}{'base min':>12}{'change':>10}")
+    for name, setup in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        repeat = max(args.repeat, OPTIONS[name]["repeat"] or 0)
+        tolerance = max(args.tolerance, OPTIONS[name]["tolerance"] or 0)
+        result = run_benchmark(name, setup, args.min_time, repeat)
+        results[name] = result
+        base = baseline.get(name)
+        change = ""
+        if base:
+            # Compare the fastest repeat, which is far less sensitive to background noise than the median
+            ratio = result["min_ms"] / base["min_ms"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            # Ignore sub-microsecond differences, which are timer noise
+            if ratio > 1 + tolerance and result["min_ms"] - base["min_ms"] > 0.001:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<36}{result['median_ms']:>12.4f}{result['min_ms']:>12.4f}"
+              f"{(base['min_ms'] if base else float('nan')):>12.4f}{change:>10}")
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                merged = json.load(f).get("results", {})
+        else:
+            merged = {}
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"environment": environment(), "results": merged}, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+    elif regressions:
+        print(f"FAIL: {len(regressions)} benchmark(s) regressed more than their tolerance: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Multi-replica stress test for the shared data directory.
+
+Starts several replica processes on one scratch data directory. Each saves
+participant rows through the normal submission path and edits the quiz config
+with update_quiz_config() while the others do the same. Every row a replica
+saves is recorded in its ack file as soon as save_participant_data() returns.
+One replica can be killed with SIGKILL half way through (--kill); a fresh
+process then starts on the directory and replays what the dead replica left
+in its write-ahead log.
+
+Checks that:
+- every acknowledged row is in the CSV exactly once, and nothing else is
+- no config edit was lost (the shared counter matches the acknowledged edits)
+- replicas were notified of config changes made by the others
+- the shared JSONL files (attempt log, duplicate index) have no torn lines
+
+Usage:
+    python benchmarks/replica_stress.py --replicas 4 --rows 300
+    python benchmarks/replica_stress.py --replicas 4 --rows 300 --kill --json results.json
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+ANSWERS = [
+    "Stop and assess him, check if he is conscious and breathing, and call the platoon medic for help.",
+    "I would tell the commander immediately and make him rest, then get the medic to check his ankle.",
+    "Do not let him continue. Inform the conducting officer and wait for the medic with him.",
+]
+
+def prepare_workdir():
+    """Copy the config into a scratch directory."""
+    workdir = tempfile.mkdtemp(prefix="quiz-replicas-")
+    os.makedirs(os.path.join(workdir, "data", "acks"))
+    shutil.copy(os.path.join(REPO_ROOT, "data", "quiz_config.json"), os.path.join(workdir, "data"))
+    return workdir
+
+def ack_path(replica):
+    return os.path.join("data", "acks", f"{replica}.txt")
+
+def run_replica(replica, rows, config_every):
+    """Body of one replica process; runs in the scratch directory."""
+    import quiz_config
+    import shared_state
+    import utils
+    from attempt_log import flush_attempt_log, log_attempt_event
+    from submissions import flush_submissions
+
+    notifications = []
+    shared_state.on_change("config", lambda: notifications.append(time.time()))
+    utils.initialize_data_storage()
+
+    def bump(config):
+        config["stress_counter"] = config.get("stress_counter", 0) + 1
+
+    with open(ack_path(replica), "a") as acks:
+        for n in range(rows):
+            row = {
+                "UNIT": "1 SIR", "COY": "Alpha", "PLATOON": str(n % 4),
+                "Rank Name": f"PTE {replica} {n}", "Telegram Handle": f"@{replica}_{n}",
+                "Answer": f"{ANSWERS[n % len(ANSWERS)]} ({replica} {n})", "Score": 10,
+                "Strength": "", "Weakness": "", "Improvement": "", "Timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "Attempt ID": f"{replica}-{n}",
+            }
+            utils.save_participant_data(row)
+            acks.write(f"row {row['Attempt ID']}\n")
+            acks.flush()
+            log_attempt_event("submit", row["Attempt ID"], answer=row["Answer"])
+            if config_every and n % config_every == 0:
+                quiz_config.update_quiz_config(bump)
+                acks.write("config\n")
+                acks.flush()
+            shared_state.check_for_changes()
+    flush_submissions()
+    flush_attempt_log()
+    print(json.dumps({"replica": replica, "notifications": len(notifications)}))
+
+def run_recovery():
+    """A fresh replica starting on the directory replays dead replicas' WALs."""
+    from submissions import flush_submissions, submission_queue
+    replayed = submission_queue.recover()
+    flush_submissions()
+    print(json.dumps({"replayed": replayed}))
+
+def spawn(workdir, *args):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *args], cwd=workdir, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def count_lines(path, prefix):
+    try:
+        with open(path) as f:
+            return sum(1 for line in f if line.startswith(prefix))
+    except FileNotFoundError:
+        return 0
+
+def torn_lines(path):
+    """Lines of a JSONL file that don't parse."""
+    bad = 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    json.loads(line)
+                except ValueError:
+                    bad += 1
+    except FileNotFoundError:
+        pass
+    return bad
+
+def verify(workdir, replicas):
+    acked = []
+    config_acks = 0
+    for replica in replicas:
+        with open(os.path.join(workdir, ack_path(replica))) as f:
+            for line in f:
+                kind, _, value = line.strip().partition(" ")
+                if kind == "row":
+                    acked.append(value)
+                elif kind == "config":
+                    config_acks += 1
+    with open(os.path.join(workdir, "data", "participants.csv"), newline="", encoding="utf-8") as f:
+        saved = [row["Attempt ID"] for row in csv.DictReader(f)]
+    counts = {}
+    for key in saved:
+        counts[key] = counts.get(key, 0) + 1
+    with open(os.path.join(workdir, "data", "quiz_config.json")) as f:
+        counter = json.load(f).get("stress_counter", 0)
+    return {
+        "acked_rows": len(acked),
+        "saved_rows": len(saved),
+        "lost_rows": sum(1 for key in acked if key not in counts),
+        "duplicated_rows": sum(1 for n in counts.values() if n > 1),
+        # Rows the killed replica made durable but died before acknowledging
+        "unacked_saved_rows": len(set(counts) - set(acked)),
+        "config_edits_acked": config_acks,
+        "config_counter": counter,
+        "torn_attempt_log_lines": torn_lines(os.path.join(workdir, "data", "attempts.jsonl")),
+        "torn_dedup_index_lines": torn_lines(os.path.join(workdir, "data", "dedup_index.jsonl")),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=4, help="replica processes")
+    parser.add_argument("--rows", type=int, default=200, help="rows saved by each replica")
+    parser.add_argument("--config-every", type=int, default=10, help="edit the config every N rows (0 = never)")
+    parser.add_argument("--kill", action="store_true", help="SIGKILL the first replica half way through")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch data directory")
+    parser.add_argument("--replica", help=argparse.SUPPRESS)
+    parser.add_argument("--recover", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.replica:
+        run_replica(args.replica, args.rows, args.config_every)
+        return
+    if args.recover:
+        run_recovery()
+        return
+
+    workdir = prepare_workdir()
+    names = [f"replica{i}" for i in range(args.replicas)]
+    start = time.perf_counter()
+    processes = {}
+    for name in names:
+        os.environ["QUIZ_REPLICA_ID"] = name
+        processes[name] = spawn(workdir, "--replica", name, "--rows", str(args.rows),
+                                "--config-every", str(args.config_every))
+    os.environ.pop("QUIZ_REPLICA_ID", None)
+
+    killed = None
+    if args.kill:
+        victim = names[0]
+        while processes[victim].poll() is None:
+            if count_lines(os.path.join(workdir, ack_path(victim)), "row") >= args.rows // 2:
+                processes[victim].send_signal(signal.SIGKILL)
+                killed = victim
+                break
+            time.sleep(0.005)
+
+    notifications = {}
+    errors = []
+    for name, process in processes.items():
+        out, err = process.communicate()
+        if name == killed:
+            continue
+        if process.returncode != 0:
+            errors.append(f"{name} exited with {process.returncode}: {err.strip()[-500:]}")
+            continue
+        notifications[name] = json.loads(out.strip().splitlines()[-1])["notifications"]
+    elapsed = time.perf_counter() - start
+
+    recovery = spawn(workdir, "--recover")
+    out, err = recovery.communicate()
+    if recovery.returncode != 0:
+        errors.append(f"recovery exited with {recovery.returncode}: {err.strip()[-500:]}")
+        replayed = None
+    else:
+        replayed = json.loads(out.strip().splitlines()[-1])["replayed"]
+
+    results = verify(workdir, names)
+    results.update({
+        "replicas": args.replicas,
+        "rows_per_replica": args.rows,
+        "killed": killed,
+        "replayed_rows": replayed,
+        "elapsed_s": elapsed,
+        "rows_per_s": results["acked_rows"] / elapsed if elapsed else 0.0,
+        "config_notifications": notifications,
+        "errors": errors,
+    })
+    # The killed replica may have saved one config edit it never acknowledged
+    config_ok = results["config_edits_acked"] <= results["config_counter"] <= results["config_edits_acked"] + (1 if killed else 0)
+    ok = (not errors and results["lost_rows"] == 0 and results["duplicated_rows"] == 0
+          and config_ok and results["torn_attempt_log_lines"] == 0 and results["torn_dedup_index_lines"] == 0
+          and (killed or results["unacked_saved_rows"] == 0))
+
+    print(f"{args.replicas} replicas x {args.rows} rows in {elapsed:.1f}s "
+          f"({results['rows_per_s']:.0f} rows/s)" + (f", killed {killed}" if killed else ""))
+    print(f"acked {results['acked_rows']}  saved {results['saved_rows']}  lost {results['lost_rows']}  "
+          f"duplicated {results['duplicated_rows']}  replayed {replayed}")
+    print(f"config edits acked {results['config_edits_acked']}  counter {results['config_counter']}  "
+          f"notifications {notifications}")
+    print(f"torn lines: attempt log {results['torn_attempt_log_lines']}, "
+          f"dedup index {results['torn_dedup_index_lines']}")
+    for error in errors:
+        print(f"  error: {error}")
+    print("OK" if ok else "FAILED")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.keep:
+        print(f"scratch data kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Report bundle generation time on large synthetic datasets.
+
+Builds the per-unit/company report bundle for each dataset size, once in a
+single process and once with each requested worker count, and reports the
+time, throughput and bundle size of each run. Also checks that every bundle
+has one workbook per unit and company plus the summary.
+
+Usage:
+    python benchmarks/report_bench.py
+    python benchmarks/report_bench.py --rows 10000 50000 --workers 2 4 --json results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def run(rows, worker_counts, workdir):
+    import pandas as pd
+    import synthetic
+    from reports import build_report_bundle, SUMMARY_FILE
+
+    df = pd.DataFrame(synthetic.make_participants(rows))
+    expected = df.groupby(["UNIT", "COY"]).ngroups + 1
+    results = []
+    for workers in [1] + [w for w in worker_counts if w != 1]:
+        destination = os.path.join(workdir, f"bundle-{rows}-{workers}.zip")
+        stats = build_report_bundle(df, destination, workers=workers)
+        with zipfile.ZipFile(destination) as bundle:
+            names = bundle.namelist()
+        assert len(names) == expected and SUMMARY_FILE in names, names
+        stats["rows_per_second"] = rows / stats["seconds"]
+        results.append(stats)
+        print(f"{rows:>8} rows  {stats['workers']:>2} worker(s)  {stats['seconds']:7.2f}s  "
+              f"{stats['rows_per_second']:9.0f} rows/s  {stats['bytes'] / (1024 * 1024):6.1f} MB")
+        os.remove(destination)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[5000, 50000], help="dataset sizes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="worker process counts to compare with a single process")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU(s)")
+    workdir = tempfile.mkdtemp(prefix="quiz-reports-")
+    try:
+        results = [stats for rows in args.rows for stats in run(rows, args.workers, workdir)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
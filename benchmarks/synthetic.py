@@ -0,0 +1,92 @@
+"""Synthetic participant and question data for benchmarks."""
+import csv
+import random
+from datetime import datetime, timedelta
+
+UNITS = ["1 SIR", "2 SIR", "3 SIR"]
+COYS = ["Alpha", "Bravo", "Charlie"]
+PLATOONS = ["1", "2", "3", "4"]
+RANKS = ["PTE", "LCP", "CPL", "3SG", "2SG", "LTA", "2LT"]
+NAMES = ["Tan", "Lim", "Lee", "Ng", "Wong", "Goh", "Chua", "Koh", "Teo", "Ong", "Kumar", "Rahman", "Bek", "Yeo"]
+
+# Fragments real answers are built from, so keyword and similarity graders see realistic text
+ANSWER_PHRASES = [
+    "stop the route march", "call for the platoon medic", "check if he is conscious",
+    "assess his condition using AVPU", "check his breathing", "do not move him",
+    "inform the section commander", "alert the safety IC", "call for help",
+    "render first aid", "keep him hydrated", "secure the area", "help him up",
+    "activate the ambulance", "stay with the casualty", "check for bleeding",
+]
+
+COLUMNS = [
+    "UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", "Answer", "Score",
+    "Strength", "Weakness", "Improvement", "Timestamp", "Attempt ID", "Time Taken", "Late",
+    "Duplicate Of", "Duplicate Similarity", "Repeated Text",
+]
+
+def make_answer(rng, phrases=6):
+    """Build a plausible free-text answer from random phrases."""
+    chosen = rng.sample(ANSWER_PHRASES, k=min(phrases, len(ANSWER_PHRASES)))
+    return "I will " + ", ".join(chosen) + "."
+
+def make_participants(count, seed=0):
+    """Generate participant rows matching the participants.csv schema."""
+    rng = random.Random(seed)
+    start = datetime(2025, 8, 1)
+    rows = []
+    for i in range(count):
+        name = f"{rng.choice(RANKS)} {rng.choice(NAMES)} {i}"
+        rows.append({
+            "UNIT": rng.choice(UNITS),
+            "COY": rng.choice(COYS),
+            "PLATOON": rng.choice(PLATOONS),
+            "Rank Name": name,
+            "Telegram Handle": f"@user{i}",
+            "Answer": make_answer(rng, rng.randint(2, 8)),
+            "Score": rng.randint(0, 10),
+            "Strength": "Good identification of initial response steps.",
+            "Weakness": "Could be more specific on who to call and what to check.",
+            "Improvement": "Specify calling the platoon medic or section commander and checking for breathing and responsiveness.",
+            "Timestamp": (start + timedelta(minutes=i)).isoformat(),
+            "Attempt ID": f"{i:032x}",
+            "Time Taken": round(rng.uniform(10, 60), 3),
+            "Late": False,
+            "Duplicate Of": "",
+            "Duplicate Similarity": 0.0,
+            "Repeated Text": "",
+        })
+    return rows
+
+def write_participants_csv(path, count, seed=0):
+    """Write a participants CSV with count synthetic rows."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(make_participants(count, seed))
+
+def make_questions(count, seed=0, references=0):
+    """Generate question entries matching the quiz_config.json schema."""
+    rng = random.Random(seed)
+    questions = []
+    for i in range(1, count + 1):
+        question = {
+            "id": f"q{i}",
+            "scenario_title": f"Safety Scenario {i}",
+            "question_text": f"Scenario {i}: " + make_answer(rng, 5),
+            "image_enabled": True,
+            "image_prompt": "Photorealistic scene of NSF soldiers in SAF No.4 camouflage. " + make_answer(rng, 4),
+        }
+        if references:
+            question["reference_answers"] = [make_answer(rng, 8) for _ in range(references)]
+        questions.append(question)
+    return questions
+
+def make_config(question_count, seed=0, references=0, grading_backend="keyword"):
+    """Generate a full quiz configuration, optionally with reference answers per question."""
+    return {
+        "passing_score": 7,
+        "time_limit": 60,
+        "questions_per_participant": 1,
+        "grading_backend": grading_backend,
+        "questions": make_questions(question_count, seed, references),
+    }
@@ -0,0 +1,325 @@
+import base64
+import hashlib
+import json
+import operator
+import os
+import re
+import threading
+from array import array
+
+from shared_state import atomic_write, file_lock
+from tenants import TenantScoped, tenant_path
+
+# Near-duplicate detection for participant answers.
+# Each answer is reduced to a MinHash signature of its word shingles; LSH
+# buckets over signature bands find candidate matches without comparing every
+# pair of answers. The index is an append-only JSONL file next to the CSV, so
+# saves only append one line and other processes pick new lines up on read.
+
+DATA_DIR = "data"
+INDEX_PATH = os.path.join(DATA_DIR, "dedup_index.jsonl")
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Estimated Jaccard similarity at or above which two answers count as duplicates
+DUPLICATE_THRESHOLD = 0.7
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SENTENCE_RE = re.compile(r"[.!?\n]+")
+
+def words(text):
+    return _WORD_RE.findall(str(text).lower())
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Set of word n-grams; answers shorter than size words use their single words."""
+    tokens = words(text)
+    if len(tokens) < size:
+        return set(tokens)
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def minhash(text):
+    """
+    MinHash signature of the answer's shingles, or None for an empty answer.
+    One SHAKE-128 digest per shingle supplies all NUM_PERM 32-bit hash values,
+    and the slot-wise minimum across shingles is taken in C via zip/map.
+    """
+    grams = shingles(text)
+    if not grams:
+        return None
+    hashes = [array("I", hashlib.shake_128(g.encode("utf-8")).digest(4 * NUM_PERM)) for g in grams]
+    return array("I", map(min, zip(*hashes)))
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity: the fraction of matching signature slots."""
+    return sum(map(operator.eq, sig_a, sig_b)) / NUM_PERM
+
+def _band_keys(signature):
+    return [(band, tuple(signature[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+def owner_key(row):
+    """Who submitted a row: their Telegram handle, else their rank and name."""
+    owner = str(row.get("Telegram Handle") or "").strip().lower()
+    if not owner or owner == "nan":
+        owner = str(row.get("Rank Name") or "").strip().lower()
+    return owner
+
+def repeated_passages(answer, min_words=4):
+    """Sentences (of at least min_words words) that appear more than once within one answer."""
+    seen = set()
+    repeated = []
+    for sentence in _SENTENCE_RE.split(str(answer)):
+        normalized = " ".join(words(sentence))
+        if len(normalized.split()) < min_words:
+            continue
+        if normalized in seen and normalized not in repeated:
+            repeated.append(normalized)
+        seen.add(normalized)
+    return repeated
+
+class DuplicateIndex:
+    """MinHash/LSH index over stored answers, keyed by Attempt ID."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signatures = {}  # record id -> signature
+        self._owners = {}  # record id -> owner key
+        self._buckets = {}  # (band, band values) -> [record ids]
+        self._offset = 0  # bytes of the index file already loaded
+        self._inode = None  # identity of the loaded file; a rebuild replaces it
+        self._clusters_cache = None
+
+    # --- Storage ---
+
+    def _add_to_memory(self, record_id, owner, signature):
+        if record_id in self._signatures:
+            return
+        self._signatures[record_id] = signature
+        self._owners[record_id] = owner
+        for key in _band_keys(signature):
+            self._buckets.setdefault(key, []).append(record_id)
+
+    def _remove_from_memory(self, record_id):
+        signature = self._signatures.pop(record_id, None)
+        if signature is None:
+            return
+        self._owners.pop(record_id, None)
+        for key in _band_keys(signature):
+            members = self._buckets.get(key)
+            if members and record_id in members:
+                members.remove(record_id)
+                if not members:
+                    del self._buckets[key]
+
+    def _clear_memory(self):
+        self._signatures.clear()
+        self._owners.clear()
+        self._buckets.clear()
+        self._offset = 0
+
+    def _sync(self):
+        """Load lines appended to the index file since the last read (by any process)."""
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode or stat.st_size < self._offset:
+                    # Rebuilt by another process: start over
+                    self._clear_memory()
+                    self._inode = stat.st_ino
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only consume complete lines; a concurrent writer may be mid-line
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("deleted"):
+                self._remove_from_memory(entry["id"])
+                continue
+            signature = array("I", base64.b64decode(entry["sig"]))
+            self._add_to_memory(entry["id"], entry["owner"], signature)
+        self._offset += end
+
+    def _append(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        # Other replicas append to the same file
+        with file_lock(self.path):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    @staticmethod
+    def _entry(record_id, owner, signature):
+        return {"id": record_id, "owner": owner, "sig": base64.b64encode(signature.tobytes()).decode("ascii")}
+
+    # --- Updates ---
+
+    def add(self, row):
+        """Index one saved participant row. Rows with an empty answer are skipped."""
+        self.add_many([row])
+
+    def add_many(self, rows):
+        """Index several saved rows with a single append to the index file."""
+        signed = [(record_key(row), owner_key(row), minhash(row.get("Answer", ""))) for row in rows]
+        with self._lock:
+            self._sync()
+            entries = [self._entry(record_id, owner, signature) for record_id, owner, signature in signed
+                       if signature is not None and record_id not in self._signatures]
+            if entries:
+                self._append(entries)
+                self._sync()
+
+    def remove(self, row):
+        """Drop a deleted participant row from the index."""
+        record_id = record_key(row)
+        with self._lock:
+            self._sync()
+            if record_id not in self._signatures:
+                return
+            self._append([{"id": record_id, "deleted": True}])
+            self._sync()
+
+    def rebuild(self, rows):
+        """Replace the index with the given rows, e.g. when it is missing or out of step with the CSV."""
+        entries = []
+        for row in rows:
+            signature = minhash(row.get("Answer", ""))
+            if signature is not None:
+                entries.append(self._entry(record_key(row), owner_key(row), signature))
+        with self._lock:
+            with file_lock(self.path):
+                atomic_write(self.path, "".join(json.dumps(entry) + "\n" for entry in entries))
+            self._clear_memory()
+            self._sync()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._signatures)
+
+    # --- Queries ---
+
+    def find_similar(self, answer, exclude_owner=None, threshold=DUPLICATE_THRESHOLD):
+        """
+        Return [(record id, owner, similarity)] for stored answers similar to answer,
+        most similar first. Only records sharing an LSH bucket are compared.
+        """
+        return self.find_similar_many([(answer, exclude_owner)], threshold)[0]
+
+    def find_similar_many(self, queries, threshold=DUPLICATE_THRESHOLD):
+        """find_similar() for a list of (answer, exclude_owner) pairs, reading the index file once."""
+        signatures = [minhash(answer) for answer, _ in queries]
+        results = []
+        with self._lock:
+            self._sync()
+            for signature, (_, exclude_owner) in zip(signatures, queries):
+                results.append([] if signature is None else self._matches(signature, exclude_owner, threshold))
+        return results
+
+    def _matches(self, signature, exclude_owner, threshold):
+        candidates = set()
+        for key in _band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        matches = []
+        for record_id in candidates:
+            owner = self._owners[record_id]
+            if exclude_owner and owner == exclude_owner:
+                continue
+            score = similarity(signature, self._signatures[record_id])
+            if score >= threshold:
+                matches.append((record_id, owner, score))
+        return sorted(matches, key=lambda match: -match[2])
+
+    def clusters(self, threshold=DUPLICATE_THRESHOLD, min_owners=2):
+        """
+        Group records into near-duplicate clusters using the LSH buckets.
+        Only clusters spanning at least min_owners different people are returned,
+        largest first, as lists of record ids.
+        """
+        with self._lock:
+            self._sync()
+            # Recomputed only when the index file has changed
+            cache_key = (self._offset, len(self._signatures), threshold, min_owners)
+            if self._clusters_cache and self._clusters_cache[0] == cache_key:
+                return list(self._clusters_cache[1])
+            parent = {}
+
+            def find(x):
+                root = x
+                while parent.get(root, root) != root:
+                    root = parent[root]
+                parent[x] = root
+                return root
+
+            rejected = set()
+            for members in self._buckets.values():
+                if len(members) < 2:
+                    continue
+                # Compare each member with one representative per cluster seen in this bucket
+                representatives = []
+                for member in members:
+                    for representative in representatives:
+                        root_a, root_b = find(representative), find(member)
+                        if root_a == root_b:
+                            break
+                        # The same pair usually collides in several bands; compare it once
+                        pair = (representative, member)
+                        if pair in rejected:
+                            continue
+                        if similarity(self._signatures[member], self._signatures[representative]) >= threshold:
+                            parent[root_b] = root_a
+                            break
+                        rejected.add(pair)
+                    else:
+                        representatives.append(member)
+                        parent.setdefault(member, member)
+            groups = {}
+            for record_id in parent:
+                groups.setdefault(find(record_id), set()).add(record_id)
+            owners = self._owners
+            result = sorted((sorted(group) for group in groups.values()
+                             if len({owners[r] for r in group}) >= min_owners), key=len, reverse=True)
+            self._clusters_cache = (cache_key, result)
+        return list(result)
+
+def record_key(row):
+    """Attempt ID of a row, or a content hash for rows saved before attempt IDs existed."""
+    attempt_id = str(row.get("Attempt ID") or "")
+    if attempt_id and attempt_id != "nan":
+        return attempt_id
+    content = "\0".join(str(row.get(k, "")) for k in ("Rank Name", "Telegram Handle", "Timestamp", "Answer"))
+    return "row-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+# Answers are only compared with others from the same tenant
+duplicate_index = TenantScoped(lambda tenant_id: DuplicateIndex(tenant_path("dedup_index.jsonl", tenant_id=tenant_id)))
+
+def check_answer(answer, row):
+    """
+    Flags for an answer about to be saved: the closest other person's answer
+    it nearly duplicates (if any) and passages repeated within the answer.
+    """
+    return check_answers([(answer, row)])[0]
+
+def check_answers(items):
+    """check_answer() for a list of (answer, row) pairs, as used by bulk imports."""
+    found = duplicate_index.find_similar_many([(answer, owner_key(row)) for answer, row in items])
+    results = []
+    for (answer, _), matches in zip(items, found):
+        best = matches[0] if matches else None
+        results.append({
+            "duplicate_of": best[0] if best else "",
+            "similarity": round(best[2], 2) if best else 0.0,
+            "repeated": repeated_passages(answer),
+        })
+    return results
@@ -0,0 +1,489 @@
+import abc
+import hashlib
+import json
+import logging
+import math
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from question_bank import question_bank
+from tenants import TenantScoped, current_tenant, tenant_path, use_tenant
+
+log = logging.getLogger(__name__)
+
+# Grading runs fully offline. A backend turns (answer, question) pairs into
+# result dicts with Score (0-10), Strength, Weakness and Improvement.
+
+# Reference indexes kept in memory, one per set of reference answers (each tenant has its own)
+INDEX_CACHE_SIZE = 32
+
+DEFAULT_BACKEND = "keyword"
+
+# Micro-batching: requests that queue up while a batch is being graded form the
+# next batch. BATCH_WINDOW optionally waits for more; 0 adds no latency to a lone request.
+BATCH_WINDOW = 0.0
+MAX_BATCH = 64
+# Seconds to wait on the batcher before grading on the caller's own thread instead
+BATCH_TIMEOUT = 10.0
+
+# Graded results kept in memory across all sessions
+CACHE_SIZE = 10000
+
+class GradingBackend(abc.ABC):
+    """Base class for grading backends."""
+
+    name = ""
+    label = ""
+    # Backends that are expensive per call are fed through the micro-batcher
+    batched = False
+    # Bump when scoring rules change so cached results are not reused
+    version = 1
+
+    def rubric_version(self, question, config):
+        """Identifies everything besides the answer that the score depends on."""
+        return f"{self.name}:{self.version}"
+
+    @abc.abstractmethod
+    def grade_batch(self, items, config):
+        """Grade a list of (answer, question) pairs, returning one result dict per pair."""
+
+    def grade(self, answer, question=None, config=None):
+        return self.grade_batch([(answer, question)], config or {})[0]
+
+class KeywordBackend(GradingBackend):
+    """The original keyword rules: medic/help, check/assess, conscious/breathing."""
+
+    name = "keyword"
+    label = "Keyword Rules"
+
+    def grade_batch(self, items, config):
+        return [self.grade_one(answer) for answer, _ in items]
+
+    @staticmethod
+    def grade_one(answer):
+        score = 0
+        strength = "No specific strengths identified."
+        weakness = "Lacked detail on critical safety procedures."
+        improvement = "A better answer would include checking for consciousness, calling for a medic, and not moving the injured person."
+
+        if "medic" in answer.lower() or "call for help" in answer.lower():
+            score += 4
+        if "check" in answer.lower() or "assess" in answer.lower():
+            score += 3
+        if "conscious" in answer.lower() or "breathing" in answer.lower():
+            score += 3
+
+        if score >= 7:
+            strength = "Good identification of initial response steps."
+            weakness = "Could be more specific on who to call and what to check."
+        if score >= 4:
+            improvement = "Specify calling the platoon medic or section commander and checking for breathing and responsiveness."
+
+        return {
+            "Score": score,
+            "Strength": strength,
+            "Weakness": weakness,
+            "Improvement": improvement
+        }
+
+# --- TF-IDF similarity ---
+
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been before being but by can case could do does down ensure first for
+from get had has have he her him his how i if in into is it its just let make me my need needed of off on or other
+our out own quickly she should so sure tell than that the their them then there these they this to up us was we
+were what whether when where which while who will with would you your
+""".split())
+
+# Words that negate the rest of their clause ("do not move him" -> not_move)
+NEGATORS = frozenset(["not", "no", "never", "don", "doesn", "didn", "cannot", "avoid"])
+
+_CLAUSE_RE = re.compile(r"[.,;:!?\n]+")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SUFFIXES = ("ing", "ed", "ly", "es", "s")
+
+def tokenize(text):
+    """
+    Lowercase word stems with stopwords removed, as (stem, surface word) pairs.
+    Words after a negator in the same clause are prefixed with "not_", so
+    "do not move him" never matches an answer that says "move him".
+    """
+    tokens = []
+    for clause in _CLAUSE_RE.split(text.lower()):
+        negated = False
+        for word in _TOKEN_RE.findall(clause):
+            if word in NEGATORS:
+                negated = True
+                continue
+            if word in STOPWORDS or len(word) < 2:
+                continue
+            stem = word
+            for suffix in _SUFFIXES:
+                if stem.endswith(suffix) and len(stem) - len(suffix) >= 3:
+                    stem = stem[:-len(suffix)]
+                    break
+            if negated:
+                tokens.append(("not_" + stem, "not " + word))
+            else:
+                tokens.append((stem, word))
+    return tokens
+
+def _vector(stems, idf):
+    """Sublinear TF-IDF vector, L2-normalised, as a {stem: weight} dict."""
+    counts = Counter(stems)
+    vector = {t: (1 + math.log(n)) * idf.get(t, idf.get("", 1.0)) for t, n in counts.items()}
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    return {t: w / norm for t, w in vector.items()} if norm else {}
+
+def _questions(config):
+    """The config's own question list if it has one, else every question in the question bank."""
+    if "questions" in config:
+        return config["questions"]
+    return question_bank.all()
+
+def references_fingerprint(config):
+    """Hash of every question's reference answers; changes whenever they are edited."""
+    if "questions" not in config:
+        # The bank tracks a hash of each question's references in its manifest
+        return question_bank.references_fingerprint()
+    digest = hashlib.sha256()
+    for question in config.get("questions", []):
+        digest.update(question.get("id", "").encode("utf-8") + b"\0")
+        for reference in question.get("reference_answers", []):
+            digest.update(reference.encode("utf-8") + b"\1")
+        digest.update(b"\2")
+    return digest.hexdigest()[:16]
+
+def build_reference_index(config):
+    """
+    Precompute IDF weights and reference-answer vectors for every question.
+    The corpus is all reference answers across the quiz, so words every answer
+    uses (e.g. "soldier") carry little weight.
+    """
+    documents = []
+    for question in _questions(config):
+        for reference in question.get("reference_answers", []):
+            if reference and reference.strip():
+                documents.append((question.get("id", ""), tokenize(reference)))
+
+    df = Counter()
+    surface = {}
+    for _, tokens in documents:
+        df.update({stem for stem, _ in tokens})
+        for stem, word in tokens:
+            surface.setdefault(stem, word)
+    n = len(documents)
+    idf = {t: math.log((1 + n) / (1 + d)) + 1 for t, d in df.items()}
+    # Words never seen in a reference get the maximum weight
+    idf[""] = math.log(1 + n) + 1
+
+    references = {}
+    for question_id, tokens in documents:
+        references.setdefault(question_id, []).append(_vector([stem for stem, _ in tokens], idf))
+
+    return {
+        "fingerprint": references_fingerprint(config),
+        "idf": idf,
+        "surface": surface,
+        "references": references,
+    }
+
+_index_lock = threading.Lock()
+_index_cache = OrderedDict()  # fingerprint -> reference index
+
+def _reference_index_path():
+    return tenant_path("grading", "reference_index.json")
+
+def _cache_index(index):
+    with _index_lock:
+        _index_cache[index["fingerprint"]] = index
+        _index_cache.move_to_end(index["fingerprint"])
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+def prepare_references(config, path=None):
+    """Build the reference index for a saved config and write it next to the tenant's data files."""
+    path = path or _reference_index_path()
+    index = build_reference_index(config)
+    _cache_index(index)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.error("Error writing reference index: %s", e)
+    return index
+
+def get_reference_index(config, path=None):
+    """Return the reference index for config from memory, then disk, building it only if both are stale."""
+    path = path or _reference_index_path()
+    fingerprint = references_fingerprint(config)
+    with _index_lock:
+        index = _index_cache.get(fingerprint)
+    if index is not None:
+        return index
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        if stored.get("fingerprint") == fingerprint:
+            _cache_index(stored)
+            return stored
+    except (OSError, ValueError):
+        pass
+    return prepare_references(config, path)
+
+class TfidfBackend(GradingBackend):
+    """
+    Scores an answer by its cosine similarity to the question's reference answers.
+    Questions without reference answers fall back to the keyword rules.
+    """
+
+    name = "tfidf"
+    label = "Similarity to Reference Answers (TF-IDF)"
+    batched = True
+
+    # Similarity at which an answer earns full marks; paraphrases rarely exceed ~0.6
+    FULL_MARKS_SIMILARITY = 0.6
+    FEEDBACK_TERMS = 4
+
+    def rubric_version(self, question, config):
+        # IDF weights come from every question's references, so any edit changes the rubric
+        return f"{self.name}:{self.version}:{references_fingerprint(config)}"
+
+    def grade_batch(self, items, config):
+        index = get_reference_index(config)
+        return [self.grade_one(answer, question, index) for answer, question in items]
+
+    def grade_one(self, answer, question, index):
+        references = index["references"].get((question or {}).get("id", ""))
+        if not references:
+            return KeywordBackend.grade_one(answer)
+
+        stems = [stem for stem, _ in tokenize(answer)]
+        vector = _vector(stems, index["idf"])
+        best, best_similarity = references[0], -1.0
+        for reference in references:
+            similarity = sum(w * reference.get(t, 0.0) for t, w in vector.items())
+            if similarity > best_similarity:
+                best, best_similarity = reference, similarity
+        score = max(0, min(10, round(10 * best_similarity / self.FULL_MARKS_SIMILARITY)))
+
+        # Feedback from the most important words of the closest reference answer;
+        # negated phrases read badly out of context, so they only count towards the score
+        key_terms = [t for t in sorted(best, key=best.get, reverse=True) if not t.startswith("not_")]
+        present = set(stems)
+        covered = [index["surface"].get(t, t) for t in key_terms if t in present][:self.FEEDBACK_TERMS]
+        missing = [index["surface"].get(t, t) for t in key_terms if t not in present][:self.FEEDBACK_TERMS]
+
+        strength = (f"Covered key points: {', '.join(covered)}." if covered
+                    else "No specific strengths identified.")
+        weakness = (f"Missed key points: {', '.join(missing)}." if missing
+                    else "Could be more specific on who to call and what to check.")
+        improvement = (f"A stronger answer would also mention: {', '.join(missing)}." if missing
+                       else "Keep answers specific: who you call, what you check, and what you avoid doing.")
+        return {
+            "Score": score,
+            "Strength": strength,
+            "Weakness": weakness,
+            "Improvement": improvement
+        }
+
+BACKENDS = {backend.name: backend() for backend in (KeywordBackend, TfidfBackend)}
+
+def get_backend(name):
+    """Return the named backend, or the keyword backend for unknown names."""
+    return BACKENDS.get(name) or BACKENDS[DEFAULT_BACKEND]
+
+# --- Micro-batching ---
+
+class MicroBatcher:
+    """
+    Groups grading requests from concurrent sessions into batches.
+    Each Streamlit session grades on its own thread; requests that arrive while
+    the worker thread is busy are graded together in its next batch, so
+    per-batch work (index lookup, model calls) is shared under a quiz drop.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, backend, answer, question, config):
+        """Queue an answer for grading and return a Future for its result."""
+        future = Future()
+        self._ensure_started()
+        # Grouping key, computed here while the caller's tenant is current
+        group = (backend.name, current_tenant(), references_fingerprint(config))
+        self._queue.put((backend, answer, question, config, future, group))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="grading-batcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Requests for the same backend, tenant and reference answers are graded in one call
+            groups = {}
+            for request in batch:
+                if not request[4].set_running_or_notify_cancel():
+                    continue  # the caller gave up waiting and graded it itself
+                groups.setdefault(request[5], []).append(request)
+            for (_, tenant_id, _), requests in groups.items():
+                backend, config = requests[0][0], requests[0][3]
+                try:
+                    with use_tenant(tenant_id):
+                        results = backend.grade_batch([(r[1], r[2]) for r in requests], config)
+                    for request, result in zip(requests, results):
+                        request[4].set_result(result)
+                except Exception as e:
+                    for request in requests:
+                        request[4].set_exception(e)
+
+_batcher = MicroBatcher()
+
+# --- Result cache ---
+
+def normalize_answer(answer):
+    """
+    Case and whitespace differences never change a grade, so they are folded away.
+    Line breaks are kept (blank lines aside): tokenize() ends a clause at each one.
+    """
+    lines = (" ".join(line.split()) for line in answer.lower().split("\n"))
+    return "\n".join(line for line in lines if line)
+
+class GradingCache:
+    """
+    LRU cache of graded results keyed by (question ID, rubric version, answer hash).
+    Shared by every session in the process, so a resubmitted or duplicated
+    answer is graded once.
+    """
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        # max_entries of 0 disables caching
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(answer, question, rubric):
+        digest = hashlib.sha256(normalize_answer(answer).encode("utf-8")).hexdigest()
+        return ((question or {}).get("id", ""), rubric, digest)
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(result)
+
+    def put(self, key, result):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Question IDs are only unique within a tenant, and one tenant's load shouldn't evict another's grades
+grading_cache = TenantScoped(lambda tenant_id: GradingCache())
+
+def grade(answer, question=None, config=None):
+    """
+    Grade an answer with the backend selected in config ("grading_backend").
+    Without a config the keyword rules are used. Results are cached per
+    question, rubric version and normalized answer.
+    """
+    config = config or {}
+    backend = get_backend(config.get("grading_backend", DEFAULT_BACKEND))
+    cache = grading_cache.for_tenant(current_tenant())
+    key = None
+    if cache.max_entries > 0:
+        key = GradingCache.key(answer, question, backend.rubric_version(question, config))
+        result = cache.get(key)
+        if result is not None:
+            return result
+    if backend.batched:
+        future = _batcher.submit(backend, answer, question, config)
+        try:
+            result = future.result(timeout=BATCH_TIMEOUT)
+        except FutureTimeout:
+            # The batcher is stuck or far behind: don't leave the participant waiting on it
+            future.cancel()
+            result = backend.grade(answer, question, config)
+    else:
+        result = backend.grade(answer, question, config)
+    if key is not None:
+        cache.put(key, result)
+    return dict(result)
+
+def grade_many(items, config=None):
+    """
+    Grade a list of (answer, question) pairs in one backend call, for bulk imports.
+    Cached results are reused and new ones cached, exactly as grade() does.
+    """
+    config = config or {}
+    backend = get_backend(config.get("grading_backend", DEFAULT_BACKEND))
+    cache = grading_cache.for_tenant(current_tenant())
+    results = [None] * len(items)
+    keys = [None] * len(items)
+    misses = []
+    for i, (answer, question) in enumerate(items):
+        if cache.max_entries > 0:
+            keys[i] = GradingCache.key(answer, question, backend.rubric_version(question, config))
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            misses.append(i)
+    if misses:
+        graded = backend.grade_batch([items[i] for i in misses], config)
+        for i, result in zip(misses, graded):
+            if keys[i] is not None:
+                cache.put(keys[i], result)
+            results[i] = dict(result)
+    return results
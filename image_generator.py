@@ -7,19 +7,128 @@ import time
 import base64
 import urllib.parse
 import os
+import logging
+import hashlib
+from perf import timed, metrics, maybe_export_metrics
+from shared_state import atomic_write, file_lock
+from prompts import LLMClient, StubLLMClient, enhance_image_prompt
+from scene_renderer import PROCEDURAL_MODEL, render_scene
 
-# Try importing the new Google GenAI library
-try:
-    from google import genai
-    NEW_GENAI = True
-except ImportError:
-    NEW_GENAI = False
-    # Fallback to old library
+log = logging.getLogger(__name__)
+
+# The Google GenAI SDK is slow to import, so it is only loaded the first
+# time "Gemini Enhanced" is used (see load_genai)
+genai = None
+NEW_GENAI = False
+_genai_loaded = False
+
+def load_genai():
+    """Import the Google GenAI library on first use, returning None if unavailable."""
+    global genai, NEW_GENAI, _genai_loaded
+    if _genai_loaded:
+        return genai
+    _genai_loaded = True
+    # Try importing the new Google GenAI library
     try:
-        import google.generativeai as genai
-        NEW_GENAI = False
+        from google import genai as new_genai
+        genai = new_genai
+        NEW_GENAI = True
     except ImportError:
-        genai = None
+        NEW_GENAI = False
+        # Fallback to old library
+        try:
+            import google.generativeai as old_genai
+            genai = old_genai
+        except ImportError:
+            genai = None
+    return genai
+
+# --- Backend metrics ---
+# Every call to an external image/prompt backend is recorded so timeouts and
+# model order can be tuned from real latency and failure numbers.
+
+POLLINATIONS_URL = "https://image.pollinations.ai/prompt/"
+
+BACKEND_LATENCY = "image_backend_request_seconds"
+BACKEND_REQUESTS = "image_backend_requests_total"
+BACKEND_TIMEOUTS = "image_backend_timeouts_total"
+BACKEND_BYTES = "image_backend_bytes_total"
+BACKEND_FALLBACKS = "image_backend_fallbacks_total"
+
+metrics.describe(BACKEND_LATENCY, "Latency of requests to external image and prompt backends.")
+metrics.describe(BACKEND_REQUESTS, "Requests to external backends by HTTP status, 'timeout' or 'error'.")
+metrics.describe(BACKEND_TIMEOUTS, "Requests to external backends that timed out.")
+metrics.describe(BACKEND_BYTES, "Bytes downloaded from external backends.")
+metrics.describe(BACKEND_FALLBACKS, "Times generation fell back from one stage to the next.")
+
+def record_backend_call(backend, model, status, seconds, size=0):
+    """Record one backend request. status is the HTTP status code, 'ok', 'timeout' or 'error'."""
+    metrics.observe(BACKEND_LATENCY, seconds, backend=backend, model=model)
+    metrics.inc(BACKEND_REQUESTS, backend=backend, model=model, status=str(status))
+    if status == "timeout":
+        metrics.inc(BACKEND_TIMEOUTS, backend=backend, model=model)
+    if size:
+        metrics.inc(BACKEND_BYTES, size, backend=backend, model=model)
+    maybe_export_metrics()
+
+def record_fallback(model, source, target):
+    """Record generation moving on from a failed stage (e.g. gemini -> pollinations)."""
+    metrics.inc(BACKEND_FALLBACKS, model=model, source=source, target=target)
+    maybe_export_metrics()
+
+def fetch_pollinations_image(prompt, model, timeout):
+    """Request an image for prompt from Pollinations, recording latency, status and size."""
+    url = f"{POLLINATIONS_URL}{urllib.parse.quote(prompt)}?width=800&height=400&seed={int(time.time())}"
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, timeout=timeout, headers={'User-Agent': 'Mozilla/5.0'})
+    except requests.exceptions.Timeout:
+        record_backend_call("pollinations", model, "timeout", time.perf_counter() - start)
+        raise
+    except Exception:
+        record_backend_call("pollinations", model, "error", time.perf_counter() - start)
+        raise
+    record_backend_call("pollinations", model, response.status_code, time.perf_counter() - start,
+                        len(response.content or b""))
+    return response
+
+def image_backend_summary():
+    """Per backend/model request counts, success rate, latency and download figures for display."""
+    rows = {}
+    for _, labels, histogram in metrics.histograms(BACKEND_LATENCY):
+        rows[(labels["backend"], labels["model"])] = {
+            "Backend": labels["backend"],
+            "Model": labels["model"],
+            "Requests": histogram.count,
+            "OK": 0,
+            "Timeouts": 0,
+            "Errors": 0,
+            "p50 (s)": round(histogram.quantile(0.5), 2),
+            "p95 (s)": round(histogram.quantile(0.95), 2),
+            "Mean (s)": round(histogram.sum / histogram.count, 2) if histogram.count else 0.0,
+            "MB": 0.0,
+        }
+    for _, labels, value in metrics.counters(BACKEND_REQUESTS):
+        row = rows.get((labels["backend"], labels["model"]))
+        if row is None:
+            continue
+        status = labels["status"]
+        if status in ("200", "ok"):
+            row["OK"] += value
+        elif status == "timeout":
+            row["Timeouts"] += value
+        else:
+            row["Errors"] += value
+    for _, labels, value in metrics.counters(BACKEND_BYTES):
+        row = rows.get((labels["backend"], labels["model"]))
+        if row is not None:
+            row["MB"] = round(value / (1024 * 1024), 2)
+    return list(rows.values())
+
+def image_fallback_summary():
+    """Fallback counts as rows of model, source stage, target stage and count."""
+    return [{"Model": labels["model"], "From": labels["source"], "To": labels["target"], "Count": value}
+            for _, labels, value in metrics.counters(BACKEND_FALLBACKS)]
 
 def generate_realistic_fallback():
     """
@@ -68,28 +177,27 @@ def generate_realistic_fallback():
         if selected_model == "Flux (Realistic)":
             # Add style hints for realistic output
             styled_prompt = f"{realistic_prompt}, ultra realistic, photorealistic, high quality photography"
-            models = [("default", styled_prompt)]
+            models = [("styled", styled_prompt)]
         elif selected_model == "Turbo (Fast)":
             # Use simpler prompt for faster generation
-            models = [("default", realistic_prompt)]
+            models = [("plain", realistic_prompt)]
         elif selected_model == "Simplified":
             # Use very simple prompt
             simple = "Two soldiers military training one injured helping Singapore modern uniforms"
-            models = [("default", simple)]
+            models = [("simple", simple)]
         else:  # Auto (Best)
             # Try different style variations
             styled_prompt = f"{realistic_prompt}, ultra realistic, photorealistic, high quality photography"
-            models = [("default", styled_prompt), ("default", realistic_prompt)]
+            models = [("styled", styled_prompt), ("plain", realistic_prompt)]
         
-        for model_name, prompt_to_use in models:
+        previous_variant = None
+        for variant, prompt_to_use in models:
+            if previous_variant:
+                record_fallback(selected_model, previous_variant, variant)
+            previous_variant = variant
             try:
-                # Encode the specific prompt for this attempt
-                encoded_prompt_specific = urllib.parse.quote(prompt_to_use)
-                # Pollinations.ai doesn't use model parameter in the same way - remove it
-                image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt_specific}?width=800&height=400&seed={int(time.time())}"
-                
-                # No nested spinner - just make the request
-                response = requests.get(image_url, timeout=60, headers={'User-Agent': 'Mozilla/5.0'})
+                # Pollinations.ai doesn't use a model parameter in the same way, so variants differ by prompt only
+                response = fetch_pollinations_image(prompt_to_use, f"{selected_model}/{variant}", timeout=60)
                     
                 if response.status_code == 200:
                     # Verify we got an image
@@ -127,11 +235,10 @@ def generate_realistic_fallback():
         
         # Last resort - use a very simple prompt
         simple_prompt = "Two soldiers military training one injured helping Singapore"
-        encoded_simple = urllib.parse.quote(simple_prompt)
-        simple_url = f"https://image.pollinations.ai/prompt/{encoded_simple}?width=800&height=400&seed={int(time.time())}"
+        record_fallback(selected_model, previous_variant or "none", "last-resort")
         
         try:
-            response = requests.get(simple_url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'})
+            response = fetch_pollinations_image(simple_prompt, "last-resort", timeout=30)
             if response.status_code == 200:
                 img = Image.open(BytesIO(response.content))
                 img_with_text = add_model_attribution(img, "AI Generated (Fallback)")
@@ -270,29 +377,80 @@ def add_model_attribution(img, model_name):
         print(f"Error adding attribution: {e}")
         return img
 
-def generate_safety_scenario_image():
+class GeminiClient(LLMClient):
+    """Gemini text model behind the "Gemini Enhanced" option, with calls recorded as backend metrics."""
+
+    model = "gemini-pro"
+
+    def __init__(self, api_key):
+        import google.generativeai as old_genai
+        old_genai.configure(api_key=api_key)
+        self._model = old_genai.GenerativeModel(self.model)
+
+    def generate(self, prompt):
+        start = time.perf_counter()
+        try:
+            response = self._model.generate_content(prompt)
+        except Exception:
+            record_backend_call("gemini", self.model, "error", time.perf_counter() - start)
+            raise
+        record_backend_call("gemini", self.model, "ok", time.perf_counter() - start)
+        return response.text
+
+_llm_client = None
+
+def set_llm_client(client):
+    """Use client for prompt enhancement instead of Gemini (e.g. a StubLLMClient in tests); None resets."""
+    global _llm_client
+    _llm_client = client
+
+def get_llm_client():
+    """
+    The client for "Gemini Enhanced": one set with set_llm_client(), a stub when
+    QUIZ_LLM_CLIENT=stub, else Gemini if an API key and the library are available.
+    """
+    if _llm_client is not None:
+        return _llm_client
+    if os.environ.get("QUIZ_LLM_CLIENT") == "stub":
+        return StubLLMClient()
+    try:
+        google_api_key = st.secrets.get("GOOGLE_API_KEY", "")
+    except Exception:
+        return None
+    if not google_api_key or not load_genai() or NEW_GENAI:
+        return None
+    try:
+        return GeminiClient(google_api_key)
+    except Exception as e:
+        st.warning(f"Gemini enhancement failed: {e}. Using standard generation.")
+        return None
+
+def generate_safety_scenario_image(question=None):
     """
     Generate image based on selected model.
+    The offline scene renderer draws the given question's scene without any network call.
     """
     
     # Get selected model
     selected_model = st.session_state.get('selected_image_model', 'Auto (Best)')
     
+    if selected_model == PROCEDURAL_MODEL:
+        if 'current_gen_prompt' in st.session_state:
+            del st.session_state.current_gen_prompt
+        return render_scene(question)
+    
     # Import quiz_config here to avoid circular imports
-    from quiz_config import load_quiz_config
+    from quiz_config import list_questions, get_question_by_id
     
     # Check if there's a specific prompt in session state (for multi-question support)
     if 'current_gen_prompt' in st.session_state:
         image_prompt = st.session_state.current_gen_prompt
         # Don't delete here - let generate_realistic_fallback handle it
     else:
-        # Load prompt from configuration, with detailed fallback
-        config = load_quiz_config()
-        # For backward compatibility, check if using old format
-        if "questions" in config and len(config["questions"]) > 0:
-            image_prompt = config["questions"][0].get("image_prompt", "")
-        else:
-            image_prompt = config.get("image_prompt", "")
+        # Load prompt from the first question, with detailed fallback
+        questions = list_questions()
+        first = get_question_by_id(questions[0]["id"]) if questions else None
+        image_prompt = (first or {}).get("image_prompt", "")
     
     # If no prompt is configured or it's empty, use the detailed default
     if not image_prompt or image_prompt.strip() == "":
@@ -324,57 +482,79 @@ def generate_safety_scenario_image():
     
     # Handle Gemini Enhanced option
     if selected_model == "Gemini Enhanced":
-        try:
-            google_api_key = st.secrets.get("GOOGLE_API_KEY", "")
-            if google_api_key and google_api_key != "":
-                # Use Gemini to enhance the prompt
-                if genai:
-                    try:
-                        if not NEW_GENAI:
-                            # Use old library
-                            import google.generativeai as old_genai
-                            old_genai.configure(api_key=google_api_key)
-                            model = old_genai.GenerativeModel('gemini-pro')
-                            
-                            enhancement_prompt = f"""
-                            Enhance this prompt for maximum photorealism in AI image generation:
-                            {image_prompt}
-                            
-                            Add specific details about lighting, textures, camera settings.
-                            Output only the enhanced prompt (150 words max).
-                            """
-                            
-                            response = model.generate_content(enhancement_prompt)
-                            enhanced_prompt = response.text.strip()[:500]
-                            
-                            # Generate with enhanced prompt
-                            encoded = urllib.parse.quote(enhanced_prompt)
-                            # Don't specify model parameter - use Pollinations default
-                            url = f"https://image.pollinations.ai/prompt/{encoded}?width=800&height=400&seed={int(time.time())}"
-                            
-                            resp = requests.get(url, timeout=60, headers={'User-Agent': 'Mozilla/5.0'})
-                            if resp.status_code == 200:
-                                img = Image.open(BytesIO(resp.content))
-                                # Clean up the prompt from session state after successful generation
-                                if 'current_gen_prompt' in st.session_state:
-                                    del st.session_state.current_gen_prompt
-                                return add_model_attribution(img, "Gemini Enhanced")
-                    except Exception as e:
-                        st.warning(f"Gemini enhancement failed: {e}. Using standard generation.")
-        except:
-            pass
+        client = get_llm_client()
+        if client is not None:
+            try:
+                # The rewrite of a given prompt is memoized, so only its first use calls the model
+                enhanced_prompt = enhance_image_prompt(image_prompt, client)
+                
+                # Generate with enhanced prompt (Pollinations default model)
+                resp = fetch_pollinations_image(enhanced_prompt, "Gemini Enhanced", timeout=60)
+                if resp.status_code == 200:
+                    img = Image.open(BytesIO(resp.content))
+                    # Clean up the prompt from session state after successful generation
+                    if 'current_gen_prompt' in st.session_state:
+                        del st.session_state.current_gen_prompt
+                    return add_model_attribution(img, "Gemini Enhanced")
+            except Exception as e:
+                st.warning(f"Gemini enhancement failed: {e}. Using standard generation.")
+        record_fallback(selected_model, "gemini", "pollinations")
     
     # For all other options, use the standard fallback
     return generate_realistic_fallback()
 
-def get_cached_scenario_image():
+# Generated images shared by every replica and session, keyed by prompt and model
+IMAGE_CACHE_DIR = os.path.join("data", "image_cache")
+
+def _shared_image_path():
+    """Cache file for the image the current session would generate."""
+    prompt = st.session_state.get('current_gen_prompt', "")
+    model = st.session_state.get('selected_image_model', 'Auto (Best)')
+    key = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(IMAGE_CACHE_DIR, f"{key}.png")
+
+def _read_shared_image(path):
+    try:
+        with Image.open(path) as img:
+            img.load()
+            return img
+    except (FileNotFoundError, OSError):
+        return None
+
+@timed()
+def get_cached_scenario_image(question=None):
     """
     Get or generate the scenario image with caching to avoid repeated API calls.
+    Images are shared through IMAGE_CACHE_DIR, and the lock on the cache file means
+    only one replica generates a given prompt while the others wait and reuse it.
+    Offline scenes render in milliseconds, so they skip the shared cache.
     """
-    if 'scenario_image' not in st.session_state:
-        with st.spinner("Generating scenario visualization..."):
-            image = generate_safety_scenario_image()
-            if image:
-                st.session_state.scenario_image = image
+    if 'scenario_image' not in st.session_state and \
+            st.session_state.get('selected_image_model') == PROCEDURAL_MODEL:
+        st.session_state.pop('regenerate_image', None)
+        st.session_state.scenario_image = generate_safety_scenario_image(question)
+    elif 'scenario_image' not in st.session_state:
+        # Regenerate asks for a fresh image rather than the shared one
+        refresh = st.session_state.pop('regenerate_image', False)
+        cache_path = _shared_image_path()
+        with file_lock(cache_path):
+            image = None if refresh else _read_shared_image(cache_path)
+            if image is None:
+                with st.spinner("Generating scenario visualization..."):
+                    image = generate_safety_scenario_image(question)
+                if image is not None:
+                    try:
+                        buffer = BytesIO()
+                        image.save(buffer, "PNG")
+                        atomic_write(cache_path, buffer.getvalue())
+                    except Exception as e:
+                        log.error("Error caching generated image: %s", e)
+        if image is None:
+            # Participants still get a picture of their scenario when every backend is down
+            record_fallback(st.session_state.get('selected_image_model', 'Auto (Best)'),
+                            "pollinations", "procedural")
+            image = render_scene(question)
+        if image:
+            st.session_state.scenario_image = image
     
-    return st.session_state.get('scenario_image', None)
\ No newline at end of file
+    return st.session_state.get('scenario_image', None)
@@ -0,0 +1,353 @@
+"""
+Bulk import of quiz answers collected offline (on paper or a device without
+the app), instead of re-keying them one at a time through the quiz.
+
+Each record gives the participant's details, the question ID and their answer,
+as NDJSON (one JSON object per line) or CSV with a header row:
+
+    UNIT, COY, PLATOON, Rank Name, Telegram Handle, Question ID, Answer[, Timestamp]
+
+Column names are matched ignoring case, spaces and underscores. Every batch is
+validated, graded in one call, and its rows are saved together: a crash saves
+all of them or none. Malformed rows are rejected with a reason and the rest of
+the batch goes ahead. As in the quiz, only passing answers are saved unless
+--save-failed is given.
+
+Usage:
+    python ingest.py load answers.csv --tenant 3sir
+    python ingest.py load platoon1.ndjson platoon2.ndjson --batch-size 200 --json report.json
+    python ingest.py serve --port 8600
+
+The server takes POST /ingest?tenant=<id>[&save_failed=1] with a
+Content-Type of application/x-ndjson or text/csv, and returns the batch
+report as JSON. Set QUIZ_INGEST_TOKEN to require "Authorization: Bearer <token>".
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from perf import metrics
+from tenants import COYS, PLATOONS, DEFAULT_TENANT, current_tenant, resolve_tenant, tenant_units, use_tenant
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PORT = 8600
+# Largest request body the server accepts
+MAX_BODY_BYTES = 20 * 1024 * 1024
+MAX_ANSWER_CHARS = 5000
+
+FIELDS = ["UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", "Question ID", "Answer", "Timestamp"]
+REQUIRED = ["UNIT", "COY", "PLATOON", "Rank Name", "Question ID", "Answer"]
+
+INGEST_SECONDS = "quiz_ingest_batch_seconds"
+INGEST_ROWS = "quiz_ingest_rows_total"
+metrics.describe(INGEST_SECONDS, "Time to validate, grade and save one ingested batch")
+metrics.describe(INGEST_ROWS, "Ingested rows by outcome (saved, failed, rejected)")
+
+def _field_key(name):
+    return "".join(ch for ch in str(name).lower() if ch.isalnum())
+
+_FIELD_NAMES = {_field_key(field): field for field in FIELDS}
+
+# --- Parsing ---
+
+def detect_format(name="", content_type=""):
+    """"csv" or "ndjson", from a file name or a Content-Type header."""
+    if "csv" in (content_type or "").lower() or str(name).lower().endswith(".csv"):
+        return "csv"
+    return "ndjson"
+
+def parse_records(text, fmt):
+    """
+    [(line number, record dict or None, error or None)] for each non-blank record.
+    Records are returned with FIELDS as keys; unknown columns are dropped.
+    """
+    parsed = []
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        for raw in reader:
+            if not any((value or "").strip() for value in raw.values() if isinstance(value, str)):
+                continue
+            parsed.append((reader.line_num, _canonical(raw), None))
+        return parsed
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError:
+            parsed.append((line_number, None, "not valid JSON"))
+            continue
+        if not isinstance(raw, dict):
+            parsed.append((line_number, None, "expected a JSON object"))
+            continue
+        parsed.append((line_number, _canonical(raw), None))
+    return parsed
+
+def _canonical(raw):
+    record = {}
+    for name, value in raw.items():
+        field = _FIELD_NAMES.get(_field_key(name))
+        if field and value is not None:
+            record[field] = str(value).strip()
+    return record
+
+# --- Validation ---
+
+def validate(record, units, questions):
+    """The participant row and question for a record. Raises ValueError with the reason it is rejected."""
+    missing = [field for field in REQUIRED if not record.get(field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if record["UNIT"] not in units:
+        raise ValueError(f"unknown UNIT {record['UNIT']!r}")
+    if record["COY"] not in COYS:
+        raise ValueError(f"unknown COY {record['COY']!r}")
+    if record["PLATOON"] not in PLATOONS:
+        raise ValueError(f"unknown PLATOON {record['PLATOON']!r}")
+    question = questions.get(record["Question ID"])
+    if question is None:
+        raise ValueError(f"unknown Question ID {record['Question ID']!r}")
+    if len(record["Answer"]) > MAX_ANSWER_CHARS:
+        raise ValueError(f"answer longer than {MAX_ANSWER_CHARS} characters")
+    timestamp = record.get("Timestamp")
+    if timestamp:
+        try:
+            timestamp = datetime.fromisoformat(timestamp).isoformat()
+        except ValueError:
+            raise ValueError(f"Timestamp {timestamp!r} is not an ISO date and time")
+    row = {field: record.get(field, "") for field in ("UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle")}
+    row["Answer"] = record["Answer"]
+    row["Timestamp"] = timestamp or datetime.now().isoformat()
+    return row, question
+
+# --- Ingestion ---
+
+def ingest_batch(records, save_failed=False):
+    """
+    Validate, grade and save one batch of parsed records for the current tenant.
+    Returns a report: counts, per-row results, rejected rows with reasons, and throughput.
+    """
+    import grading
+    from attempt_log import new_attempt_id
+    from dedup import check_answers
+    from quiz_config import get_question_by_id, list_questions, load_quiz_config
+    from roster import link_roster
+    from submissions import submission_queue
+    from utils import initialize_data_storage
+
+    start = time.perf_counter()
+    initialize_data_storage()
+    config = load_quiz_config()
+    passing_score = config.get("passing_score", 9)
+    units = set(tenant_units())
+    question_ids = {summary["id"] for summary in list_questions()}
+    questions = {}
+    for _, record, _ in records:
+        question_id = (record or {}).get("Question ID")
+        if question_id in question_ids and question_id not in questions:
+            questions[question_id] = get_question_by_id(question_id)
+
+    accepted, rejected = [], []
+    for line_number, record, error in records:
+        if error is None:
+            try:
+                row, question = validate(record, units, questions)
+                link_roster(row)
+                accepted.append((line_number, row, question))
+                continue
+            except ValueError as e:
+                error = str(e)
+        rejected.append({"line": line_number, "error": error})
+
+    grades = grading.grade_many([(row["Answer"], question) for _, row, question in accepted], config)
+    duplicates = check_answers([(row["Answer"], row) for _, row, _ in accepted])
+
+    to_save, results = [], []
+    for (line_number, row, question), result, duplicate in zip(accepted, grades, duplicates):
+        passed = result["Score"] >= passing_score
+        row.update(result)
+        row.update({
+            "Attempt ID": new_attempt_id(),
+            "Time Taken": None,
+            "Late": False,
+            "Duplicate Of": duplicate["duplicate_of"],
+            "Duplicate Similarity": duplicate["similarity"],
+            "Repeated Text": " | ".join(duplicate["repeated"]),
+        })
+        saved = passed or save_failed
+        if saved:
+            to_save.append(row)
+        results.append({
+            "line": line_number,
+            "question_id": question.get("id"),
+            "score": result["Score"],
+            "passed": passed,
+            "saved": saved,
+            "attempt_id": row["Attempt ID"] if saved else None,
+        })
+    # One WAL record for the whole batch: every row is saved or none is
+    submission_queue.submit_many(to_save)
+
+    seconds = time.perf_counter() - start
+    failed = sum(not r["passed"] for r in results)
+    tenant_id = current_tenant()
+    metrics.observe(INGEST_SECONDS, seconds, tenant=tenant_id)
+    for outcome, count in (("saved", len(to_save)), ("failed", failed), ("rejected", len(rejected))):
+        if count:
+            metrics.inc(INGEST_ROWS, count, tenant=tenant_id, outcome=outcome)
+    return {
+        "tenant": tenant_id,
+        "received": len(records),
+        "saved": len(to_save),
+        "failed": failed,
+        "rejected": rejected,
+        "results": results,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(len(records) / seconds, 1) if seconds > 0 else 0.0,
+    }
+
+def batches(records, size):
+    for i in range(0, len(records), size):
+        yield records[i:i + size]
+
+# --- CLI ---
+
+def _print_report(label, report):
+    print(f"{label}: {report['received']} rows, {report['saved']} saved, {report['failed']} below pass mark, "
+          f"{len(report['rejected'])} rejected  {report['seconds']:.3f}s  {report['rows_per_second']:.0f} rows/s")
+    for rejection in report["rejected"]:
+        print(f"  line {rejection['line']}: {rejection['error']}")
+
+def load_files(paths, tenant_id=DEFAULT_TENANT, fmt=None, batch_size=DEFAULT_BATCH_SIZE, save_failed=False):
+    """Ingest files in batches of batch_size rows, printing a report for each batch. Returns the reports."""
+    from submissions import flush_submissions
+    reports = []
+    with use_tenant(tenant_id):
+        for path in paths:
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                records = parse_records(f.read(), fmt or detect_format(path))
+            for number, batch in enumerate(batches(records, batch_size), start=1):
+                report = ingest_batch(batch, save_failed=save_failed)
+                report["file"] = path
+                _print_report(f"{os.path.basename(path)} batch {number}", report)
+                reports.append(report)
+        flush_submissions()
+    return reports
+
+# --- HTTP server ---
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, token=None):
+    """A threaded HTTP server for POST /ingest; each request body is one batch."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    class IngestHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/health":
+                self._reply(200, {"ok": True})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/ingest":
+                self._reply(404, {"error": "not found"})
+                return
+            if token and self.headers.get("Authorization") != f"Bearer {token}":
+                self._reply(401, {"error": "missing or wrong token"})
+                return
+            params = parse_qs(url.query)
+            tenant_id = resolve_tenant(params.get("tenant", [""])[0])
+            if tenant_id is None:
+                self._reply(404, {"error": "unknown tenant"})
+                return
+            header = self.headers.get("Content-Length")
+            if header is None:
+                self._reply(411, {"error": "Content-Length is required"})
+                return
+            try:
+                length = int(header)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._reply(400, {"error": "Content-Length is not a byte count"})
+                return
+            if length > MAX_BODY_BYTES:
+                self._reply(413, {"error": f"batch larger than {MAX_BODY_BYTES} bytes"})
+                return
+            try:
+                text = self.rfile.read(length).decode("utf-8-sig")
+            except UnicodeDecodeError:
+                self._reply(400, {"error": "body is not UTF-8"})
+                return
+            fmt = params.get("format", [""])[0] or detect_format(content_type=self.headers.get("Content-Type"))
+            save_failed = params.get("save_failed", ["0"])[0] in ("1", "true", "yes")
+            try:
+                with use_tenant(tenant_id):
+                    report = ingest_batch(parse_records(text, fmt), save_failed=save_failed)
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, report)
+
+        def log_message(self, format, *args):
+            # One line per request, without the default timestamp noise
+            print(f"{self.address_string()} {format % args}")
+
+    return ThreadingHTTPServer((host, port), IngestHandler)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="ingest NDJSON or CSV files")
+    load.add_argument("files", nargs="+")
+    load.add_argument("--tenant", default="", help="tenant ID (default tenant if omitted)")
+    load.add_argument("--format", choices=["csv", "ndjson"], help="input format (default: from the file extension)")
+    load.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    load.add_argument("--save-failed", action="store_true", help="also save answers below the pass mark")
+    load.add_argument("--json", help="write the batch reports to this file")
+
+    serve = commands.add_parser("serve", help="accept batches over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        server = make_server(args.host, args.port, os.environ.get("QUIZ_INGEST_TOKEN"))
+        print(f"Accepting batches on http://{args.host}:{args.port}/ingest")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    tenant_id = resolve_tenant(args.tenant)
+    if tenant_id is None:
+        sys.exit(f"Unknown tenant: {args.tenant}")
+    reports = load_files(args.files, tenant_id, args.format, max(1, args.batch_size), args.save_failed)
+    rows = sum(r["received"] for r in reports)
+    seconds = sum(r["seconds"] for r in reports)
+    print(f"Total: {rows} rows, {sum(r['saved'] for r in reports)} saved, "
+          f"{sum(len(r['rejected']) for r in reports)} rejected in {seconds:.2f}s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == "__main__":
+    main()
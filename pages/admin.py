@@ -1,23 +1,39 @@
 import streamlit as st
+import functools
+import time
+import sqlite3
 import pandas as pd
 from io import BytesIO
 import plotly.express as px
-from utils import send_telegram_message, CSV_PATH
+from utils import send_telegram_message
 
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from quiz_config import (load_quiz_config, save_quiz_config, save_scenario_image, 
-                         load_scenario_image, delete_scenario_image, get_all_questions,
-                         add_question, update_question, delete_question, get_question_by_id)
-from image_generator import generate_safety_scenario_image
+from quiz_config import (load_quiz_config, update_quiz_config, save_scenario_image, 
+                         load_scenario_image, delete_scenario_image,
+                         add_question, update_question, delete_question, get_question_by_id,
+                         question_count, list_questions, load_scenario_thumbnail)
+from image_generator import generate_safety_scenario_image, image_backend_summary, image_fallback_summary
+from perf import (timed, metrics, span_summary, recent_profiles, profile_report, profile_dump,
+                  METRICS_FILE, EXPORT_INTERVAL, PROFILING_ENABLED)
+from session_store import session_store
+from grading import BACKENDS, grading_cache
+from prompts import auto_image_prompt, prompt_cache
+from scene_renderer import PROCEDURAL_MODEL, SETTINGS as SCENE_SETTINGS, PROPS as SCENE_PROPS, MAX_PEOPLE, scene_for
+from dedup import duplicate_index, record_key, DUPLICATE_THRESHOLD
+from search_index import search_index, fts5_available, INDEXED_FIELDS as SEARCHABLE_COLUMNS
+from submissions import read_submissions, delete_submission, unsaved_submissions, FLUSH_TIMEOUT
+from tenants import DEFAULT_TENANT, current_tenant, list_tenants, save_tenant, tenant_units
+from roster import roster, parse_roster, completion, ROSTER_COLUMNS
+from reports import build_report_bundle, read_report_bundle, bundle_path as report_bundle_path
 
 def show():
     """Admin Page: View data and perform admin actions."""
     st.header("USO Admin Dashboard")
     
     # Create tabs for different admin functions
-    tab1, tab2, tab3 = st.tabs(["📊 Participant Data", "📝 Quiz Configuration", "🖼️ Preview Quiz"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Participant Data", "📝 Quiz Configuration", "🖼️ Preview Quiz", "⚡ Performance"])
     
     with tab1:
         show_participant_data()
@@ -28,16 +44,31 @@ def show():
     with tab3:
         preview_quiz()
 
+    with tab4:
+        show_performance()
+
+@timed("admin.show_participant_data")
 def show_participant_data():
     """Display participant data and analytics."""
     try:
-        df = pd.read_csv(CSV_PATH)
+        # Include submissions still on their way to the CSV, unless saving them is stuck
+        df = read_submissions(timeout=FLUSH_TIMEOUT)
+        unsaved = unsaved_submissions()
+        if unsaved:
+            st.warning(f"{unsaved} submission(s) are still being saved and are not shown yet.")
                 
         TOTAL_PER_COY = 60 # As specified, each company has 60 respondents
 
         # Calculate completion data per company
-        completion_by_coy = df.groupby(['UNIT', 'COY'])['Rank Name'].count().reset_index()
-        completion_by_coy.rename(columns={'Rank Name': 'Completed'}, inplace=True)
+        roster_join = completion(df) if roster.exists() else None
+        if roster_join is not None:
+            # Count people on the roster rather than rows, and size the chart to the largest company
+            by_coy = roster_join[0].groupby(['UNIT', 'COY'])[['Roster', 'Completed']].sum().reset_index()
+            TOTAL_PER_COY = int(by_coy['Roster'].max())
+            completion_by_coy = by_coy.loc[by_coy['Completed'] > 0, ['UNIT', 'COY', 'Completed']].reset_index(drop=True)
+        else:
+            completion_by_coy = df.groupby(['UNIT', 'COY'])['Rank Name'].count().reset_index()
+            completion_by_coy.rename(columns={'Rank Name': 'Completed'}, inplace=True)
         
         # Add a combined label for the chart
         completion_by_coy['Unit-Company'] = completion_by_coy['UNIT'] + " - " + completion_by_coy['COY']
@@ -58,7 +89,7 @@ def show_participant_data():
             
             # Customize the chart
             fig.update_layout(
-                yaxis=dict(range=[0, TOTAL_PER_COY]), # Set y-axis from 0 to 60
+                yaxis=dict(range=[0, TOTAL_PER_COY]), # Set y-axis from 0 to the company size
                 xaxis_title="Unit and Company",
                 yaxis_title="Completed Respondents",
                 plot_bgcolor='rgba(0,0,0,0)'
@@ -71,6 +102,12 @@ def show_participant_data():
             
             st.plotly_chart(fig, use_container_width=True)
 
+        st.markdown("---")
+        show_roster(roster_join)
+
+        st.markdown("---")
+        show_search(df)
+
         st.markdown("---")
         st.subheader("Raw Participant Data")
         
@@ -86,8 +123,7 @@ def show_participant_data():
                 with col1:
                     if st.button("🗑️", key=f"del_{idx}", help=f"Delete {df.loc[idx, 'Rank Name']}'s record"):
                         # Delete the row
-                        df_updated = df.drop(idx).reset_index(drop=True)
-                        df_updated.to_csv(CSV_PATH, index=False)
+                        delete_submission(df.loc[idx].to_dict())
                         st.success(f"Deleted record for {df.loc[idx, 'Rank Name']}")
                         st.rerun()
                 
@@ -101,6 +137,9 @@ def show_participant_data():
             # Also show full dataframe for reference
             with st.expander("View Full Data Table"):
                 st.dataframe(df)
+
+            with st.expander("🔁 Possible Copied Answers"):
+                show_duplicate_clusters(df)
         else:
             st.info("No participant data available.")
 
@@ -144,6 +183,8 @@ def show_participant_data():
                 mime="text/csv"
             )
 
+        show_report_bundle(df)
+
         # Assign Monthly Quiz
         if st.button("Assign Monthly"):
             with st.spinner("Sending reminders..."):
@@ -157,13 +198,215 @@ def show_participant_data():
     except Exception as e:
         st.error(f"An error occurred: {e}")
 
+def show_report_bundle(df):
+    """Build and download a zip of per-unit/company workbooks."""
+    st.markdown("#### Unit Reports")
+    st.caption("One workbook per unit and company, with a platoon summary and chart, plus an overall summary.")
+    if st.button("📦 Build Report Bundle", disabled=df.empty):
+        passing_score = load_quiz_config().get("passing_score", 9)
+        with st.spinner("Building unit reports..."):
+            try:
+                st.session_state.report_bundle = build_report_bundle(df, pass_mark=passing_score)
+            except Exception as e:
+                st.error(f"Error building report bundle: {e}")
+    stats = st.session_state.get("report_bundle")
+    path = report_bundle_path()
+    if stats and os.path.exists(path):
+        st.caption(f"{stats['groups']} companies, {stats['rows']} records in {stats['seconds']:.1f}s "
+                   f"using {stats['workers']} worker(s), {stats['bytes'] / (1024 * 1024):.1f} MB")
+        # Read from disk only when the download is clicked
+        st.download_button(
+            label="Download Unit Reports (.zip)",
+            # Runs on another thread when clicked, so the tenant's path is bound here
+            data=functools.partial(read_report_bundle, path),
+            file_name="unit_reports.zip",
+            mime="application/zip"
+        )
+
+def show_search(df):
+    """Full-text search over names, handles, answers and feedback."""
+    st.subheader("🔍 Search Records")
+    query = st.text_input(
+        "Search names, Telegram handles, answers and feedback:",
+        key="record_search",
+        placeholder="e.g. medic breathing, @handle, PTE Tan"
+    )
+    if not query.strip():
+        return
+
+    if not fts5_available():
+        # Without FTS5, fall back to a plain substring filter over the same columns
+        fields = [f for f in SEARCHABLE_COLUMNS if f in df.columns]
+        mask = df[fields].astype(str).apply(lambda col: col.str.contains(query, case=False, regex=False)).any(axis=1)
+        st.caption(f"{mask.sum()} matching record(s)")
+        st.dataframe(df[mask], hide_index=True, use_container_width=True)
+        return
+
+    try:
+        started = time.perf_counter()
+        rebuilt = search_index.sync(len(df), lambda: df.to_dict("records"))
+        rebuild_seconds = time.perf_counter() - started
+        rows, total, seconds = search_index.search(query)
+    except sqlite3.Error as e:
+        st.error(f"Search failed: {e}")
+        return
+    st.caption(f"{total} matching record(s) in {seconds * 1000:.1f} ms" +
+               (f", showing the best {len(rows)}" if total > len(rows) else "") +
+               (f" (index rebuilt in {rebuild_seconds * 1000:.0f} ms)" if rebuilt else ""))
+    if rows:
+        results = pd.DataFrame(rows)[["Rank Name", "Telegram Handle", "UNIT", "COY", "PLATOON", "Score",
+                                      "Timestamp", "Match"]]
+        st.dataframe(results, hide_index=True, use_container_width=True)
+
+def _rows_by_record_key(df, keys):
+    """The rows of df whose duplicate-index keys are in keys, as {key: row}."""
+    if not keys or df.empty:
+        return {}
+    # Index records are keyed by Attempt ID, or by a content hash for older rows
+    attempt_ids = df["Attempt ID"].fillna("").astype(str) if "Attempt ID" in df.columns else pd.Series("", index=df.index)
+    legacy = (attempt_ids == "") | (attempt_ids == "nan")
+    wanted = df[attempt_ids.isin(keys) & ~legacy]
+    rows = {record_key(row): row for row in wanted.to_dict("records")}
+    if any(k.startswith("row-") for k in keys) and legacy.any():
+        for row in df[legacy].to_dict("records"):
+            key = record_key(row)
+            if key in keys:
+                rows[key] = row
+    return rows
+
+def show_duplicate_clusters(df):
+    """List groups of near-identical answers from different people, and answers that repeat themselves."""
+    if not duplicate_index.exists():
+        duplicate_index.rebuild(df.to_dict("records"))
+
+    clusters = duplicate_index.clusters()
+    rows_by_key = _rows_by_record_key(df, {k for cluster in clusters for k in cluster})
+    clusters = [[rows_by_key[k] for k in cluster if k in rows_by_key] for cluster in clusters]
+    clusters = [cluster for cluster in clusters if len(cluster) > 1]
+
+    if clusters:
+        st.caption(f"{len(clusters)} group(s) of answers that are at least {DUPLICATE_THRESHOLD:.0%} similar, from different people.")
+        for n, cluster in enumerate(clusters, 1):
+            st.markdown(f"**Group {n}** – {len(cluster)} answers")
+            st.dataframe(
+                pd.DataFrame(cluster)[["Rank Name", "Telegram Handle", "UNIT", "COY", "Timestamp", "Answer"]],
+                hide_index=True, use_container_width=True
+            )
+    else:
+        st.info("No near-duplicate answers found.")
+
+    if "Repeated Text" in df.columns:
+        repeated = df[df["Repeated Text"].fillna("").astype(str).str.len() > 0]
+        if not repeated.empty:
+            st.markdown("**Answers that repeat the same text**")
+            st.dataframe(repeated[["Rank Name", "Telegram Handle", "Repeated Text"]], hide_index=True,
+                         use_container_width=True)
+
+    if st.button("Rebuild Duplicate Index", key="rebuild_dedup"):
+        duplicate_index.rebuild(df.to_dict("records"))
+        st.rerun()
+
+def show_roster(roster_join):
+    """Import the roster and show who has and hasn't taken the quiz."""
+    st.subheader("Roster")
+    with st.expander("📋 Import Roster", expanded=roster_join is None):
+        st.caption(f"A CSV or Excel file with the columns {', '.join(ROSTER_COLUMNS)} (Telegram Handle optional). "
+                   "Participants then pick their name from their platoon's list.")
+        uploaded = st.file_uploader("Roster file:", type=["csv", "xlsx"], key="roster_file")
+        if uploaded is not None and st.button("📥 Replace Roster", key="import_roster"):
+            try:
+                rows, problems = parse_roster(uploaded.getvalue(), uploaded.name)
+            except Exception as e:
+                st.error(f"Could not read the roster: {e}")
+                rows, problems = [], []
+            if rows:
+                roster.save(rows)
+                st.success(f"✅ Imported {len(rows)} people.")
+            for problem in problems[:20]:
+                st.warning(problem)
+            if len(problems) > 20:
+                st.warning(f"...and {len(problems) - 20} more rows left out.")
+            if rows:
+                st.rerun()
+        if roster_join is not None and st.button("🗑️ Remove Roster", key="remove_roster"):
+            roster.clear()
+            st.rerun()
+
+    if roster_join is None:
+        st.info("No roster imported. Completion is counted against 60 per company.")
+        return
+
+    summary, outstanding, unmatched = roster_join
+    col1, col2, col3 = st.columns(3)
+    col1.metric("On Roster", int(summary["Roster"].sum()))
+    col2.metric("Completed", int(summary["Completed"].sum()))
+    col3.metric("Outstanding", int(summary["Outstanding"].sum()))
+    st.dataframe(summary, hide_index=True, use_container_width=True)
+
+    lookup = st.text_input("Find on roster:", key="roster_lookup", placeholder="Name or @handle")
+    if lookup:
+        matches = roster.suggest(lookup, limit=20)
+        if matches:
+            st.dataframe(pd.DataFrame(matches, columns=ROSTER_COLUMNS), hide_index=True, use_container_width=True)
+        else:
+            st.caption("No one on the roster matches.")
+
+    with st.expander(f"⏳ Outstanding ({len(outstanding)})"):
+        st.dataframe(outstanding, hide_index=True, use_container_width=True)
+    with st.expander(f"❓ Submissions Not On The Roster ({len(unmatched)})"):
+        st.caption("Names and handles that match no one on the roster, e.g. typos or people missing from it.")
+        columns = [c for c in ["UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", "Timestamp"] if c in unmatched.columns]
+        st.dataframe(unmatched[columns], hide_index=True, use_container_width=True)
+
+def show_tenants():
+    """List the tenants (battalions), edit this one's units and add new ones."""
+    tenant_id = current_tenant()
+    with st.expander("🏢 Units and Tenants", expanded=False):
+        st.caption("Each tenant has its own questions, settings, images and submissions. "
+                   "Participants and admins reach a tenant with ?tenant=<id> in the app link.")
+        st.dataframe(
+            pd.DataFrame([{"Tenant": t, "Name": info["name"], "Units": ", ".join(info["units"]),
+                           "Link": "" if t == DEFAULT_TENANT else f"?tenant={t}"}
+                          for t, info in list_tenants().items()]),
+            hide_index=True, use_container_width=True
+        )
+        
+        # Units offered on this tenant's participant details form
+        units = st.text_input("Units for this tenant (comma separated):", value=", ".join(tenant_units()),
+                              key="tenant_units")
+        if st.button("💾 Save Units", key="save_tenant_units"):
+            try:
+                save_tenant(tenant_id, list_tenants()[tenant_id]["name"], units.split(","))
+                st.success("✅ Units saved!")
+            except ValueError as e:
+                st.error(str(e))
+        
+        st.markdown("**Add a tenant**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            new_id = st.text_input("Tenant ID:", key="new_tenant_id", help="Used in the link, e.g. 3sir")
+        with col2:
+            new_name = st.text_input("Name:", key="new_tenant_name")
+        with col3:
+            new_units = st.text_input("Units:", key="new_tenant_units", help="Comma separated")
+        if st.button("➕ Add Tenant", key="add_tenant"):
+            if new_id.strip().lower() in list_tenants():
+                st.error("A tenant with this ID already exists.")
+            else:
+                try:
+                    save_tenant(new_id, new_name, new_units.split(","))
+                    st.success(f"✅ Tenant added. Its quiz is at ?tenant={new_id.strip().lower()}")
+                except ValueError as e:
+                    st.error(str(e))
+
+@timed("admin.show_quiz_configuration")
 def show_quiz_configuration():
     """Allow admin to edit quiz configuration."""
     st.subheader("Quiz Configuration")
     
-    # Load current configuration
+    # Load current configuration and the question list (the manifest only; a question loads when it is edited)
     config = load_quiz_config()
-    questions = get_all_questions()
+    questions = list_questions()
     
     # Global settings
     with st.expander("⚙️ Global Settings", expanded=False):
@@ -174,12 +417,46 @@ def show_quiz_configuration():
             value=config.get("passing_score", 9),
             help="Minimum score required to pass"
         )
+
+        questions_per_participant = st.number_input(
+            "Questions per Participant:",
+            min_value=1,
+            max_value=max(len(questions), 1),
+            value=min(config.get("questions_per_participant", 1), max(len(questions), 1)),
+            help="Number of questions each participant answers. Questions are rotated so each one is shown equally often within a company."
+        )
+        
+        time_limit = st.number_input(
+            "Time Limit (seconds):",
+            min_value=0,
+            max_value=3600,
+            value=config.get("time_limit", 60),
+            help="Time allowed per question. Answers are auto-submitted when it runs out, and late submissions are flagged. Set to 0 for no limit."
+        )
+        
+        backend_names = list(BACKENDS)
+        current_backend = config.get("grading_backend", "keyword")
+        grading_backend = st.selectbox(
+            "Grading Method:",
+            backend_names,
+            index=backend_names.index(current_backend) if current_backend in backend_names else 0,
+            format_func=lambda name: BACKENDS[name].label,
+            help="Keyword Rules score fixed safety keywords. Similarity compares answers with each question's reference answers, and falls back to keyword rules for questions without any."
+        )
         
         if st.button("💾 Save Global Settings", type="primary"):
-            config["passing_score"] = passing_score
-            if save_quiz_config(config):
+            settings = {
+                "passing_score": passing_score,
+                "time_limit": time_limit,
+                "questions_per_participant": questions_per_participant,
+                "grading_backend": grading_backend,
+            }
+            # Applied to the latest saved config under its lock, so another admin's concurrent edits are kept
+            if update_quiz_config(lambda latest: latest.update(settings)) is not False:
                 st.success("✅ Global settings saved!")
     
+    show_tenants()
+    
     # Question management
     st.markdown("### Questions")
     
@@ -193,17 +470,24 @@ def show_quiz_configuration():
         }
         success, new_id = add_question(new_question)
         if success:
+            st.session_state.edit_question_id = new_id
             st.success(f"✅ New question added with ID: {new_id}")
             st.rerun()
     
-    # Create tabs for each question
+    # One editor at a time: only the question picked here is loaded
     if questions:
-        tab_labels = [f"Question {i+1}" for i in range(len(questions))]
-        tabs = st.tabs(tab_labels)
-        
-        for i, (tab, question) in enumerate(zip(tabs, questions)):
-            with tab:
-                show_question_editor(question, i+1)
+        numbers = {summary["id"]: i for i, summary in enumerate(questions, 1)}
+        if st.session_state.get("edit_question_id") not in numbers:
+            st.session_state.edit_question_id = questions[0]["id"]
+        question_id = st.selectbox(
+            "Question to edit:",
+            list(numbers),
+            format_func=lambda qid: f"Question {numbers[qid]}: {questions[numbers[qid] - 1].get('scenario_title', '')}",
+            key="edit_question_id"
+        )
+        question = get_question_by_id(question_id)
+        if question:
+            show_question_editor(question, numbers[question_id])
 
 def show_question_editor(question, question_num):
     """Show the editor for a single question."""
@@ -232,6 +516,13 @@ def show_question_editor(question, question_num):
                 help="The main question that participants will answer"
             )
             
+            # Reference answers for similarity grading
+            reference_answers = st.text_area(
+                "Reference Answers (one per line):",
+                value="\n".join(question.get("reference_answers", [])),
+                height=120,
+                help="Model answers used by similarity grading. Add a few differently worded good answers."
+            )
             
             # Image settings
             image_enabled = st.checkbox(
@@ -259,14 +550,41 @@ def show_question_editor(question, question_num):
                 key=f"image_prompt_field_{question_id}"
             )
             
+            # Scene drawn by the offline renderer
+            st.markdown("### Offline Scene")
+            scene = scene_for(question)
+            scene_col1, scene_col2, scene_col3 = st.columns([2, 1, 1])
+            with scene_col1:
+                scene_setting = st.selectbox(
+                    "Setting:",
+                    list(SCENE_SETTINGS),
+                    index=list(SCENE_SETTINGS).index(scene["setting"]),
+                    format_func=SCENE_SETTINGS.get,
+                    key=f"scene_setting_{question_id}"
+                )
+            with scene_col2:
+                scene_casualties = st.number_input("Casualties:", 0, MAX_PEOPLE, scene["casualties"],
+                                                   key=f"scene_casualties_{question_id}")
+            with scene_col3:
+                scene_helpers = st.number_input("Helpers:", 0, MAX_PEOPLE, scene["helpers"],
+                                                key=f"scene_helpers_{question_id}")
+            scene_props = st.multiselect(
+                "Props:",
+                list(SCENE_PROPS),
+                default=scene["props"],
+                format_func=SCENE_PROPS.get,
+                max_selections=4,
+                key=f"scene_props_{question_id}",
+                help=f"Drawn by the '{PROCEDURAL_MODEL}' image model, which needs no network"
+            )
+            
             # Save and Delete buttons
             col1, col2, col3 = st.columns([1, 1, 2])
             with col1:
                 submitted = st.form_submit_button("💾 Save Question", type="primary")
             with col2:
                 # Only show delete if not the only question
-                questions = get_all_questions()
-                if len(questions) > 1:
+                if question_count() > 1:
                     delete_clicked = st.form_submit_button("🗑️ Delete Question", type="secondary")
                 else:
                     delete_clicked = False
@@ -277,7 +595,14 @@ def show_question_editor(question, question_num):
                     "scenario_title": scenario_title,
                     "question_text": question_text,
                     "image_enabled": image_enabled,
-                    "image_prompt": image_prompt
+                    "image_prompt": image_prompt,
+                    "scene": {
+                        "setting": scene_setting,
+                        "props": scene_props,
+                        "casualties": int(scene_casualties),
+                        "helpers": int(min(scene_helpers, MAX_PEOPLE - scene_casualties)),
+                    },
+                    "reference_answers": [line.strip() for line in reference_answers.splitlines() if line.strip()]
                 }
                 
                 if update_question(question_id, updated_question):
@@ -300,32 +625,7 @@ def show_question_editor(question, question_num):
         if st.button(f"🤖 Auto-Generate Image Prompt", type="secondary", 
                     help="Generate prompt from question text", key=f"auto_gen_{question_id}"):
             if question_text:
-                # Parse the question for key scenario
-                scenario = ""
-                if "buddy" in question_text.lower() and ("trip" in question_text.lower() or "fall" in question_text.lower() or "injur" in question_text.lower()):
-                    scenario = "One soldier is kneeling on a tarmac road, visibly injured, while the other supports/helps him"
-                elif "heat" in question_text.lower():
-                    scenario = "One soldier showing heat exhaustion symptoms, another providing shade and water"
-                elif "weapon" in question_text.lower() or "rifle" in question_text.lower():
-                    scenario = "Soldiers demonstrating proper SAR-21 rifle safety procedures"
-                elif "grenade" in question_text.lower():
-                    scenario = "Soldiers in grenade throwing bay with proper safety positions"
-                elif "vehicle" in question_text.lower():
-                    scenario = "Soldiers conducting vehicle safety checks near military tonner"
-                else:
-                    scenario = "Soldiers demonstrating safety procedures during training exercise"
-                
-                # Determine environment
-                environment = "SAF training area with visible infrastructure"
-                if "march" in question_text.lower() or "route" in question_text.lower():
-                    environment = "SAF training area with visible infrastructure during a route march"
-                elif "range" in question_text.lower():
-                    environment = "SAF live firing range with safety markers and bunkers"
-                elif "field" in question_text.lower():
-                    environment = "jungle training area with dense tropical vegetation"
-                
-                # Generate concise prompt like the user's example
-                generated_prompt = f"Photorealistic scene of two NSF soldiers in modern SAF No.4 pixelated camouflage. {scenario}. Distinctive Singapore pixel pattern, field pack with metal frame, black Frontier boots. Background: {environment}."
+                generated_prompt = auto_image_prompt(question_text)
                 
                 # Store in session state to update the field on rerun
                 st.session_state[f'auto_generated_prompt_{question_id}'] = generated_prompt
@@ -356,7 +656,7 @@ def show_question_editor(question, question_num):
     
     with col1:
         # Model selection
-        model_options = ["Auto (Best)", "Flux (Realistic)", "Turbo (Fast)", "Simplified"]
+        model_options = ["Auto (Best)", "Flux (Realistic)", "Turbo (Fast)", "Simplified", PROCEDURAL_MODEL]
         try:
             if st.secrets.get("GOOGLE_API_KEY", "") != "":
                 model_options.insert(1, "Gemini Enhanced")
@@ -381,7 +681,7 @@ def show_question_editor(question, question_num):
                         # Temporarily set the prompt in session for the generator
                         st.session_state.current_gen_prompt = updated_q.get("image_prompt")
                     
-                    new_image = generate_safety_scenario_image()
+                    new_image = generate_safety_scenario_image(updated_q)
                     if new_image:
                         st.session_state[f'preview_image_{question_id}'] = new_image
                         st.success("Image generated! Preview below.")
@@ -416,53 +716,179 @@ def show_question_editor(question, question_num):
                 del st.session_state[preview_key]
                 st.rerun()
 
+PREVIEW_PAGE_SIZE = 20
+
+@timed("admin.preview_quiz")
 def preview_quiz():
     """Preview how the quiz will appear to participants."""
     st.subheader("Quiz Preview")
-    st.info("This shows how all questions will appear to participants (Note: In actual quiz, only one random question is shown)")
+    st.info("This shows how all questions will appear to participants (Note: In actual quiz, each participant only sees their assigned questions)")
     
-    # Load configuration and questions
+    # Load configuration and the question list (the manifest only; questions load when expanded)
     config = load_quiz_config()
-    questions = get_all_questions()
+    questions = list_questions()
     
     if not questions:
         st.warning("No questions configured. Please add questions in the Quiz Configuration tab.")
         return
     
-    # Show all questions in continuous scroll
-    for i, question in enumerate(questions, 1):
-        question_id = question.get("id", "")
-        
-        # Show preview container for each question
-        with st.container():
-            st.markdown("---")
-            st.markdown(f"### Question {i}")
-            st.header(question.get("scenario_title", "Safety Scenario Question"))
-            st.write(question.get("question_text", "No question text configured"))
-            
-            # Show image if enabled and exists
-            if question.get("image_enabled", True):
-                saved_image = load_scenario_image(question_id)
-                if saved_image:
-                    st.image(saved_image, caption=f"Safety Scenario for Question {i}", use_container_width=True)
-                else:
-                    st.info(f"No scenario image saved for Question {i}. Generate one in the Quiz Configuration tab.")
-            
-            # Show mock answer area
-            st.text_area(f"Your Answer for Question {i}:", 
-                        placeholder="Participants will type their answer here...", 
-                        disabled=True,
-                        key=f"preview_answer_{question_id}")
-            
-            # Show submit button (disabled)
-            st.button(f"Submit Answer", disabled=True, key=f"preview_submit_{question_id}")
+    # Compact cards, a page at a time; the full preview opens on demand
+    pages = (len(questions) + PREVIEW_PAGE_SIZE - 1) // PREVIEW_PAGE_SIZE
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key="preview_page")
+    first = (page - 1) * PREVIEW_PAGE_SIZE
+    for i, summary in enumerate(questions[first:first + PREVIEW_PAGE_SIZE], first + 1):
+        show_preview_card(i, summary)
     
     st.markdown("---")
     
     # Show configuration summary
     st.markdown("### Current Settings")
     st.metric("Passing Score", f"{config.get('passing_score', 9)}/10")
-    st.info("**Note:** In the actual quiz, participants will receive ONE randomly selected question from the above pool.")
+    per_participant = config.get("questions_per_participant", 1)
+    st.info(f"**Note:** In the actual quiz, participants will receive {per_participant} question(s) from the above pool, rotated so each question is shown equally often within a company.")
+
+def show_preview_card(i, summary):
+    """One question as a card with a thumbnail; toggling it shows the full participant view."""
+    question_id = summary.get("id", "")
+    image_enabled = summary.get("image_enabled", True)
+    
+    with st.container(border=True):
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            thumbnail = load_scenario_thumbnail(question_id) if image_enabled else None
+            if thumbnail:
+                st.image(thumbnail, use_container_width=True)
+            elif image_enabled:
+                st.caption("No image saved")
+            else:
+                st.caption("Image disabled")
+        with col2:
+            st.markdown(f"**Question {i}** · `{question_id}`")
+            st.markdown(summary.get("scenario_title", "Safety Scenario Question"))
+            expanded = st.toggle("Show full preview", key=f"preview_open_{question_id}")
+        
+        if expanded:
+            show_full_preview(i, question_id, image_enabled)
+
+def show_full_preview(i, question_id, image_enabled):
+    """The question as participants see it, with its full-size image."""
+    question = get_question_by_id(question_id)
+    if question is None:
+        st.warning("This question has been deleted.")
+        return
+    st.header(question.get("scenario_title", "Safety Scenario Question"))
+    st.write(question.get("question_text", "No question text configured"))
+    
+    # Show image if enabled and exists
+    if image_enabled:
+        saved_image = load_scenario_image(question_id)
+        if saved_image:
+            st.image(saved_image, caption=f"Safety Scenario for Question {i}", use_container_width=True)
+        else:
+            st.info(f"No scenario image saved for Question {i}. Generate one in the Quiz Configuration tab.")
+    
+    # Show mock answer area
+    st.text_area(f"Your Answer for Question {i}:", 
+                placeholder="Participants will type their answer here...", 
+                disabled=True,
+                key=f"preview_answer_{question_id}")
+    
+    # Show submit button (disabled)
+    st.button(f"Submit Answer", disabled=True, key=f"preview_submit_{question_id}")
+
+def show_performance():
+    """Show timing histograms, session memory and captured profiles for this server process."""
+    st.subheader("Performance")
+    st.caption("Figures cover this server process since it started.")
+
+    # Live quiz sessions
+    stats = session_store.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Active Sessions", stats["sessions"])
+    col2.metric("Session Memory", f"{stats['bytes'] / 1024:.1f} KB")
+    col3.metric("Per Session", f"{stats['avg_bytes']} B")
+
+    # Grading result cache
+    cache_stats = grading_cache.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached Grades", cache_stats["entries"])
+    col2.metric("Cache Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+    with col3:
+        if st.button("Clear Grading Cache", key="clear_grading_cache"):
+            grading_cache.clear()
+            st.rerun()
+
+    # Memoized Gemini rewrites and auto-generated image prompts
+    prompt_stats = prompt_cache.stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cached Prompts", prompt_stats["entries"])
+    col2.metric("Prompt Hit Rate", f"{prompt_stats['hit_rate']:.0%}")
+    with col3:
+        if st.button("Clear Prompt Cache", key="clear_prompt_cache",
+                     help="Forget saved prompt rewrites so they are generated again"):
+            prompt_cache.invalidate()
+            st.rerun()
+
+    # Timing spans
+    st.markdown("### Timing Spans")
+    rows = span_summary()
+    if rows:
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    else:
+        st.info("No timings recorded yet.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="Download Metrics (Prometheus)",
+            data=metrics.prometheus_text(),
+            file_name="metrics.prom",
+            mime="text/plain"
+        )
+    with col2:
+        if st.button("Reset Metrics", key="reset_metrics"):
+            metrics.reset()
+            st.rerun()
+    with st.expander("Prometheus Text", expanded=False):
+        st.code(metrics.prometheus_text(), language="text")
+
+    # External image backends
+    st.markdown("### Image Backends")
+    backend_rows = image_backend_summary()
+    if backend_rows:
+        st.dataframe(pd.DataFrame(backend_rows), hide_index=True, use_container_width=True)
+        fallback_rows = image_fallback_summary()
+        if fallback_rows:
+            st.markdown("**Fallbacks**")
+            st.dataframe(pd.DataFrame(fallback_rows), hide_index=True, use_container_width=True)
+    else:
+        st.info("No image backend requests recorded yet.")
+    st.caption(f"Metrics are also written to `{METRICS_FILE}` every {EXPORT_INTERVAL}s while backends are in use.")
+
+    # Profiling
+    st.markdown("### Profiling")
+    if PROFILING_ENABLED:
+        st.info("Open the app with `?profile=1` in the URL to capture a cProfile of every rerun in that session.")
+        profiling = st.checkbox("Profile this admin session", value=st.session_state.get('profile_session', False),
+                                key="profile_toggle")
+        st.session_state.profile_session = profiling
+    else:
+        st.info("Profiling is off. Start the server with `QUIZ_PROFILING=1` to capture cProfiles of reruns.")
+
+    profiles = recent_profiles()
+    if not profiles:
+        st.caption("No profiles captured yet.")
+    for i, captured in enumerate(profiles):
+        with st.expander(f"{captured['label']} – {captured['duration'] * 1000:.1f} ms"):
+            st.code(profile_report(captured), language="text")
+            st.download_button(
+                label="Download .prof",
+                data=profile_dump(captured),
+                file_name=f"profile_{int(captured['time'])}.prof",
+                key=f"download_profile_{i}_{int(captured['time'] * 1000)}"
+            )
 
 if __name__ == "__main__":
     show()
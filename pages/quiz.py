@@ -1,21 +1,174 @@
 import streamlit as st
-import pandas as pd
+import json
 import random
-from utils import initialize_data_storage, grade_answer, save_participant_data
+import time
+import streamlit.components.v1 as components
+from utils import initialize_data_storage, grade_and_record, SUBMIT_GRACE_SECONDS
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from image_generator import get_cached_scenario_image
-from quiz_config import load_quiz_config, load_scenario_image, get_all_questions
+from quiz_config import (load_quiz_config, load_scenario_image, list_questions, question_count,
+                         get_question_by_id, prefetch_scenario_images)
+from question_schedule import assign_questions
+from roster import link_roster, roster
+from attempt_log import log_attempt_event, new_attempt_id
+from session_store import QuizSession, session_store
+from tenants import COYS, PLATOONS, current_tenant, tenant_units
+
+# Session state keys that make up a participant's resumable progress
+SESSION_KEYS = (
+    "page", "participant_details", "quiz_run_id", "question_queue", "question_index",
+    "question_results", "attempt_id", "attempt_number", "attempts_total",
+    "attempt_started_at", "quiz_started_at", "answer", "previous_answer",
+    "retake_feedback", "grading_results", "answer_seconds", "answer_late",
+)
+
+COUNTDOWN_HTML = """
+<div style="font-family: sans-serif; font-size: 14px;">
+  <div id="label">Time remaining: --</div>
+  <div style="background: #e5e7eb; border-radius: 4px; height: 8px; margin-top: 4px;">
+    <div id="bar" style="background: #1E3A8A; border-radius: 4px; height: 8px; width: 100%;"></div>
+  </div>
+</div>
+<script>
+  // Runs entirely in the browser, so the countdown never triggers server reruns
+  const total = __TOTAL__;
+  const deadline = Date.now() + __REMAINING__ * 1000;
+  const doc = window.parent.document;
+  let submitted = false;
+  function autoSubmit() {
+    if (submitted) return;
+    submitted = true;
+    const area = doc.querySelector('textarea[aria-label="Your Answer:"]');
+    if (area) { area.blur(); area.readOnly = true; }
+    // Give the blur a moment to commit the answer before pressing submit
+    setTimeout(function () {
+      const button = Array.from(doc.querySelectorAll('button')).find(b => b.innerText.trim() === "Submit Answer");
+      if (button) button.click();
+    }, 400);
+  }
+  function tick() {
+    const remaining = Math.max(0, (deadline - Date.now()) / 1000);
+    document.getElementById("label").innerText = "Time remaining: " + Math.ceil(remaining) + "s";
+    document.getElementById("bar").style.width = (100 * remaining / total) + "%";
+    if (remaining <= 0) { autoSubmit(); return; }
+    setTimeout(tick, 250);
+  }
+  tick();
+</script>
+"""
+
+def render_countdown(remaining, total):
+    """Show a client-side countdown that auto-submits the answer when time runs out."""
+    html = (COUNTDOWN_HTML
+            .replace("__TOTAL__", json.dumps(total))
+            .replace("__REMAINING__", json.dumps(round(remaining, 1))))
+    # st.iframe replaces components.html in newer Streamlit releases
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=40)
+    else:
+        components.html(html, height=40)
+
+def resume_session():
+    """Restore progress from the server-side session named in the URL, if any."""
+    if 'page' in st.session_state:
+        return
+    token = st.query_params.get("session")
+    session = session_store.get(token)
+    # Only sessions this page started, in this tenant, can be resumed from a link
+    if session is None or session.origin != "web" or session.tenant != current_tenant():
+        return
+    for key in SESSION_KEYS:
+        value = getattr(session, key)
+        if value is not None:
+            st.session_state[key] = value
+    if session.question_id:
+        question = get_question_by_id(session.question_id)
+        if question:
+            st.session_state.selected_question = question
+    st.session_state.session_token = token
+
+def sync_session():
+    """Save the participant's progress under their session token when it has changed."""
+    if 'participant_details' not in st.session_state:
+        return
+    token = st.session_state.get('session_token')
+    if not token:
+        token = session_store.new_token()
+        st.session_state.session_token = token
+    if st.query_params.get("session") != token:
+        st.query_params["session"] = token
+
+    question = st.session_state.get('selected_question') or {}
+    snapshot = {key: st.session_state.get(key) for key in SESSION_KEYS}
+    snapshot["question_id"] = question.get("id")
+    if st.session_state.get('session_snapshot') == snapshot:
+        return
+    session_store.save(QuizSession(token, origin="web", tenant=current_tenant(), **snapshot))
+    st.session_state.session_snapshot = snapshot
+
+def end_session():
+    """Drop the server-side session and clear progress for the next participant."""
+    token = st.session_state.get('session_token')
+    if token:
+        session_store.delete(token)
+    if "session" in st.query_params:
+        del st.query_params["session"]
+    for key in list(st.session_state.keys()):
+        if key not in ['is_admin']:
+            del st.session_state[key]
+
+def participant_label():
+    """Identify the current participant in attempt events."""
+    details = st.session_state.get('participant_details', {})
+    return {
+        "run_id": st.session_state.get('quiz_run_id'),
+        "telegram_handle": details.get("Telegram Handle"),
+        "unit": details.get("UNIT"),
+        "coy": details.get("COY"),
+        "tenant": current_tenant(),
+    }
+
+def start_attempt(question_id):
+    """Open a new attempt for the current question if one isn't already running."""
+    if 'attempt_id' in st.session_state:
+        return
+    st.session_state.attempt_id = new_attempt_id()
+    st.session_state.attempt_started_at = time.time()
+    st.session_state.attempt_number = st.session_state.get('attempt_number', 0) + 1
+    st.session_state.attempts_total = st.session_state.get('attempts_total', 0) + 1
+    if 'quiz_started_at' not in st.session_state:
+        st.session_state.quiz_started_at = st.session_state.attempt_started_at
+    log_attempt_event(
+        "start", st.session_state.attempt_id,
+        question_id=question_id,
+        attempt_number=st.session_state.attempt_number,
+        **participant_label()
+    )
+
+def advance_question(next_index):
+    """Move on to the next assigned question with a fresh attempt."""
+    st.session_state.question_index = next_index
+    for key in ['selected_question', 'attempt_id', 'attempt_number', 'previous_answer',
+                'retake_feedback', 'scenario_image']:
+        if key in st.session_state:
+            del st.session_state[key]
+    st.session_state.answer_displayed = False
+    st.session_state.page_reloaded_for_retake = True
 
 def page_participant_details():
     """Page 1: Collects participant details."""
     st.header("SAF Safety Quiz – Participant Details")
 
+    # With a roster, participants pick their name from their platoon's list
+    if roster.exists():
+        roster_details_form()
+        return
+
     with st.form("details_form"):
-        unit = st.selectbox("UNIT", ["-", "1 SIR", "2 SIR", "3 SIR"])
-        coy = st.selectbox("COY", ["-", "Alpha", "Bravo", "Charlie"])
-        platoon = st.selectbox("PLATOON", ["-", "1", "2", "3", "4"])
+        unit = st.selectbox("UNIT", ["-"] + tenant_units())
+        coy = st.selectbox("COY", ["-"] + COYS)
+        platoon = st.selectbox("PLATOON", ["-"] + PLATOONS)
         rank_name = st.text_input("Rank Name")
         telegram_handle = st.text_input("Telegram Handle (e.g., @username)")
         
@@ -25,35 +178,88 @@ def page_participant_details():
             if unit == "-" or coy == "-" or platoon == "-" or not rank_name or not telegram_handle:
                 st.error("All fields are required.")
             else:
-                st.session_state.participant_details = {
+                start_quiz({
                     "UNIT": unit,
                     "COY": coy,
                     "PLATOON": platoon,
                     "Rank Name": rank_name,
                     "Telegram Handle": telegram_handle
-                }
-                st.session_state.page = "quiz_question"
-                st.rerun()
+                })
+
+def roster_details_form():
+    """Participant details with the name chosen from the roster (outside a form, so the list follows the platoon)."""
+    unit = st.selectbox("UNIT", ["-"] + tenant_units())
+    coy = st.selectbox("COY", ["-"] + COYS)
+    platoon = st.selectbox("PLATOON", ["-"] + PLATOONS)
+    chosen = "-" not in (unit, coy, platoon)
+    names = [entry["Rank Name"] for entry in roster.platoon(unit, coy, platoon)] if chosen else []
+    rank_name = st.selectbox(
+        "Rank Name", names, index=None, accept_new_options=True, disabled=not chosen,
+        placeholder="Type to search your name" if chosen else "Choose your platoon first"
+    )
+    entry = roster.find({"UNIT": unit, "COY": coy, "PLATOON": platoon, "Rank Name": rank_name}) if rank_name else None
+    if rank_name and entry is None:
+        st.caption("This name isn't on your platoon's roster. Check the spelling, or carry on if it is correct.")
+    # Keyed by person, so choosing someone else fills in their handle
+    telegram_handle = st.text_input(
+        "Telegram Handle (e.g., @username)",
+        value=(entry or {}).get("Telegram Handle", ""),
+        key=f"telegram_handle_{entry['Roster ID'] if entry else ''}"
+    )
+
+    if st.button("Next"):
+        if not chosen or not rank_name or not telegram_handle:
+            st.error("All fields are required.")
+        else:
+            start_quiz({
+                "UNIT": unit,
+                "COY": coy,
+                "PLATOON": platoon,
+                "Rank Name": rank_name,
+                "Telegram Handle": telegram_handle
+            })
+
+def start_quiz(details):
+    """Record the participant's details, assign their questions and go to the first one."""
+    link_roster(details)
+    st.session_state.participant_details = details
+    st.session_state.quiz_run_id = new_attempt_id()
+    # Assign this participant's questions and warm their images while they read
+    config = load_quiz_config()
+    st.session_state.question_queue = assign_questions(
+        list_questions(),
+        config.get("questions_per_participant", 1),
+        group=f"{details['UNIT']}/{details['COY']}"
+    )
+    st.session_state.question_index = 0
+    prefetch_scenario_images(st.session_state.question_queue)
+    st.session_state.page = "quiz_question"
+    st.rerun()
 
 def page_quiz_question():
     """Page 2: Displays the safety scenario question and timer."""
     # Load quiz configuration
     config = load_quiz_config()
     
-    # Get all questions and select one
-    questions = get_all_questions()
-    if not questions:
+    # Only the selected question is loaded; the rest stay on disk
+    if not question_count():
         st.error("No questions configured. Please contact the administrator.")
         return
     
-    # Select a random question if not already selected for this session
+    # Take the next assigned question if not already selected for this session
+    queue = st.session_state.get('question_queue') or []
+    index = st.session_state.get('question_index', 0)
     if 'selected_question' not in st.session_state:
-        st.session_state.selected_question = random.choice(questions)
+        question = get_question_by_id(queue[index]) if index < len(queue) else None
+        # Fall back to a random question if the assigned one was removed
+        st.session_state.selected_question = question or get_question_by_id(random.choice(list_questions())["id"])
     
     question = st.session_state.selected_question
     question_id = question.get("id", "q1")
     
     st.header(question.get("scenario_title", "Safety Scenario Question"))
+    if len(queue) > 1:
+        st.caption(f"Question {index + 1} of {len(queue)}")
 
     # If there's retake feedback, show the feedback screen first.
     if 'retake_feedback' in st.session_state:
@@ -67,7 +273,14 @@ def page_quiz_question():
         st.markdown("---")
         
         if st.button("Retry Quiz"):
+            log_attempt_event(
+                "retry", st.session_state.attempt_id,
+                question_id=question_id,
+                attempt_number=st.session_state.attempt_number,
+                **participant_label()
+            )
             del st.session_state['retake_feedback']
+            del st.session_state['attempt_id']
             st.session_state.page_reloaded_for_retake = True
             st.session_state.answer_displayed = False  # Reset the display flag for retry
             # Clear cached image to regenerate with improved prompt
@@ -76,6 +289,13 @@ def page_quiz_question():
             st.rerun()
         return # Stop further rendering until user clicks retry
 
+    start_attempt(question_id)
+
+    # The deadline is enforced from the server-side start time; the browser only displays it
+    time_limit = config.get("time_limit", 0) or 0
+    remaining = time_limit - (time.time() - st.session_state.attempt_started_at) if time_limit else None
+    time_up = remaining is not None and remaining <= 0
+
     st.write(question.get("question_text", "Describe the actions when your buddy trips and fall during a march and has difficulty walking but insists to carry on."))
     
     # Display scenario image with model selection
@@ -92,14 +312,16 @@ def page_quiz_question():
                 # Set the question's prompt for generation
                 if question.get("image_prompt"):
                     st.session_state.current_gen_prompt = question.get("image_prompt")
-                scenario_image = get_cached_scenario_image()
+                # Only pull in the image generation stack when an image has to be generated
+                from image_generator import get_cached_scenario_image
+                scenario_image = get_cached_scenario_image(question)
                 if scenario_image:
                     st.image(scenario_image, caption=question.get("scenario_title", "Safety Scenario"), use_container_width=True)
     with col2:
         # Only show model selection if no saved image or if image generation is needed
         if question.get("image_enabled", True) and not load_scenario_image(question_id):
             # Model selection dropdown
-            model_options = ["Auto (Best)", "Flux (Realistic)", "Turbo (Fast)", "Simplified"]
+            model_options = ["Auto (Best)", "Flux (Realistic)", "Turbo (Fast)", "Simplified", "Procedural (Offline)"]
             
             # Add Gemini option if API key is configured
             try:
@@ -122,6 +344,7 @@ def page_quiz_question():
             if st.button("🔄 Regenerate", help="Generate new image with selected model"):
                 if 'scenario_image' in st.session_state:
                     del st.session_state['scenario_image']
+                st.session_state.regenerate_image = True
                 # Set the question's prompt for regeneration
                 if question.get("image_prompt"):
                     st.session_state.current_gen_prompt = question.get("image_prompt")
@@ -141,16 +364,50 @@ def page_quiz_question():
     else:
         answer_value = st.session_state.get('user_answer', '')
     
-    answer = st.text_area("Your Answer:", value=answer_value, key="user_answer")
+    if time_up:
+        st.warning("Time is up. Please submit your answer.")
+    elif remaining is not None:
+        render_countdown(remaining, time_limit)
+
+    answer = st.text_area("Your Answer:", value=answer_value, key="user_answer", disabled=time_up)
 
     if st.button("Submit Answer"):
         st.session_state.answer = st.session_state.user_answer
+        elapsed = time.time() - st.session_state.attempt_started_at
+        st.session_state.answer_seconds = round(elapsed, 3)
+        st.session_state.answer_late = bool(time_limit) and elapsed > time_limit + SUBMIT_GRACE_SECONDS
+        log_attempt_event(
+            "submit", st.session_state.attempt_id,
+            question_id=question_id,
+            attempt_number=st.session_state.attempt_number,
+            answer=st.session_state.answer,
+            answer_seconds=st.session_state.answer_seconds,
+            time_limit=time_limit,
+            late=st.session_state.answer_late,
+            **participant_label()
+        )
         st.session_state.page = "grading"
         st.rerun()
 
 def page_completion():
     """Page 3: Shows the final score and feedback."""
     st.header("Quiz Completion")
+
+    results = st.session_state.get('question_results') or []
+    if len(results) > 1:
+        total = sum(r["Score"] for r in results)
+        st.success(f"You have completed the SAF Safety Quiz. Your total score is: {total}/{10 * len(results)}")
+        for result in results:
+            st.subheader(f"{result['Question']} – {result['Score']}/10")
+            st.markdown(f"**Strength:** {result['Strength']}")
+            st.markdown(f"**Weakness:** {result['Weakness']}")
+            st.markdown(f"**Improvement:** {result['Improvement']}")
+        if st.button("Finish"):
+            # Clear session state for the next participant
+            end_session()
+            st.session_state.page = "details"
+            st.rerun()
+        return
     
     score = st.session_state.grading_results["Score"]
     strength = st.session_state.grading_results["Strength"]
@@ -166,12 +423,7 @@ def page_completion():
 
     if st.button("Finish"):
         # Clear session state for the next participant
-        for key in list(st.session_state.keys()):
-            if key not in ['page', 'is_admin']:
-                del st.session_state[key]
-        # Make sure to clear selected question for next participant
-        if 'selected_question' in st.session_state:
-            del st.session_state['selected_question']
+        end_session()
         st.session_state.page = "details"
         st.rerun()
 
@@ -181,42 +433,68 @@ def main():
     """Main function to run the Streamlit app."""
     initialize_data_storage()
 
+    resume_session()
+
     if 'page' not in st.session_state:
         st.session_state.page = "details"
 
-    # Page routing
-    if st.session_state.page == "details":
-        page_participant_details()
-    elif st.session_state.page == "quiz_question":
-        page_quiz_question()
-    elif st.session_state.page == "grading":
-        # This is a transient state to perform grading
-        with st.spinner("Grading your answer..."):
-            grading_results = grade_answer(st.session_state.answer)
-            st.session_state.grading_results = grading_results
-            
-            # Load passing score from config
-            passing_score = load_quiz_config().get("passing_score", 9)
-            # Check if score is sufficient
-            if grading_results["Score"] >= passing_score:
-                # Combine all data and save
-                full_data = {
-                    **st.session_state.participant_details,
-                    "Answer": st.session_state.answer,
-                    **grading_results,
-                    "Timestamp": pd.to_datetime("now").isoformat()
-                }
-                save_participant_data(full_data)
-                
-                st.session_state.page = "completion"
-            else:
-                # Store feedback and previous answer, then go to the feedback screen
-                st.session_state.retake_feedback = grading_results
-                st.session_state.previous_answer = st.session_state.answer
-                st.session_state.page = "quiz_question"
-            st.rerun()
-    elif st.session_state.page == "completion":
-        page_completion()
+    try:
+        # Page routing
+        if st.session_state.page == "details":
+            page_participant_details()
+        elif st.session_state.page == "quiz_question":
+            page_quiz_question()
+        elif st.session_state.page == "grading":
+            # This is a transient state to perform grading
+            with st.spinner("Grading your answer..."):
+                config = load_quiz_config()
+                attempt_id = st.session_state.attempt_id
+                question_id = st.session_state.selected_question.get("id", "q1")
+                grading_results, passed = grade_and_record(
+                    st.session_state.answer,
+                    st.session_state.selected_question,
+                    st.session_state.participant_details,
+                    config,
+                    attempt_id,
+                    attempt_number=st.session_state.attempt_number,
+                    answer_seconds=st.session_state.get('answer_seconds'),
+                    late=st.session_state.get('answer_late', False),
+                    label=participant_label()
+                )
+                st.session_state.grading_results = grading_results
+                # Check if score is sufficient
+                if passed:
+                    st.session_state.question_results = st.session_state.get('question_results', []) + [{
+                        "Question": st.session_state.selected_question.get("scenario_title", question_id),
+                        **grading_results
+                    }]
+
+                    queue = st.session_state.get('question_queue') or []
+                    next_index = st.session_state.get('question_index', 0) + 1
+                    if next_index < len(queue):
+                        advance_question(next_index)
+                        st.session_state.page = "quiz_question"
+                    else:
+                        log_attempt_event(
+                            "complete", attempt_id,
+                            question_id=question_id,
+                            questions=len(st.session_state.question_results),
+                            attempts=st.session_state.attempts_total,
+                            total_seconds=round(time.time() - st.session_state.quiz_started_at, 3),
+                            **participant_label()
+                        )
+                        st.session_state.page = "completion"
+                else:
+                    # Store feedback and previous answer, then go to the feedback screen
+                    st.session_state.retake_feedback = grading_results
+                    st.session_state.previous_answer = st.session_state.answer
+                    st.session_state.page = "quiz_question"
+                st.rerun()
+        elif st.session_state.page == "completion":
+            page_completion()
+    finally:
+        # Runs on st.rerun() too, so every page transition is saved
+        sync_session()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,285 @@
+import cProfile
+import functools
+import io
+import logging
+import marshal
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from shared_state import REPLICA_ID
+
+log = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" labels)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SPAN_METRIC = "quiz_span_seconds"
+
+class Histogram:
+    """Fixed-bucket histogram, cheap enough to update on every call."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within the bucket that contains it."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + n >= target and n:
+                return lower + (upper - lower) * (target - seen) / n
+            seen += n
+            lower = upper
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """In-process histograms and counters keyed by metric name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histograms(self, name=None):
+        """Return [(name, labels dict, Histogram copy)] for all or one metric."""
+        with self._lock:
+            items = [(n, dict(l), _copy_histogram(h)) for (n, l), h in self._histograms.items()
+                     if name is None or n == name]
+        return sorted(items, key=lambda item: (item[0], sorted(item[1].items())))
+
+    def counters(self, name=None):
+        """Return [(name, labels dict, value)] for all or one metric."""
+        with self._lock:
+            items = [(n, dict(l), v) for (n, l), v in self._counters.items() if name is None or n == name]
+        return sorted(items, key=lambda item: (item[0], sorted(item[1].items())))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for name, labels, histogram in self.histograms():
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for name, labels, value in self.counters():
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def _copy_histogram(histogram):
+    copy = Histogram(histogram.buckets)
+    copy.counts = list(histogram.counts)
+    copy.sum = histogram.sum
+    copy.count = histogram.count
+    return copy
+
+def _labels(labels, **extra):
+    merged = dict(labels, **{k: v for k, v in extra.items()})
+    if not merged:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in merged.items())
+    return "{" + ",".join(escaped) + "}"
+
+# Shared process-wide registry
+metrics = MetricsRegistry()
+metrics.describe(SPAN_METRIC, "Time spent in instrumented quiz operations.")
+
+# --- Metrics file ---
+# Written in the node_exporter textfile format so a collector (or anyone with
+# shell access) can read the metrics without going through the Streamlit UI.
+
+# One file per replica, so replicas sharing the data directory don't overwrite each other
+METRICS_FILE = os.path.join("data", "metrics", f"quiz-{REPLICA_ID}.prom")
+EXPORT_INTERVAL = 15  # seconds between automatic writes
+
+_last_export = 0.0
+_export_lock = threading.Lock()
+
+def export_metrics(path=METRICS_FILE):
+    """Atomically write every metric to path in the Prometheus text format."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(metrics.prometheus_text())
+    os.replace(tmp_path, path)
+
+def maybe_export_metrics(interval=EXPORT_INTERVAL):
+    """Write the metrics file if the last write is older than interval seconds."""
+    global _last_export
+    now = time.monotonic()
+    with _export_lock:
+        if now - _last_export < interval:
+            return
+        _last_export = now
+    try:
+        export_metrics()
+    except OSError as e:
+        log.error("Error writing metrics file: %s", e)
+
+@contextmanager
+def span(name):
+    """Time a block and record it under the given span name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(SPAN_METRIC, time.perf_counter() - start, span=name)
+
+def timed(name=None):
+    """Decorator that records each call of the function as a span."""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe(SPAN_METRIC, time.perf_counter() - start, span=span_name)
+        return wrapper
+    return decorate
+
+def span_summary():
+    """Per-span count and latency figures (milliseconds) for display."""
+    rows = []
+    for _, labels, histogram in metrics.histograms(SPAN_METRIC):
+        rows.append({
+            "Span": labels.get("span", ""),
+            "Calls": histogram.count,
+            "Mean (ms)": round(1000 * histogram.sum / histogram.count, 3) if histogram.count else 0.0,
+            "p50 (ms)": round(1000 * histogram.quantile(0.5), 3),
+            "p95 (ms)": round(1000 * histogram.quantile(0.95), 3),
+            "p99 (ms)": round(1000 * histogram.quantile(0.99), 3),
+            "Total (s)": round(histogram.sum, 3),
+        })
+    return rows
+
+# --- Profiling ---
+
+MAX_PROFILES = 20
+
+# Profiling slows every rerun it covers, so it is off unless the server is started with QUIZ_PROFILING=1
+PROFILING_ENABLED = os.environ.get("QUIZ_PROFILING") == "1"
+
+_profiles = deque(maxlen=MAX_PROFILES)
+_profiles_lock = threading.Lock()
+# Only one cProfile can be active per process (enabling a second raises on Python 3.12+)
+_profiler_lock = threading.Lock()
+
+@contextmanager
+def profile(label):
+    """
+    Profile a block with cProfile and keep the result among the recent captures.
+    The block runs unprofiled while another session's profile is being captured.
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        with _capture(label):
+            yield
+    finally:
+        _profiler_lock.release()
+
+@contextmanager
+def _capture(label):
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start
+        profiler.create_stats()
+        with _profiles_lock:
+            _profiles.append({
+                "label": label,
+                "time": time.time(),
+                "duration": duration,
+                "stats": profiler.stats,
+            })
+
+def recent_profiles():
+    """Return the captured profiles, newest first."""
+    with _profiles_lock:
+        return list(reversed(_profiles))
+
+def profile_report(captured, limit=25, sort="cumulative"):
+    """Render a captured profile as pstats text."""
+    stream = io.StringIO()
+    stats = pstats.Stats(_StatsHolder(captured["stats"]), stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+def profile_dump(captured):
+    """Serialize a captured profile in the .prof format read by pstats and snakeviz."""
+    return marshal.dumps(captured["stats"])
+
+class _StatsHolder:
+    """Minimal object pstats.Stats accepts in place of a live profiler."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
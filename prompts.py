@@ -0,0 +1,231 @@
+import abc
+import hashlib
+import json
+import os
+import threading
+
+from shared_state import atomic_write, file_lock
+
+# Image prompts derived from other text: Gemini rewrites of a question's image
+# prompt, and prompts auto-generated from question text in the admin editor.
+# Results are memoized on disk keyed by (source text hash, model, template
+# version), so the same source is only sent to a model once across restarts
+# and replicas. Changing a template means bumping its version.
+
+DATA_DIR = "data"
+PROMPT_CACHE_PATH = os.path.join(DATA_DIR, "prompt_cache.jsonl")
+
+# Prompts kept; past this the oldest are dropped when the log is compacted
+MAX_PROMPT_ENTRIES = 5000
+
+ENHANCEMENT_TEMPLATE_VERSION = 1
+ENHANCEMENT_TEMPLATE = """
+Enhance this prompt for maximum photorealism in AI image generation:
+{prompt}
+
+Add specific details about lighting, textures, camera settings.
+Output only the enhanced prompt (150 words max).
+"""
+ENHANCED_PROMPT_MAX_CHARS = 500
+
+AUTO_PROMPT_MODEL = "rules"
+AUTO_PROMPT_VERSION = 1
+
+class PromptCache:
+    """
+    Persistent memo of generated prompts, shared by every replica through one
+    append-only JSON-lines file. A new prompt is one appended line, and readers
+    only parse the lines added since they last looked. The log is rewritten
+    (keeping the newest max_entries prompts) when it has grown to twice that,
+    and when prompts are invalidated.
+    """
+
+    def __init__(self, path=PROMPT_CACHE_PATH, max_entries=MAX_PROMPT_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> entry, oldest first
+        self._inode = None  # of the log when last read
+        self._offset = 0  # bytes of the log read so far
+        self._lines = 0  # lines in the log, including superseded ones
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, model, template_version):
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+        return f"{model}|{template_version}|{digest}"
+
+    def _load(self):
+        """Read whatever has been appended since the last call, or all of a rewritten log (caller holds _lock)."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._entries, self._inode, self._offset, self._lines = {}, None, 0, 0
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._entries, self._inode, self._offset, self._lines = {}, stat.st_ino, 0, 0
+        if stat.st_size == self._offset:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read(stat.st_size - self._offset)
+        except FileNotFoundError:
+            return
+        # A line still being appended by another replica is picked up next time
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset += len(data)
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._entries.pop(entry["key"], None)
+            self._entries[entry["key"]] = entry
+            self._lines += 1
+
+    def _rewrite(self, entries):
+        """Replace the log with entries (caller holds the file lock and _lock)."""
+        atomic_write(self.path, "".join(json.dumps(entry) + "\n" for entry in entries))
+        self._inode = None
+        self._load()
+
+    def get(self, source, model, template_version):
+        key = self.key(source, model, template_version)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry["text"]
+
+    def put(self, source, model, template_version, text):
+        entry = {"key": self.key(source, model, template_version), "model": model,
+                 "version": template_version, "text": text}
+        with file_lock(self.path):
+            with self._lock:
+                self._load()
+                if self._lines + 1 >= 2 * self.max_entries:
+                    self._entries.pop(entry["key"], None)
+                    self._entries[entry["key"]] = entry
+                    self._rewrite(list(self._entries.values())[-self.max_entries:])
+                    return
+                if not os.path.exists(os.path.dirname(self.path) or "."):
+                    os.makedirs(os.path.dirname(self.path))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def get_or_create(self, source, model, template_version, create):
+        """Return the memoized text for source, calling create(source) only on a miss."""
+        text = self.get(source, model, template_version)
+        if text is None:
+            text = create(source)
+            self.put(source, model, template_version, text)
+        return text
+
+    def invalidate(self, source=None, model=None):
+        """
+        Forget memoized prompts: for one source text, one model, both, or (with neither) all of them.
+        Returns the number of entries removed.
+        """
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:32] if source is not None else None
+        with file_lock(self.path):
+            with self._lock:
+                self._load()
+                kept = [entry for key, entry in self._entries.items()
+                        if not ((model is None or entry["model"] == model)
+                                and (digest is None or key.endswith("|" + digest)))]
+                removed = len(self._entries) - len(kept)
+                if removed:
+                    self._rewrite(kept)
+                return removed
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+prompt_cache = PromptCache()
+
+# --- LLM clients ---
+
+class LLMClient(abc.ABC):
+    """A text model that rewrites prompts. Subclasses implement generate()."""
+
+    model = ""
+
+    @abc.abstractmethod
+    def generate(self, prompt):
+        """The model's text for prompt."""
+
+class StubLLMClient(LLMClient):
+    """
+    Offline stand-in for a real model, for tests and benchmarks.
+    Returns a fixed rewrite of the prompt after an optional delay and counts its calls.
+    """
+
+    model = "stub"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate(self, prompt):
+        import time
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        source = prompt.split("generation:", 1)[-1].split("Add specific details", 1)[0].strip()
+        return f"{source} Natural daylight, 85mm lens, sharp focus, detailed fabric textures."
+
+# --- Prompt builders ---
+
+def enhance_image_prompt(prompt, client):
+    """The model's photorealistic rewrite of an image prompt, memoized per (prompt, model, template)."""
+    def create(source):
+        text = client.generate(ENHANCEMENT_TEMPLATE.format(prompt=source))
+        return text.strip()[:ENHANCED_PROMPT_MAX_CHARS]
+    return prompt_cache.get_or_create(prompt, client.model, ENHANCEMENT_TEMPLATE_VERSION, create)
+
+def auto_image_prompt(question_text):
+    """A concise image prompt describing a question's scenario, memoized per question text."""
+    return prompt_cache.get_or_create(question_text, AUTO_PROMPT_MODEL, AUTO_PROMPT_VERSION, build_auto_prompt)
+
+def build_auto_prompt(question_text):
+    """Pick the scene and setting for an image prompt from keywords in the question text."""
+    text = question_text.lower()
+    # Parse the question for key scenario
+    if "buddy" in text and ("trip" in text or "fall" in text or "injur" in text):
+        scenario = "One soldier is kneeling on a tarmac road, visibly injured, while the other supports/helps him"
+    elif "heat" in text:
+        scenario = "One soldier showing heat exhaustion symptoms, another providing shade and water"
+    elif "weapon" in text or "rifle" in text:
+        scenario = "Soldiers demonstrating proper SAR-21 rifle safety procedures"
+    elif "grenade" in text:
+        scenario = "Soldiers in grenade throwing bay with proper safety positions"
+    elif "vehicle" in text:
+        scenario = "Soldiers conducting vehicle safety checks near military tonner"
+    else:
+        scenario = "Soldiers demonstrating safety procedures during training exercise"
+
+    # Determine environment
+    environment = "SAF training area with visible infrastructure"
+    if "march" in text or "route" in text:
+        environment = "SAF training area with visible infrastructure during a route march"
+    elif "range" in text:
+        environment = "SAF live firing range with safety markers and bunkers"
+    elif "field" in text:
+        environment = "jungle training area with dense tropical vegetation"
+
+    return (f"Photorealistic scene of two NSF soldiers in modern SAF No.4 pixelated camouflage. {scenario}. "
+            f"Distinctive Singapore pixel pattern, field pack with metal frame, black Frontier boots. "
+            f"Background: {environment}.")
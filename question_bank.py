@@ -0,0 +1,306 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from shared_state import atomic_write, file_lock
+from tenants import TenantScoped, tenant_path
+
+# Question storage: one JSON file per question plus a small manifest.
+# The manifest lists every question in display order with the few fields
+# needed to list and schedule them, a monotonic ID counter and a revision
+# number. Adding, editing or deleting a question writes only that question's
+# file and the manifest; quiz sessions read just the questions they were given.
+# Each tenant has its own bank in its data directory.
+
+DATA_DIR = "data"
+BANK_DIR = os.path.join(DATA_DIR, "question_bank")
+MANIFEST_PATH = os.path.join(BANK_DIR, "manifest.json")
+QUESTIONS_DIR = os.path.join(BANK_DIR, "questions")
+
+# Fields copied into the manifest so listing and scheduling never open question files
+SUMMARY_FIELDS = ("scenario_title", "weight", "image_enabled")
+
+CACHE_SIZE = 512  # parsed questions kept in memory
+
+def _references_hash(question):
+    references = question.get("reference_answers") or []
+    if not references:
+        return ""
+    digest = hashlib.sha256("\1".join(references).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def _seed_key(question):
+    """How seed.json names a config question: its ID, or for one without, a hash of its title and text."""
+    if question.get("id"):
+        return str(question["id"])
+    text = f"{question.get('scenario_title', '')}\1{question.get('question_text', '')}"
+    return "~" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+class QuestionBank:
+    """Per-question files with a manifest index, shared by every replica."""
+
+    def __init__(self, directory=BANK_DIR, cache_size=CACHE_SIZE):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.questions_dir = os.path.join(directory, "questions")
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._stamp = None  # (inode, mtime_ns, size) of the manifest when last read
+        self._questions = OrderedDict()  # (id, rev) -> question
+        self._fingerprint = None  # (revision, references fingerprint)
+        self._summaries = None  # (manifest, summaries built from it)
+
+    # --- Manifest ---
+
+    @staticmethod
+    def _empty_manifest():
+        return {"next_id": 1, "revision": 0, "questions": {}}
+
+    def _read_manifest(self):
+        """The current manifest; re-read only when another write (from any replica) has replaced it."""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return self._manifest
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            self._manifest, self._stamp = manifest, stamp
+        return manifest
+
+    def _load_manifest_for_write(self):
+        """A private copy of the manifest read straight from disk; callers hold the bank lock."""
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest):
+        manifest["revision"] += 1
+        atomic_write(self.manifest_path, json.dumps(manifest))
+        with self._lock:
+            self._manifest, self._stamp = manifest, None
+
+    def _question_path(self, question_id):
+        return os.path.join(self.questions_dir, f"{question_id}.json")
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    # --- Reads ---
+
+    def ids(self):
+        manifest = self._read_manifest()
+        return list(manifest["questions"]) if manifest else []
+
+    def count(self):
+        manifest = self._read_manifest()
+        return len(manifest["questions"]) if manifest else 0
+
+    def summaries(self):
+        """
+        [{id, scenario_title, weight, image_enabled}] for every question, in order, from the
+        manifest alone. Built once per manifest revision; treat the dicts as read-only.
+        """
+        manifest = self._read_manifest()
+        if not manifest:
+            return []
+        with self._lock:
+            if self._summaries and self._summaries[0] is manifest:
+                return list(self._summaries[1])
+        summaries = [dict(id=question_id, **{k: v for k, v in entry.items() if k in SUMMARY_FIELDS})
+                     for question_id, entry in manifest["questions"].items()]
+        with self._lock:
+            self._summaries = (manifest, summaries)
+        return list(summaries)
+
+    def get(self, question_id):
+        """One full question, or None. Parsed questions are cached until they are edited."""
+        manifest = self._read_manifest()
+        entry = manifest["questions"].get(question_id) if manifest else None
+        if entry is None:
+            return None
+        key = (question_id, entry["rev"])
+        with self._lock:
+            question = self._questions.get(key)
+            if question is not None:
+                self._questions.move_to_end(key)
+        if question is None:
+            try:
+                with open(self._question_path(question_id)) as f:
+                    question = json.load(f)
+            except (FileNotFoundError, ValueError):
+                return None
+            with self._lock:
+                self._questions[key] = question
+                while len(self._questions) > self.cache_size:
+                    self._questions.popitem(last=False)
+        return copy.deepcopy(question)
+
+    def all(self):
+        """Every full question, in order. Reads each question file not already cached."""
+        questions = (self.get(question_id) for question_id in self.ids())
+        return [q for q in questions if q is not None]
+
+    def references_fingerprint(self):
+        """Changes whenever any question's reference answers change; computed from the manifest."""
+        manifest = self._read_manifest()
+        if not manifest:
+            return ""
+        with self._lock:
+            if self._fingerprint and self._fingerprint[0] == manifest["revision"]:
+                return self._fingerprint[1]
+        digest = hashlib.sha256()
+        for question_id, entry in manifest["questions"].items():
+            if entry.get("refs"):
+                digest.update(f"{question_id}\0{entry['refs']}\1".encode("utf-8"))
+        fingerprint = digest.hexdigest()[:16]
+        with self._lock:
+            self._fingerprint = (manifest["revision"], fingerprint)
+        return fingerprint
+
+    # --- Writes ---
+
+    def _store(self, manifest, question_id, question):
+        """Write one question file and its manifest entry (caller holds the bank lock)."""
+        question = dict(question, id=question_id)
+        atomic_write(self._question_path(question_id), json.dumps(question, indent=2))
+        previous = manifest["questions"].get(question_id, {})
+        entry = {k: question[k] for k in SUMMARY_FIELDS if k in question}
+        entry["rev"] = previous.get("rev", 0) + 1
+        entry["refs"] = _references_hash(question)
+        manifest["questions"][question_id] = entry
+        return previous.get("refs", "") != entry["refs"]
+
+    def add(self, question):
+        """Store a new question under the next ID. Returns (id, whether reference answers changed)."""
+        with file_lock(self.manifest_path):
+            manifest = self._load_manifest_for_write() or self._empty_manifest()
+            question_id = f"q{manifest['next_id']}"
+            manifest["next_id"] += 1
+            references_changed = self._store(manifest, question_id, question)
+            self._write_manifest(manifest)
+        return question_id, references_changed
+
+    def update(self, question_id, question):
+        """Replace an existing question. Returns (found, whether reference answers changed)."""
+        with file_lock(self.manifest_path):
+            manifest = self._load_manifest_for_write()
+            if not manifest or question_id not in manifest["questions"]:
+                return False, False
+            references_changed = self._store(manifest, question_id, question)
+            self._write_manifest(manifest)
+        return True, references_changed
+
+    def delete(self, question_id):
+        """Remove a question. Returns (found, whether reference answers changed)."""
+        with file_lock(self.manifest_path):
+            manifest = self._load_manifest_for_write()
+            if not manifest or question_id not in manifest["questions"]:
+                return False, False
+            entry = manifest["questions"].pop(question_id)
+            self._write_manifest(manifest)
+            try:
+                os.remove(self._question_path(question_id))
+            except FileNotFoundError:
+                pass
+        return True, bool(entry.get("refs"))
+
+    def import_questions(self, questions):
+        """
+        Create the bank from a list of questions (e.g. the old single-file config),
+        keeping their IDs. Does nothing if the bank already exists.
+        Returns True if the questions were imported.
+        """
+        with file_lock(self.manifest_path):
+            if self._load_manifest_for_write() is not None:
+                return False
+            manifest = self._empty_manifest()
+            numbers = [int(q["id"][1:]) for q in questions if str(q.get("id", ""))[1:].isdigit()]
+            manifest["next_id"] = max(numbers, default=0) + 1
+            for question in questions:
+                question_id = question.get("id")
+                if not question_id or question_id in manifest["questions"]:
+                    question_id = f"q{manifest['next_id']}"
+                    manifest["next_id"] += 1
+                self._store(manifest, question_id, question)
+            self._write_manifest(manifest)
+        return True
+
+    def seed(self, questions):
+        """
+        Merge the questions listed in the config file (kept under version control) into
+        the bank without ever dropping either side's changes. The bank remembers each
+        question as last seeded (seed.json), so only fields changed in the config since
+        then are applied; edits made in the app to other fields are kept, and questions
+        deleted in the app stay deleted. Banks created before seed.json existed only gain
+        the fields their questions lack (e.g. a newly added "scene").
+        Returns the IDs of the questions added or updated.
+        """
+        seed_path = os.path.join(self.directory, "seed.json")
+        changed = []
+        with file_lock(self.manifest_path):
+            manifest = self._load_manifest_for_write()
+            fresh = manifest is None
+            if fresh:
+                manifest = self._empty_manifest()
+                numbers = [int(q["id"][1:]) for q in questions if str(q.get("id", ""))[1:].isdigit()]
+                manifest["next_id"] = max(numbers, default=0) + 1
+            try:
+                with open(seed_path) as f:
+                    seeded = json.load(f)  # config id -> {"id": bank id, "question": as last seeded}
+            except FileNotFoundError:
+                seeded = None
+            merged = {}
+            for question in questions:
+                config_id = _seed_key(question)
+                # Identical questions without IDs are told apart by their order
+                duplicates = 1
+                while config_id in merged:
+                    duplicates += 1
+                    config_id = f"{_seed_key(question)}#{duplicates}"
+                previous = (seeded or {}).get(config_id)
+                bank_id = previous["id"] if previous else question.get("id")
+                current = None
+                if bank_id in manifest["questions"]:
+                    try:
+                        with open(self._question_path(bank_id)) as f:
+                            current = json.load(f)
+                    except (FileNotFoundError, ValueError):
+                        current = None
+                if previous is None and (fresh or seeded is not None):
+                    # New in the config: add it, under a fresh ID if the app already used this one
+                    if not bank_id or current is not None:
+                        bank_id = f"q{manifest['next_id']}"
+                        manifest["next_id"] += 1
+                    self._store(manifest, bank_id, question)
+                    changed.append(bank_id)
+                elif current is not None:
+                    if previous is None:
+                        updates = {k: v for k, v in question.items() if k not in current}
+                    else:
+                        updates = {k: v for k, v in question.items() if previous["question"].get(k) != v}
+                    updates.pop("id", None)
+                    if updates:
+                        self._store(manifest, bank_id, dict(current, **updates))
+                        changed.append(bank_id)
+                merged[config_id] = {"id": bank_id, "question": question}
+            if changed or fresh:
+                self._write_manifest(manifest)
+            if merged != seeded:
+                atomic_write(seed_path, json.dumps(merged))
+        return changed
+
+question_bank = TenantScoped(lambda tenant_id: QuestionBank(tenant_path("question_bank", tenant_id=tenant_id)))
@@ -0,0 +1,120 @@
+import math
+import random
+import threading
+import zlib
+from fractions import Fraction
+
+from tenants import current_tenant
+
+class AssignmentSchedule:
+    """
+    Precomputed table of question sets for balanced exposure.
+
+    Each question gets a share of the places in every set in proportion to its
+    weight. No question can be in a set twice, so a weight too large for that is
+    capped at every set and the others split the remaining places by weight.
+    The table has just enough rows for every share to be a whole number of
+    appearances, laid out by a smooth weighted round-robin so heavier
+    questions are spread evenly. Each group (e.g. a company) walks the table
+    with its own counter, so picking a set at session start is a single lookup
+    and, over a full cycle, every question is shown exactly its share.
+    """
+
+    # Longest table built; very uneven weights are rounded to fit
+    MAX_ROWS = 10000
+
+    def __init__(self, questions, per_participant=1, seed=None):
+        ids = [q.get("id") for q in questions if q.get("id")]
+        weights = {q.get("id"): _weight(q) for q in questions if q.get("id")}
+        self.per_participant = max(1, min(int(per_participant), len(ids))) if ids else 0
+        order = list(ids)
+        random.Random(seed).shuffle(order)
+        self.table = self._build_table(order, weights, self.per_participant)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _shares(cls, order, weights, per_participant):
+        """Fraction of sets each question is in: by weight, at most every set."""
+        shares = {}
+        remaining = list(order)
+        places = per_participant
+        while remaining:
+            total = sum(weights[q] for q in remaining)
+            capped = [q for q in remaining if weights[q] * places >= total]
+            if not capped:
+                for q in remaining:
+                    shares[q] = Fraction(weights[q] * places, total)
+                break
+            for q in capped:
+                shares[q] = Fraction(1)
+            places -= len(capped)
+            remaining = [q for q in remaining if q not in capped]
+        return shares
+
+    @classmethod
+    def _build_table(cls, order, weights, per_participant):
+        if not order:
+            return []
+        shares = cls._shares(order, weights, per_participant)
+        rows = 1
+        for share in shares.values():
+            rows = rows * share.denominator // math.gcd(rows, share.denominator)
+        if rows > cls.MAX_ROWS:
+            shares = {q: share.limit_denominator(cls.MAX_ROWS // len(order) or 1) for q, share in shares.items()}
+            rows = cls.MAX_ROWS // len(order) or 1
+        counts = {q: int(shares[q] * rows) for q in order}
+        # Rounding (only for very uneven weights) can leave places over or short: fix up the largest
+        while sum(counts.values()) != per_participant * rows:
+            step = 1 if sum(counts.values()) < per_participant * rows else -1
+            q = max(order, key=lambda q: (counts[q] < rows) if step > 0 else counts[q])
+            counts[q] += step
+
+        # Smooth weighted round-robin, N at a time: each row takes the N questions with
+        # the most credit, so each appears counts[q] times over the table, evenly spread
+        current = {q: 0 for q in order}
+        table = []
+        for _ in range(rows):
+            for q in order:
+                current[q] += counts[q]
+            row = sorted(order, key=lambda q: -current[q])[:per_participant]
+            for q in row:
+                current[q] -= rows
+            table.append(tuple(row))
+        return table
+
+    def assign(self, group=""):
+        """Return the next question ID set for a group."""
+        if not self.table:
+            return []
+        with self._lock:
+            if group not in self._counters:
+                # Stagger groups so they don't all start on the same row
+                self._counters[group] = zlib.crc32(group.encode("utf-8")) % len(self.table)
+            index = self._counters[group]
+            self._counters[group] = (index + 1) % len(self.table)
+        return list(self.table[index])
+
+def _weight(question):
+    """A question's weight as a whole number of at least 1; anything unreadable counts as 1."""
+    try:
+        return max(int(float(question.get("weight", 1) or 1)), 1)
+    except (TypeError, ValueError):
+        return 1
+
+_schedules = {}  # tenant -> (question set key, schedule)
+_schedule_lock = threading.Lock()
+
+def get_schedule(questions, per_participant=1):
+    """Return the current tenant's schedule, rebuilding it only when its question set changes."""
+    key = (tuple((q.get("id"), q.get("weight", 1)) for q in questions), int(per_participant))
+    tenant_id = current_tenant()
+    with _schedule_lock:
+        entry = _schedules.get(tenant_id)
+        if entry is None or entry[0] != key:
+            entry = _schedules[tenant_id] = (key, AssignmentSchedule(questions, per_participant))
+        return entry[1]
+
+def assign_questions(questions, per_participant=1, group=""):
+    """Pick the question IDs for a new participant in the given group."""
+    return get_schedule(questions, per_participant).assign(group)
@@ -1,179 +1,340 @@
+import contextvars
 import json
+import logging
 import os
-from PIL import Image
+import threading
+from io import BytesIO
 import streamlit as st
+import assets
+import shared_state
+from perf import timed
+from question_bank import question_bank
+from shared_state import atomic_write, bump_generation, file_lock
+from tenants import DEFAULT_TENANT, TENANTS_DIR, current_tenant, tenant_dir, tenant_path, tenant_topic
 
-# Configuration file paths
-CONFIG_DIR = "data"
-CONFIG_FILE = os.path.join(CONFIG_DIR, "quiz_config.json")
-QUESTIONS_DIR = os.path.join(CONFIG_DIR, "questions")
+log = logging.getLogger(__name__)
+
+# Configuration file paths, inside the current tenant's data directory
+def config_file():
+    return tenant_path("quiz_config.json")
+
+def questions_dir():
+    """Where the current tenant's scenario images are saved."""
+    return tenant_path("questions")
+
+def _image_file(question_id):
+    return tenant_path("questions", f"{question_id}_image.png")
+
+def _legacy_image_file():
+    # Single-question configs kept their image here
+    return tenant_path("scenario_image.png")
+
+def _thumbnail_dir():
+    return tenant_path("thumbnails")
 
 # Default quiz configuration
 DEFAULT_CONFIG = {
     "passing_score": 9,
     "time_limit": 60,
-    "questions": [
-        {
-            "id": "q1",
-            "scenario_title": "Safety Scenario Question",
-            "question_text": "Describe the actions when your buddy trips and fall during a march and has difficulty walking but insists to carry on.",
-            "image_enabled": True,
-            "image_prompt": "Photorealistic scene of two NSF soldiers in modern SAF No.4 pixelated camouflage. One soldier is kneeling on a tarmac road, visibly injured, while the other supports/helps him. Distinctive Singapore pixel pattern, field pack with metal frame, black Frontier boots. Background: SAF training area with visible infrastructure during a route march.",
-            "image_file": "q1_image.png"
-        }
-    ]
+    "questions_per_participant": 1,
+    "grading_backend": "keyword",
 }
 
+# Questions are kept in the question bank (see question_bank.py); this seeds an empty one
+DEFAULT_QUESTIONS = [
+    {
+        "id": "q1",
+        "scenario_title": "Safety Scenario Question",
+        "question_text": "Describe the actions when your buddy trips and fall during a march and has difficulty walking but insists to carry on.",
+        "image_enabled": True,
+        "image_prompt": "Photorealistic scene of two NSF soldiers in modern SAF No.4 pixelated camouflage. One soldier is kneeling on a tarmac road, visibly injured, while the other supports/helps him. Distinctive Singapore pixel pattern, field pack with metal frame, black Frontier boots. Background: SAF training area with visible infrastructure during a route march.",
+        "image_file": "q1_image.png",
+        "scene": {"setting": "route_march", "props": ["field_pack", "water_bottle"], "casualties": 1, "helpers": 1}
+    }
+]
+
+_loaded = {}  # config file -> ((inode, mtime_ns, size), config) as last parsed
+
+@timed()
 def load_quiz_config():
     """Load quiz configuration from file or return defaults."""
     try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                
-                # Handle backward compatibility - convert old format to new
-                if "question_text" in config and "questions" not in config:
-                    # Old format - convert to new format with questions array
-                    old_question = {
-                        "id": "q1",
-                        "scenario_title": config.get("scenario_title", "Safety Scenario Question"),
-                        "question_text": config.get("question_text", ""),
-                        "image_enabled": config.get("image_enabled", True),
-                        "image_prompt": config.get("image_prompt", ""),
-                        "image_file": "q1_image.png"
-                    }
-                    config["questions"] = [old_question]
-                    # Remove old keys
-                    for key in ["question_text", "scenario_title", "image_enabled", "image_prompt"]:
-                        config.pop(key, None)
-                
-                # Merge with defaults to ensure all keys exist
-                for key, value in DEFAULT_CONFIG.items():
-                    if key not in config:
-                        config[key] = value
-                return config
+        path = config_file()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return DEFAULT_CONFIG.copy()
+        # The file is only parsed (and its questions seeded) again when it changes
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == stamp:
+            return dict(cached[1])
+        with open(path, 'r') as f:
+            config = json.load(f)
+            stat = os.fstat(f.fileno())
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        
+        # Handle backward compatibility - convert old format to new
+        if "question_text" in config and "questions" not in config:
+            # Old format - convert to new format with questions array
+            old_question = {
+                "id": "q1",
+                "scenario_title": config.get("scenario_title", "Safety Scenario Question"),
+                "question_text": config.get("question_text", ""),
+                "image_enabled": config.get("image_enabled", True),
+                "image_prompt": config.get("image_prompt", ""),
+                "image_file": "q1_image.png"
+            }
+            config["questions"] = [old_question]
+            # Remove old keys
+            for key in ["question_text", "scenario_title", "image_enabled", "image_prompt"]:
+                config.pop(key, None)
+        
+        # Questions listed in the config file seed the question bank; the file itself is left alone
+        questions = config.pop("questions", None)
+        if questions:
+            _seed_questions(questions, path, stamp)
+        
+        # Merge with defaults to ensure all keys exist
+        for key, value in DEFAULT_CONFIG.items():
+            if key not in config:
+                config[key] = value
+        _loaded[path] = (stamp, config)
+        return dict(config)
     except Exception as e:
         st.error(f"Error loading quiz config: {e}")
     
     return DEFAULT_CONFIG.copy()
 
+_seeded = {}  # config file -> (inode, mtime_ns, size) when its questions were last merged into the bank
+_seed_lock = threading.Lock()
+
+def _seed_questions(questions, path, stamp):
+    """Merge the questions of the config file at path into the bank, once per version (stamp) of the file."""
+    if _seeded.get(path) == stamp:
+        return
+    with _seed_lock:
+        if _seeded.get(path) == stamp:
+            return
+        # Grading picks up changed reference answers by their fingerprint
+        question_bank.seed(questions)
+        _seeded[path] = stamp
+
 def save_quiz_config(config):
     """Save quiz configuration to file."""
     try:
         # Ensure directory exists
-        if not os.path.exists(CONFIG_DIR):
-            os.makedirs(CONFIG_DIR)
+        if not os.path.exists(tenant_dir()):
+            os.makedirs(tenant_dir())
         
-        # Save configuration
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        # Save configuration; replaced atomically so other replicas never read a partial file
+        with file_lock(config_file()):
+            config = _keep_seed_questions(config)
+            atomic_write(config_file(), json.dumps(config, indent=2))
+        bump_generation(tenant_topic("config"))
+        
+        # Precompute reference-answer vectors now rather than on the first graded answer
+        import grading
+        grading.prepare_references(config)
         
         return True
     except Exception as e:
         st.error(f"Error saving quiz config: {e}")
         return False
 
+def _keep_seed_questions(config):
+    """Carry over the question list of the config file being replaced (it seeds the bank; see _seed_questions)."""
+    if "questions" in config:
+        return config
+    try:
+        with open(config_file()) as f:
+            questions = json.load(f).get("questions")
+    except (FileNotFoundError, ValueError, AttributeError):
+        return config
+    return dict(config, questions=questions) if questions else config
+
 def save_scenario_image(image, question_id="q1"):
     """Save the scenario image to file for a specific question."""
     try:
         # Ensure directory exists
-        if not os.path.exists(QUESTIONS_DIR):
-            os.makedirs(QUESTIONS_DIR)
+        if not os.path.exists(questions_dir()):
+            os.makedirs(questions_dir())
         
         # Save image with question ID
         if image:
-            image_file = os.path.join(QUESTIONS_DIR, f"{question_id}_image.png")
-            image.save(image_file, "PNG")
+            image_file = _image_file(question_id)
+            buffer = BytesIO()
+            image.save(buffer, "PNG")
+            atomic_write(image_file, buffer.getvalue())
+            assets.invalidate(image_file)
+            bump_generation(tenant_topic("images"))
             return True
     except Exception as e:
         st.error(f"Error saving image: {e}")
         return False
 
+def _scenario_image_path(question_id):
+    """Return the image file for a question, or None if it has no saved image."""
+    image_file = _image_file(question_id)
+    if assets.load_image(image_file) is not None:
+        return image_file
+    # Fallback to old location for backward compatibility
+    old_file = _legacy_image_file()
+    if question_id == "q1" and assets.load_image(old_file) is not None:
+        return old_file
+    return None
+
+@timed()
 def load_scenario_image(question_id="q1"):
     """Load the saved scenario image for a specific question if it exists."""
     try:
-        image_file = os.path.join(QUESTIONS_DIR, f"{question_id}_image.png")
-        if os.path.exists(image_file):
-            return Image.open(image_file)
-        # Fallback to old location for backward compatibility
-        old_file = os.path.join(CONFIG_DIR, "scenario_image.png")
-        if os.path.exists(old_file) and question_id == "q1":
-            return Image.open(old_file)
+        image_file = _scenario_image_path(question_id)
+        if image_file:
+            return assets.load_image(image_file)
     except Exception as e:
         st.error(f"Error loading image: {e}")
     return None
 
+def load_scenario_thumbnail(question_id="q1"):
+    """Small JPEG preview (bytes) of a question's saved image, or None if it has none."""
+    thumbnail = assets.load_thumbnail(_image_file(question_id),
+                                      directory=_thumbnail_dir())
+    if thumbnail is None and question_id == "q1":
+        # Fallback to old location for backward compatibility
+        thumbnail = assets.load_thumbnail(_legacy_image_file(), directory=_thumbnail_dir())
+    return thumbnail
+
+def prefetch_scenario_images(question_ids):
+    """Decode the saved images for the given questions into the asset cache in the background."""
+    def _prefetch():
+        for question_id in question_ids:
+            try:
+                _scenario_image_path(question_id)
+            except Exception:
+                log.exception("Error prefetching image for %s", question_id)
+
+    # The thread resolves image paths for the caller's tenant
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(_prefetch,), name="image-prefetch", daemon=True)
+    thread.start()
+    return thread
+
 def delete_scenario_image(question_id="q1"):
     """Delete the saved scenario image for a specific question."""
     try:
-        image_file = os.path.join(QUESTIONS_DIR, f"{question_id}_image.png")
+        image_file = _image_file(question_id)
         if os.path.exists(image_file):
             os.remove(image_file)
+            assets.invalidate(image_file)
+            bump_generation(tenant_topic("images"))
             return True
         # Also try old location for backward compatibility
-        old_file = os.path.join(CONFIG_DIR, "scenario_image.png")
+        old_file = _legacy_image_file()
         if os.path.exists(old_file) and question_id == "q1":
             os.remove(old_file)
+            assets.invalidate(old_file)
+            bump_generation(tenant_topic("images"))
             return True
     except Exception as e:
         st.error(f"Error deleting image: {e}")
     return False
 
+# Images saved or deleted by another replica: drop this process's cached copies of that tenant's images
+def _invalidate_tenant_images():
+    # The default tenant's directory holds every other tenant's, which keep their images
+    exclude = [TENANTS_DIR] if current_tenant() == DEFAULT_TENANT else []
+    assets.invalidate(directory=tenant_dir(), exclude=exclude)
+
+shared_state.on_change("images", _invalidate_tenant_images)
+
+def _ensure_question_bank():
+    """Create the question bank on first use, from the old config file or the default question."""
+    if question_bank.exists():
+        return
+    load_quiz_config()
+    if not question_bank.exists():
+        question_bank.import_questions(DEFAULT_QUESTIONS)
+
+def list_questions():
+    """
+    Lightweight summaries (id, scenario_title, weight, image_enabled) of every question.
+    Read from the bank's manifest, so listing never loads the questions themselves.
+    """
+    _ensure_question_bank()
+    return question_bank.summaries()
+
+def question_count():
+    _ensure_question_bank()
+    return question_bank.count()
+
 def get_all_questions():
-    """Get all questions from the configuration."""
-    config = load_quiz_config()
-    return config.get("questions", [])
+    """Get all questions from the question bank."""
+    _ensure_question_bank()
+    return question_bank.all()
 
 def get_question_by_id(question_id):
-    """Get a specific question by its ID."""
-    questions = get_all_questions()
-    for q in questions:
-        if q.get("id") == question_id:
-            return q
-    return None
+    """Get a specific question by its ID, loading only that question."""
+    _ensure_question_bank()
+    return question_bank.get(question_id)
+
+def _questions_changed(references_changed):
+    """Follow-up after a question edit: rebuild the grading references if they changed."""
+    if references_changed:
+        import grading
+        grading.prepare_references(load_quiz_config())
+
+def update_quiz_config(change):
+    """
+    Apply change(config) to the latest saved config and save it, holding the config
+    lock throughout so concurrent edits from other replicas aren't lost.
+    change returns the value to pass back, or False to skip saving.
+    """
+    with file_lock(config_file()):
+        config = load_quiz_config()
+        result = change(config)
+        if result is False:
+            return False
+        return save_quiz_config(config) and result
 
 def add_question(question):
-    """Add a new question to the configuration."""
-    config = load_quiz_config()
-    if "questions" not in config:
-        config["questions"] = []
-    
-    # Generate new ID
-    existing_ids = [q.get("id", "") for q in config["questions"]]
-    new_id = f"q{len(existing_ids) + 1}"
-    while new_id in existing_ids:
-        new_id = f"q{int(new_id[1:]) + 1}"
-    
+    """Add a new question to the question bank. Returns (success, new id)."""
+    _ensure_question_bank()
+    try:
+        new_id, references_changed = question_bank.add(question)
+    except OSError as e:
+        st.error(f"Error saving question: {e}")
+        return False, None
     question["id"] = new_id
-    config["questions"].append(question)
-    return save_quiz_config(config), new_id
+    _questions_changed(references_changed)
+    return True, new_id
 
 def update_question(question_id, updated_question):
     """Update an existing question."""
-    config = load_quiz_config()
-    questions = config.get("questions", [])
-    
-    for i, q in enumerate(questions):
-        if q.get("id") == question_id:
-            updated_question["id"] = question_id
-            questions[i] = updated_question
-            config["questions"] = questions
-            return save_quiz_config(config)
-    return False
+    _ensure_question_bank()
+    try:
+        found, references_changed = question_bank.update(question_id, updated_question)
+    except OSError as e:
+        st.error(f"Error saving question: {e}")
+        return False
+    if found:
+        updated_question["id"] = question_id
+        _questions_changed(references_changed)
+    return found
 
 def delete_question(question_id):
     """Delete a question and its associated image."""
-    config = load_quiz_config()
-    questions = config.get("questions", [])
-    
+    _ensure_question_bank()
     # Don't delete if it's the only question
-    if len(questions) <= 1:
+    if question_bank.count() <= 1:
+        return False
+    try:
+        found, references_changed = question_bank.delete(question_id)
+    except OSError as e:
+        st.error(f"Error deleting question: {e}")
+        return False
+    if not found:
         return False
-    
-    # Remove the question
-    config["questions"] = [q for q in questions if q.get("id") != question_id]
-    
     # Delete associated image if exists
     delete_scenario_image(question_id)
-    
-    return save_quiz_config(config)
\ No newline at end of file
+    _questions_changed(references_changed)
+    return True
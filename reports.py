@@ -0,0 +1,207 @@
+import hashlib
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from perf import metrics
+from shared_state import REPLICA_ID
+from tenants import tenant_path
+
+# Report bundles for commanders: one workbook per unit and company, plus a
+# summary workbook across all of them, zipped into a single download.
+# Workbooks are written by worker processes straight to a scratch directory
+# and copied into the zip on disk one at a time as they finish, so the bundle
+# is never held in memory while it is being built.
+
+def bundle_path():
+    """Where this replica keeps the current tenant's last bundle."""
+    return tenant_path("reports", f"report-bundle-{REPLICA_ID}.zip")
+
+# Below this many rows, starting worker processes costs more than it saves
+PARALLEL_MIN_ROWS = 5000
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+GROUP_COLUMNS = ["UNIT", "COY"]
+SUMMARY_FILE = "summary.xlsx"
+
+REPORT_SECONDS = "quiz_report_bundle_seconds"
+metrics.describe(REPORT_SECONDS, "Time to build a report bundle")
+
+def group_file_name(unit, coy):
+    """
+    File name of a unit/company workbook inside the bundle. Sanitizing can map different
+    names to the same text ("1 SIR"/"A" and "1"/"SIR A"), so a hash of the pair keeps it unique.
+    """
+    name = re.sub(r"[^A-Za-z0-9]+", "_", f"{unit} {coy}").strip("_")
+    digest = hashlib.sha256(f"{unit}\0{coy}".encode("utf-8")).hexdigest()[:8]
+    return f"{name or 'unknown'}_{digest}.xlsx"
+
+def partition(df):
+    """[(unit, coy, rows)] for each unit and company, with rows as plain lists in df column order."""
+    df = df.copy()
+    for column in GROUP_COLUMNS:
+        df[column] = df[column].fillna("Unknown").astype(str)
+    # Plain lists pickle far faster than DataFrames when sent to workers
+    df = df.astype(object).where(df.notna(), None)
+    return [(unit, coy, group.values.tolist()) for (unit, coy), group in df.groupby(GROUP_COLUMNS, sort=True)]
+
+def _platoon_rows(columns, rows, pass_mark):
+    """[platoon, participants, average score, passed] per platoon."""
+    platoon_at, score_at = columns.index("PLATOON"), columns.index("Score")
+    platoons = {}
+    for row in rows:
+        stats = platoons.setdefault(str(row[platoon_at]), [0, 0.0, 0])
+        score = _score(row[score_at])
+        stats[0] += 1
+        stats[1] += score
+        stats[2] += score >= pass_mark
+    return [[platoon, n, round(total / n, 2), passed] for platoon, (n, total, passed) in sorted(platoons.items())]
+
+def _score(value):
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(score) else score
+
+def _write_group_workbook(path, unit, coy, columns, rows, pass_mark):
+    """
+    Write one unit/company workbook: every submission, a per-platoon summary and a chart of it.
+    Runs in a worker process. Returns (unit, coy, participants, average score, passed).
+    """
+    import xlsxwriter
+    # constant_memory streams each row to disk as it is written
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True})
+    bold = workbook.add_format({"bold": True})
+
+    sheet = workbook.add_worksheet("Participants")
+    sheet.write_row(0, 0, columns, bold)
+    # Typed writes skip xlsxwriter's per-cell guessing of numbers, formulas and URLs in strings
+    write_string, write_number, write_boolean = sheet.write_string, sheet.write_number, sheet.write_boolean
+    for r, row in enumerate(rows, start=1):
+        for c, value in enumerate(row):
+            if isinstance(value, str):
+                write_string(r, c, value)
+            elif isinstance(value, bool):
+                write_boolean(r, c, value)
+            elif isinstance(value, (int, float)):
+                write_number(r, c, value)
+            elif value is not None:
+                write_string(r, c, str(value))
+
+    platoons = _platoon_rows(columns, rows, pass_mark)
+    summary = workbook.add_worksheet("Summary")
+    summary.write_row(0, 0, ["Platoon", "Participants", "Average Score", f"Passed (>= {pass_mark})"], bold)
+    for r, row in enumerate(platoons, start=1):
+        summary.write_row(r, 0, row)
+    if platoons:
+        chart = workbook.add_chart({"type": "column"})
+        last = len(platoons)
+        for col, name in ((1, "Participants"), (3, "Passed")):
+            chart.add_series({
+                "name": name,
+                "categories": ["Summary", 1, 0, last, 0],
+                "values": ["Summary", 1, col, last, col],
+            })
+        chart.set_title({"name": f"{unit} - {coy} by Platoon"})
+        chart.set_x_axis({"name": "Platoon"})
+        summary.insert_chart("F2", chart)
+    workbook.close()
+
+    participants = len(rows)
+    score_at = columns.index("Score")
+    total = sum(_score(row[score_at]) for row in rows)
+    passed = sum(row[3] for row in platoons)
+    return unit, coy, participants, round(total / participants, 2) if participants else 0.0, passed
+
+def _write_summary_workbook(path, groups, pass_mark):
+    """The cross-unit summary: one row per unit and company with a chart of completions and passes."""
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(path)
+    bold = workbook.add_format({"bold": True})
+    sheet = workbook.add_worksheet("Summary")
+    sheet.write_row(0, 0, ["UNIT", "COY", "Participants", "Average Score", f"Passed (>= {pass_mark})"], bold)
+    for r, row in enumerate(groups, start=1):
+        sheet.write_row(r, 0, row)
+    if groups:
+        chart = workbook.add_chart({"type": "bar"})
+        last = len(groups)
+        for col, name in ((2, "Participants"), (4, "Passed")):
+            chart.add_series({
+                "name": name,
+                "categories": ["Summary", 1, 0, last, 1],
+                "values": ["Summary", 1, col, last, col],
+            })
+        chart.set_title({"name": "Completion by Unit and Company"})
+        chart.set_size({"width": 720, "height": max(300, 24 * last)})
+        sheet.insert_chart("G2", chart)
+    workbook.close()
+
+def build_report_bundle(df, destination=None, pass_mark=9, workers=None):
+    """
+    Write a zip of per-unit/company workbooks and a summary workbook for the submissions in df.
+    Large datasets are rendered on a process pool (workers=1 forces a single process).
+    Returns {groups, rows, workers, seconds, bytes}.
+    """
+    start = time.perf_counter()
+    destination = destination or bundle_path()
+    columns = [str(c) for c in df.columns]
+    groups = partition(df)
+    if workers is None:
+        workers = MAX_WORKERS if len(df) >= PARALLEL_MIN_ROWS else 1
+    workers = max(1, min(workers, len(groups)))
+
+    # Absolute, so workers write to the right place whatever their working directory
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix=".report-", dir=directory)
+    partial = os.path.join(scratch, "bundle.zip")
+    try:
+        jobs = [(os.path.join(scratch, group_file_name(unit, coy)), unit, coy, columns, rows, pass_mark)
+                for unit, coy, rows in groups]
+        totals = []
+        # Workbooks are already compressed, so they are stored in the zip as they are
+        with zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as bundle:
+            def add(path, result):
+                bundle.write(path, os.path.basename(path))
+                os.remove(path)
+                totals.append(result)
+
+            if workers == 1:
+                for job in jobs:
+                    add(job[0], _write_group_workbook(*job))
+            else:
+                import multiprocessing
+                # Forking a server with running threads is unsafe, so workers start fresh
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    futures = {pool.submit(_write_group_workbook, *job): job[0] for job in jobs}
+                    for future in as_completed(futures):
+                        add(futures[future], future.result())
+
+            summary_path = os.path.join(scratch, SUMMARY_FILE)
+            _write_summary_workbook(summary_path, sorted(totals), pass_mark)
+            bundle.write(summary_path, SUMMARY_FILE)
+        os.replace(partial, destination)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    seconds = time.perf_counter() - start
+    metrics.observe(REPORT_SECONDS, seconds, workers=str(workers))
+    return {
+        "groups": len(groups),
+        "rows": len(df),
+        "workers": workers,
+        "seconds": seconds,
+        "bytes": os.path.getsize(destination),
+    }
+
+def read_report_bundle(path=None):
+    """The last bundle built by this replica, read only when it is downloaded."""
+    with open(path or bundle_path(), "rb") as f:
+        return f.read()
@@ -0,0 +1,311 @@
+import bisect
+import csv
+import io
+import os
+import re
+import threading
+
+from shared_state import atomic_write, file_lock
+from tenants import COYS, PLATOONS, TenantScoped, tenant_path, tenant_units
+
+# The nominal roll of each tenant: everyone expected to take the quiz.
+# Participants pick their name from it instead of typing it, and submissions
+# carry the roster ID of the person, so the admin page can join submissions to
+# the roster on that exact key.
+#
+# The roster is held as sorted arrays searched with bisect: one of name words
+# and handles for prefix suggestions, and one of names keyed by platoon so a
+# platoon's names are one contiguous slice. Lookups stay well under a
+# millisecond for rosters of tens of thousands.
+
+ROSTER_COLUMNS = ["UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle"]
+REQUIRED_COLUMNS = ["UNIT", "COY", "PLATOON", "Rank Name"]
+MAX_SUGGESTIONS = 8
+
+_SEP = "\x1f"  # joins key parts; sorts before any printable character
+_NAME_RE = re.compile(r"[^a-z0-9@ ]+")
+
+def normalize_name(text):
+    """Case, punctuation and spacing differences never tell two names apart."""
+    return " ".join(_NAME_RE.sub(" ", str(text or "").lower()).split())
+
+def normalize_handle(handle):
+    handle = str(handle or "").strip().lower()
+    if not handle or handle == "nan":
+        return ""
+    return "@" + handle.lstrip("@")
+
+def roster_id(entry):
+    """A person's key: their Telegram handle, or their platoon and name if they have none."""
+    handle = normalize_handle(entry.get("Telegram Handle"))
+    if handle:
+        return handle
+    return _SEP.join([entry["UNIT"], entry["COY"], str(entry["PLATOON"]), normalize_name(entry["Rank Name"])])
+
+def _scope(unit, coy, platoon):
+    return _SEP.join([unit, coy, str(platoon)]) + _SEP
+
+class _Index:
+    """Immutable lookup structures for one version of the roster file."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_id = {entry["Roster ID"]: entry for entry in entries}
+        self.by_handle = {}  # handle -> (platoon scope, entry)
+        self.by_name = {}  # (platoon scope, normalized name) -> entry
+        self.by_spelling = {}  # (platoon scope, name as on the roster) -> entry, skipping normalization
+        prefixes, scoped = [], []
+        for entry in entries:
+            name = normalize_name(entry["Rank Name"])
+            scope = _scope(entry["UNIT"], entry["COY"], entry["PLATOON"])
+            handle = normalize_handle(entry.get("Telegram Handle"))
+            if handle:
+                self.by_handle[handle] = (scope, entry)
+                prefixes.append((handle, entry["Roster ID"]))
+            self.by_name[(scope, name)] = entry
+            self.by_spelling[(scope, entry["Rank Name"])] = entry
+            # Every word starts a key, so "tan" finds "PTE Tan Ah Kow"
+            words = name.split()
+            for i in range(len(words)):
+                prefixes.append((" ".join(words[i:]), entry["Roster ID"]))
+            scoped.append((scope + name, entry["Roster ID"]))
+        prefixes.sort()
+        scoped.sort()
+        self.prefix_keys = [key for key, _ in prefixes]
+        self.prefix_ids = [rid for _, rid in prefixes]
+        self.scoped_keys = [key for key, _ in scoped]
+        self.scoped_ids = [rid for _, rid in scoped]
+
+    def find(self, details):
+        scope = _scope(details.get("UNIT", ""), details.get("COY", ""), details.get("PLATOON", ""))
+        # Linked submissions carry the roster's own spelling, so most names match exactly
+        name = details.get("Rank Name")
+        entry = self.by_spelling.get((scope, name)) or self.by_name.get((scope, normalize_name(name)))
+        if entry is not None:
+            return entry
+        # A handle only counts in the participant's own platoon, so a mistyped handle can't claim someone elsewhere
+        handle_scope, entry = self.by_handle.get(normalize_handle(details.get("Telegram Handle")), (None, None))
+        return entry if handle_scope == scope else None
+
+    @staticmethod
+    def prefix_range(keys, prefix):
+        return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + "\uffff")
+
+class Roster:
+    """One tenant's roster, reloaded whenever its file changes (by any replica)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = _Index([])
+        self._stamp = None  # (inode, mtime_ns, size) of the file when last read
+
+    def _current(self):
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._stamp:
+            return self._index
+        with self._lock:
+            if stamp != self._stamp:
+                self._index = _Index(self._read() if stamp else [])
+                self._stamp = stamp
+            return self._index
+
+    def _read(self):
+        try:
+            with open(self.path, newline="", encoding="utf-8") as f:
+                entries = list(csv.DictReader(f))
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            entry["Roster ID"] = roster_id(entry)
+        return entries
+
+    # --- Queries ---
+
+    def exists(self):
+        return bool(self._current().entries)
+
+    def __len__(self):
+        return len(self._current().entries)
+
+    def entries(self):
+        return list(self._current().entries)
+
+    def get(self, rid):
+        return self._current().by_id.get(rid)
+
+    def suggest(self, text, limit=MAX_SUGGESTIONS, unit=None, coy=None, platoon=None):
+        """
+        Roster entries whose name (from any word) or Telegram handle starts with text,
+        optionally only those in one unit, company or platoon.
+        """
+        prefix = normalize_name(text)
+        if not prefix:
+            return []
+        index = self._current()
+        lo, hi = index.prefix_range(index.prefix_keys, prefix)
+        found, seen = [], set()
+        for rid in index.prefix_ids[lo:hi]:
+            if rid in seen:
+                continue
+            seen.add(rid)
+            entry = index.by_id[rid]
+            if ((unit and entry["UNIT"] != unit) or (coy and entry["COY"] != coy)
+                    or (platoon and str(entry["PLATOON"]) != str(platoon))):
+                continue
+            found.append(entry)
+            if len(found) >= limit:
+                break
+        return found
+
+    def platoon(self, unit, coy, platoon):
+        """Everyone on the roster in one platoon, in name order."""
+        index = self._current()
+        lo, hi = index.prefix_range(index.scoped_keys, _scope(unit, coy, platoon))
+        return [index.by_id[rid] for rid in index.scoped_ids[lo:hi]]
+
+    def find(self, details):
+        """The roster entry for a participant's details: by name in their platoon, else by Telegram handle in it."""
+        return self._current().find(details)
+
+    def match(self, records):
+        """
+        The roster ID of each record (participant details): the one saved with it when it
+        is still on the roster, else that of find(record). '' where there is none.
+        """
+        index = self._current()
+        ids = []
+        for record in records:
+            rid = record.get("Roster ID")
+            if not (rid and rid in index.by_id):
+                entry = index.find(record)
+                rid = entry["Roster ID"] if entry else ""
+            ids.append(rid)
+        return ids
+
+    # --- Updates ---
+
+    def save(self, rows):
+        """Replace the roster with rows (dicts with ROSTER_COLUMNS)."""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=ROSTER_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+        with file_lock(self.path):
+            atomic_write(self.path, buffer.getvalue())
+
+    def clear(self):
+        with file_lock(self.path):
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+roster = TenantScoped(lambda tenant_id: Roster(tenant_path("roster.csv", tenant_id=tenant_id)))
+
+def link_roster(details):
+    """
+    Set details' Roster ID when the participant is on the current tenant's roster,
+    and the roster's spelling of their name when it was their name that matched.
+    Returns their roster entry or None.
+    """
+    entry = roster.find(details)
+    details["Roster ID"] = entry["Roster ID"] if entry else ""
+    if entry and normalize_name(entry["Rank Name"]) == normalize_name(details.get("Rank Name")):
+        details["Rank Name"] = entry["Rank Name"]
+    return entry
+
+# --- Import ---
+
+def _column_key(name):
+    return "".join(ch for ch in str(name).lower() if ch.isalnum())
+
+def parse_roster(data, filename="roster.csv"):
+    """
+    Read an uploaded roster (CSV or Excel) for the current tenant.
+    Returns (rows, problems): the usable rows, and a message for each row left out.
+    """
+    if filename.lower().endswith((".xlsx", ".xls")):
+        import pandas as pd
+        df = pd.read_excel(io.BytesIO(data), dtype=str).fillna("")
+        records = df.to_dict("records")
+    else:
+        records = list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+    columns = {_column_key(column): column for column in ROSTER_COLUMNS}
+    missing = [column for column in REQUIRED_COLUMNS
+               if records and _column_key(column) not in {_column_key(k) for k in records[0]}]
+    if missing:
+        return [], [f"Missing column(s): {', '.join(missing)}"]
+
+    units = set(tenant_units())
+    rows, problems = [], []
+    seen_handles, seen_names = {}, {}
+    for line, record in enumerate(records, start=2):  # line 1 is the header
+        row = {column: "" for column in ROSTER_COLUMNS}
+        for key, value in record.items():
+            column = columns.get(_column_key(key))
+            if column:
+                row[column] = str(value if value is not None else "").strip()
+        if not any(row.values()):
+            continue
+        if not all(row[column] for column in REQUIRED_COLUMNS):
+            problems.append(f"Line {line}: missing {', '.join(c for c in REQUIRED_COLUMNS if not row[c])}")
+            continue
+        if row["UNIT"] not in units:
+            problems.append(f"Line {line}: unknown UNIT {row['UNIT']!r}")
+            continue
+        if row["COY"] not in COYS or row["PLATOON"] not in PLATOONS:
+            problems.append(f"Line {line}: unknown COY or PLATOON ({row['COY']}, {row['PLATOON']})")
+            continue
+        handle = normalize_handle(row["Telegram Handle"])
+        if handle and handle in seen_handles:
+            problems.append(f"Line {line}: Telegram Handle {row['Telegram Handle']} is already on line {seen_handles[handle]}")
+            continue
+        name_key = (row["UNIT"], row["COY"], row["PLATOON"], normalize_name(row["Rank Name"]))
+        if name_key in seen_names:
+            problems.append(f"Line {line}: {row['Rank Name']} is already on line {seen_names[name_key]}")
+            continue
+        if handle:
+            row["Telegram Handle"] = handle
+            seen_handles[handle] = line
+        seen_names[name_key] = line
+        rows.append(row)
+    return rows, problems
+
+# --- Joins ---
+
+def _cell(value):
+    """A CSV value as read by pandas, back to the text it was saved as."""
+    if value is None or value != value:  # NaN
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # PLATOON in a column with gaps
+    return str(value)
+
+def roster_ids(df):
+    """The roster ID of each submission in df (see Roster.match)."""
+    keys = [column for column in ROSTER_COLUMNS + ["Roster ID"] if column in df.columns]
+    columns = [[v if v.__class__ is str else _cell(v) for v in df[key].tolist()] for key in keys]
+    return roster.match([dict(zip(keys, values)) for values in zip(*columns)])
+
+def completion(df):
+    """
+    Join submissions to the roster. Returns (summary, outstanding, unmatched):
+    roster size, people who have submitted and people outstanding per platoon;
+    the roster entries with no submission; and the submissions of people not on the roster.
+    """
+    import pandas as pd
+    ids = roster_ids(df) if not df.empty else []
+    entries = pd.DataFrame(roster.entries(), columns=ROSTER_COLUMNS + ["Roster ID"])
+    entries["Completed"] = entries["Roster ID"].isin(set(ids))
+    summary = (entries.groupby(["UNIT", "COY", "PLATOON"])
+               .agg(Roster=("Roster ID", "size"), Completed=("Completed", "sum"))
+               .reset_index())
+    summary["Outstanding"] = summary["Roster"] - summary["Completed"]
+    outstanding = entries.loc[~entries["Completed"], ROSTER_COLUMNS]
+    unmatched = df.loc[[rid == "" for rid in ids]] if ids else df.iloc[0:0]
+    return summary, outstanding, unmatched
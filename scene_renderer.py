@@ -0,0 +1,301 @@
+import json
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Offline scene renderer: draws a question's scenario from a small spec
+# (setting, props, casualties) with no network access. Backgrounds and
+# sprites are drawn once and cached, and finished scenes are cached per spec,
+# so a render is a few image pastes at most.
+#
+# A question's spec lives under its "scene" key, e.g.
+#   {"setting": "vehicle", "props": ["overturned_vehicle", "cone"], "casualties": 1, "helpers": 1}
+# Questions without one get a spec inferred from their title and text.
+
+# Name of the renderer in the image model menus
+PROCEDURAL_MODEL = "Procedural (Offline)"
+
+WIDTH, HEIGHT = 800, 400
+GROUND_Y = 320
+
+SETTINGS = {
+    "route_march": "Route march",
+    "vehicle": "Vehicle movement",
+    "bunk": "Bunk",
+    "range": "Live firing range",
+    "field": "Field camp",
+    "camp": "Camp",
+}
+
+PROPS = {
+    "overturned_vehicle": "Overturned vehicle",
+    "tonner": "Tonner",
+    "fallen_cupboard": "Fallen cupboard",
+    "bunk_bed": "Bunk bed",
+    "rifle": "Rifle",
+    "stretcher": "Stretcher",
+    "water_bottle": "Water bottle",
+    "cone": "Traffic cone",
+    "warning_sign": "Warning sign",
+    "field_pack": "Field pack",
+}
+
+MAX_PEOPLE = 4
+PROP_SLOTS = (560, 700, 100, 760)  # horizontal centres, filled in order
+
+UNIFORM = (107, 122, 74)
+UNIFORM_DARK = (74, 93, 35)
+VEST = (61, 74, 46)
+SKIN = (212, 165, 116)
+INJURY = (220, 20, 20)
+
+DEFAULT_ACTION = "Action Required: Ensure own safety, assess the casualty, alert Safety IC/Medic"
+
+# --- Specs ---
+
+_KEYWORDS = [
+    # (words in the question, setting, props)
+    (("vehicle", "overturn", "tonner", "rover"), "vehicle", ["overturned_vehicle", "cone", "warning_sign"]),
+    (("cupboard", "locker", "bunk"), "bunk", ["fallen_cupboard", "bunk_bed"]),
+    (("range", "rifle", "weapon", "firing"), "range", ["rifle", "warning_sign"]),
+    (("heat", "water", "hydrat"), "field", ["water_bottle", "stretcher"]),
+    (("field", "jungle", "outfield"), "field", ["field_pack"]),
+    (("march", "route", "trip", "fall"), "route_march", ["field_pack", "water_bottle"]),
+]
+
+def infer_scene(question):
+    """A scene spec for a question that doesn't define one, from keywords in its title and text."""
+    text = f"{question.get('scenario_title', '')} {question.get('question_text', '')}".lower()
+    for words, setting, props in _KEYWORDS:
+        if any(word in text for word in words):
+            return {"setting": setting, "props": list(props), "casualties": 1, "helpers": 1}
+    return {"setting": "camp", "props": ["warning_sign"], "casualties": 1, "helpers": 1}
+
+def scene_for(question):
+    """The question's scene spec with defaults filled in and unknown values dropped."""
+    question = question or {}
+    spec = dict(question.get("scene") or infer_scene(question))
+    setting = spec.get("setting") if spec.get("setting") in SETTINGS else "camp"
+    casualties = max(0, min(int(spec.get("casualties", 1) or 0), MAX_PEOPLE))
+    helpers = max(0, min(int(spec.get("helpers", 1) or 0), MAX_PEOPLE - casualties))
+    return {
+        "setting": setting,
+        "props": [p for p in spec.get("props", []) if p in PROPS],
+        "casualties": casualties,
+        "helpers": helpers,
+        "title": spec.get("title") or question.get("scenario_title", "Safety Scenario"),
+        "action": spec.get("action") or DEFAULT_ACTION,
+    }
+
+def render_scene(question):
+    """Render the question's scenario as an RGB image. Identical specs reuse one render."""
+    spec = scene_for(question)
+    return _render(json.dumps(spec, sort_keys=True)).copy()
+
+# --- Composition ---
+
+@lru_cache(maxsize=64)
+def _render(spec_json):
+    spec = json.loads(spec_json)
+    img = _background(spec["setting"]).copy()
+    # Props along the back of the scene, people in front of them
+    for center, prop in zip(PROP_SLOTS, spec["props"]):
+        sprite = _prop(prop)
+        x = center - sprite.width // 2
+        img.alpha_composite(sprite, (max(0, min(WIDTH - sprite.width, x)), GROUND_Y - sprite.height + 10))
+    people = [("casualty", n) for n in range(spec["casualties"])] + [("helper", n) for n in range(spec["helpers"])]
+    for slot, (role, _) in enumerate(people):
+        sprite = _person("lying" if role == "casualty" else "kneeling" if slot < 2 * spec["casualties"] else "standing")
+        x = 200 + slot * 110
+        img.alpha_composite(sprite, (x, GROUND_Y - sprite.height + 18))
+    _overlay_text(img, spec)
+    return img.convert("RGB")
+
+def _overlay_text(img, spec):
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([(0, 0), (WIDTH, 44)], fill=(255, 255, 255, 210))
+    draw.text((16, 10), f"SAF Safety Scenario: {spec['title']}", fill=(0, 0, 128), font=_font(22))
+    draw.rectangle([(0, HEIGHT - 40), (WIDTH, HEIGHT)], fill=(255, 255, 255, 210))
+    draw.text((16, HEIGHT - 30), spec["action"], fill=(139, 0, 0), font=_font(15))
+
+@lru_cache(maxsize=8)
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has one fixed-size default font
+        return ImageFont.load_default()
+
+# --- Backgrounds ---
+
+@lru_cache(maxsize=None)
+def _background(setting):
+    img = Image.new("RGBA", (WIDTH, HEIGHT), (200, 225, 245, 255))
+    draw = ImageDraw.Draw(img)
+    if setting == "bunk":
+        draw.rectangle([(0, 0), (WIDTH, GROUND_Y)], fill=(226, 222, 206))
+        draw.rectangle([(60, 80), (200, 190)], fill=(170, 205, 235), outline=(120, 110, 90), width=6)
+        draw.line([(130, 80), (130, 190)], fill=(120, 110, 90), width=4)
+        draw.rectangle([(0, GROUND_Y), (WIDTH, HEIGHT)], fill=(176, 160, 140))
+        for x in range(0, WIDTH, 50):
+            draw.line([(x, GROUND_Y), (x - 30, HEIGHT)], fill=(150, 136, 118), width=1)
+        return img
+    if setting == "field":
+        draw.rectangle([(0, 0), (WIDTH, GROUND_Y)], fill=(150, 190, 150))
+        for x in range(-20, WIDTH, 45):
+            draw.ellipse([(x, 90 + (x * 7) % 40), (x + 90, 240)], fill=(34, 110 + (x * 3) % 40, 34))
+        draw.rectangle([(0, GROUND_Y), (WIDTH, HEIGHT)], fill=(120, 95, 60))
+        draw.polygon([(300, HEIGHT), (380, GROUND_Y), (460, GROUND_Y), (560, HEIGHT)], fill=(150, 120, 80))
+        return img
+    # Outdoor settings share a sky and differ in ground and skyline
+    draw.rectangle([(0, 0), (WIDTH, 150)], fill=(180, 215, 245))
+    if setting == "range":
+        draw.rectangle([(0, 200), (WIDTH, GROUND_Y)], fill=(120, 160, 80))
+        draw.polygon([(0, 230), (200, 170), (600, 170), (WIDTH, 230)], fill=(140, 110, 70))
+        for x in range(120, 700, 110):
+            draw.rectangle([(x, 150), (x + 24, 190)], fill=(240, 240, 240), outline=(60, 60, 60))
+            draw.ellipse([(x + 6, 160), (x + 18, 172)], outline=(200, 0, 0), width=2)
+        draw.line([(740, 120), (740, 200)], fill=(80, 80, 80), width=3)
+        draw.polygon([(742, 120), (780, 132), (742, 144)], fill=(220, 0, 0))
+        draw.rectangle([(0, GROUND_Y), (WIDTH, HEIGHT)], fill=(150, 130, 90))
+        return img
+    if setting in ("vehicle", "camp"):
+        # Camp buildings with the green metal roofs
+        for x in range(30, WIDTH, 260):
+            draw.rectangle([(x, 140), (x + 200, 240)], fill=(235, 230, 215), outline=(150, 150, 140))
+            draw.polygon([(x - 15, 140), (x + 100, 100), (x + 215, 140)], fill=(60, 120, 70))
+            for wx in range(x + 20, x + 190, 45):
+                draw.rectangle([(wx, 170), (wx + 25, 195)], fill=(150, 180, 200))
+    else:
+        for x in range(20, WIDTH, 90):
+            draw.rectangle([(x + 25, 200), (x + 40, GROUND_Y - 60)], fill=(139, 69, 19))
+            draw.polygon([(x, 205), (x + 32, 120), (x + 65, 205)], fill=(34, 139, 34))
+    draw.rectangle([(0, 240), (WIDTH, GROUND_Y - 40)], fill=(120, 170, 90))
+    draw.rectangle([(0, GROUND_Y - 40), (WIDTH, HEIGHT)], fill=(90, 90, 95))
+    for x in range(0, WIDTH, 80):
+        draw.rectangle([(x, GROUND_Y + 20), (x + 40, GROUND_Y + 26)], fill=(235, 235, 235))
+    return img
+
+# --- Sprites ---
+
+@lru_cache(maxsize=None)
+def _person(pose):
+    """A soldier in No.4 uniform: lying (casualty), kneeling (helper) or standing."""
+    if pose == "lying":
+        img = Image.new("RGBA", (110, 50), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.ellipse([(25, 14), (80, 38)], fill=UNIFORM)
+        draw.rectangle([(38, 16), (62, 36)], fill=VEST)
+        draw.ellipse([(4, 16), (26, 36)], fill=SKIN)
+        draw.ellipse([(2, 14), (24, 24)], fill=UNIFORM_DARK)
+        draw.line([(78, 26), (106, 18)], fill=UNIFORM, width=6)
+        draw.line([(78, 30), (104, 40)], fill=UNIFORM, width=6)
+        draw.ellipse([(98, 34), (108, 44)], fill=INJURY)
+        draw.line([(40, 18), (30, 4)], fill=UNIFORM, width=5)
+        return img
+    if pose == "kneeling":
+        img = Image.new("RGBA", (70, 100), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.ellipse([(22, 2), (46, 26)], fill=SKIN)
+        draw.pieslice([(20, 0), (48, 20)], 180, 360, fill=UNIFORM_DARK)
+        draw.rounded_rectangle([(18, 24), (50, 66)], radius=8, fill=UNIFORM)
+        draw.rectangle([(22, 30), (46, 60)], fill=VEST)
+        draw.line([(22, 34), (4, 64)], fill=UNIFORM, width=6)  # reaching down to the casualty
+        draw.line([(46, 34), (60, 56)], fill=UNIFORM, width=6)
+        draw.line([(24, 64), (20, 96)], fill=UNIFORM, width=8)
+        draw.line([(44, 64), (66, 82)], fill=UNIFORM, width=8)
+        draw.line([(66, 82), (66, 98)], fill=UNIFORM, width=8)
+        return img
+    img = Image.new("RGBA", (50, 130), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse([(13, 2), (37, 26)], fill=SKIN)
+    draw.pieslice([(11, 0), (39, 20)], 180, 360, fill=UNIFORM_DARK)
+    draw.rounded_rectangle([(10, 24), (40, 76)], radius=8, fill=UNIFORM)
+    draw.rectangle([(14, 30), (36, 70)], fill=VEST)
+    draw.line([(12, 32), (2, 70)], fill=UNIFORM, width=6)
+    draw.line([(38, 32), (48, 70)], fill=UNIFORM, width=6)
+    draw.line([(18, 76), (16, 126)], fill=UNIFORM, width=8)
+    draw.line([(32, 76), (34, 126)], fill=UNIFORM, width=8)
+    return img
+
+@lru_cache(maxsize=None)
+def _prop(kind):
+    if kind == "overturned_vehicle":
+        img = Image.new("RGBA", (220, 120), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        # On its side: wheels face the viewer
+        draw.polygon([(10, 100), (30, 20), (200, 10), (215, 95)], fill=(85, 100, 60), outline=(40, 50, 30))
+        draw.rectangle([(60, 30), (110, 60)], fill=(120, 150, 170))
+        for x in (45, 170):
+            draw.ellipse([(x - 22, 60), (x + 22, 104)], fill=(30, 30, 30))
+            draw.ellipse([(x - 9, 73), (x + 9, 91)], fill=(120, 120, 120))
+        draw.polygon([(150, 8), (165, -10), (185, 6)], fill=(150, 150, 150, 160))  # smoke
+        return img
+    if kind == "tonner":
+        img = Image.new("RGBA", (230, 130), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([(70, 10), (225, 95)], fill=(85, 100, 60), outline=(40, 50, 30))
+        draw.rectangle([(5, 40), (75, 95)], fill=(95, 110, 65), outline=(40, 50, 30))
+        draw.rectangle([(15, 48), (55, 70)], fill=(150, 180, 200))
+        for x in (40, 150, 195):
+            draw.ellipse([(x - 18, 86), (x + 18, 122)], fill=(30, 30, 30))
+        return img
+    if kind == "fallen_cupboard":
+        img = Image.new("RGBA", (200, 70), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.polygon([(0, 60), (20, 10), (195, 25), (180, 68)], fill=(150, 110, 70), outline=(90, 60, 30))
+        draw.line([(100, 18), (92, 64)], fill=(90, 60, 30), width=2)
+        draw.ellipse([(110, 38), (118, 46)], fill=(220, 200, 80))
+        return img
+    if kind == "bunk_bed":
+        img = Image.new("RGBA", (170, 170), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        for x in (5, 160):
+            draw.rectangle([(x, 5), (x + 6, 168)], fill=(90, 90, 100))
+        for y in (50, 130):
+            draw.rectangle([(5, y), (166, y + 14)], fill=(110, 130, 90))
+            draw.rectangle([(12, y - 8), (50, y)], fill=(240, 240, 240))
+        return img
+    if kind == "rifle":
+        img = Image.new("RGBA", (120, 40), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([(0, 18), (90, 26)], fill=(40, 40, 40))
+        draw.rectangle([(60, 12), (100, 28)], fill=(60, 60, 60))
+        draw.polygon([(92, 14), (118, 18), (118, 36), (96, 28)], fill=(50, 50, 50))
+        draw.rectangle([(70, 26), (78, 38)], fill=(40, 40, 40))
+        return img
+    if kind == "stretcher":
+        img = Image.new("RGBA", (160, 30), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([(10, 8), (150, 18)], fill=(60, 90, 60))
+        draw.line([(0, 12), (160, 12)], fill=(120, 120, 120), width=3)
+        draw.line([(20, 18), (20, 28)], fill=(120, 120, 120), width=3)
+        draw.line([(140, 18), (140, 28)], fill=(120, 120, 120), width=3)
+        return img
+    if kind == "water_bottle":
+        img = Image.new("RGBA", (24, 44), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rounded_rectangle([(2, 8), (22, 42)], radius=5, fill=(74, 93, 35))
+        draw.rectangle([(8, 0), (16, 8)], fill=(30, 30, 30))
+        return img
+    if kind == "cone":
+        img = Image.new("RGBA", (40, 50), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.polygon([(20, 0), (6, 44), (34, 44)], fill=(255, 120, 0))
+        draw.polygon([(14, 18), (26, 18), (29, 28), (11, 28)], fill=(255, 255, 255))
+        draw.rectangle([(0, 44), (40, 50)], fill=(255, 120, 0))
+        return img
+    if kind == "warning_sign":
+        img = Image.new("RGBA", (60, 100), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([(28, 40), (32, 100)], fill=(100, 100, 100))
+        draw.polygon([(30, 0), (0, 50), (60, 50)], fill=(255, 210, 0), outline=(0, 0, 0))
+        draw.rectangle([(28, 16), (32, 36)], fill=(0, 0, 0))
+        draw.ellipse([(27, 40), (33, 46)], fill=(0, 0, 0))
+        return img
+    # field_pack
+    img = Image.new("RGBA", (50, 55), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle([(4, 6), (46, 54)], radius=6, fill=UNIFORM_DARK, outline=(40, 50, 20))
+    draw.rectangle([(10, 0), (40, 8)], fill=(110, 110, 110))
+    draw.rectangle([(12, 20), (38, 34)], fill=VEST)
+    return img
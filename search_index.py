@@ -0,0 +1,194 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dedup import record_key
+from tenants import TenantScoped, tenant_path
+
+# Full-text search over participant records, backed by an SQLite FTS5 table.
+# The CSV stays the source of truth: rows are added here as they are saved and
+# removed when an admin deletes them, so the index never needs a full rebuild
+# in normal use.
+
+DATA_DIR = "data"
+SEARCH_DB_PATH = os.path.join(DATA_DIR, "search.db")
+
+# CSV column -> FTS column; all of these are searchable
+INDEXED_FIELDS = {
+    "Rank Name": "rank_name",
+    "Telegram Handle": "telegram_handle",
+    "Answer": "answer",
+    "Strength": "strength",
+    "Weakness": "weakness",
+    "Improvement": "improvement",
+}
+# Stored for display only
+STORED_FIELDS = {
+    "UNIT": "unit",
+    "COY": "coy",
+    "PLATOON": "platoon",
+    "Score": "score",
+    "Timestamp": "timestamp",
+}
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+def fts5_available():
+    """Whether this Python's SQLite was built with FTS5."""
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def build_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix.
+    Words are quoted, so FTS syntax characters in the input can't cause errors.
+    """
+    terms = _TERM_RE.findall(text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+class SearchIndex:
+    """Incrementally maintained FTS5 index keyed by Attempt ID."""
+
+    def __init__(self, path=SEARCH_DB_PATH):
+        self.path = path
+        self._schema_lock = threading.Lock()
+        self._ready = set()  # database files whose schema exists
+
+    def _connect(self):
+        # One short-lived connection per call: sqlite3 connections can't be shared across
+        # Streamlit's session threads, and opening one is far cheaper than a query
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = sqlite3.connect(self.path, timeout=10)
+        # The path is relative to the working directory, so track each database file separately
+        database = os.path.abspath(self.path)
+        if database not in self._ready:
+            with self._schema_lock:
+                if database not in self._ready:
+                    self._create_schema(conn)
+                    self._ready.add(database)
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(list(INDEXED_FIELDS.values()) +
+                            [f"{c} UNINDEXED" for c in STORED_FIELDS.values()])
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS records USING fts5("
+            f"record_id UNINDEXED, {columns}, tokenize='porter unicode61')"
+        )
+        # FTS5 can't index record_id, so this table maps it to the FTS rowid for updates and deletes
+        conn.execute("CREATE TABLE IF NOT EXISTS record_keys (record_id TEXT PRIMARY KEY)")
+        conn.commit()
+
+    @staticmethod
+    def _values(row):
+        values = [record_key(row)]
+        for field in list(INDEXED_FIELDS) + list(STORED_FIELDS):
+            value = row.get(field, "")
+            values.append("" if value is None or str(value) == "nan" else str(value))
+        return values
+
+    def _insert(self, conn, rows):
+        placeholders = ", ".join("?" * (2 + len(INDEXED_FIELDS) + len(STORED_FIELDS)))
+        for row in rows:
+            values = self._values(row)
+            existing = conn.execute("SELECT rowid FROM record_keys WHERE record_id = ?", (values[0],)).fetchone()
+            if existing:
+                docid = existing[0]
+                conn.execute("DELETE FROM records WHERE rowid = ?", (docid,))
+            else:
+                docid = conn.execute("INSERT INTO record_keys (record_id) VALUES (?)", (values[0],)).lastrowid
+            conn.execute(f"INSERT INTO records (rowid, record_id, {', '.join(list(INDEXED_FIELDS.values()) + list(STORED_FIELDS.values()))}) "
+                         f"VALUES ({placeholders})", [docid] + values)
+
+    def add(self, row):
+        """Index one saved participant row, replacing any earlier copy of it."""
+        self.add_many([row])
+
+    def add_many(self, rows):
+        """Index several saved rows in one transaction."""
+        conn = self._connect()
+        try:
+            with conn:
+                self._insert(conn, rows)
+        finally:
+            conn.close()
+
+    def remove(self, row):
+        """Remove a deleted participant row."""
+        conn = self._connect()
+        try:
+            with conn:
+                existing = conn.execute("SELECT rowid FROM record_keys WHERE record_id = ?",
+                                        (record_key(row),)).fetchone()
+                if existing:
+                    conn.execute("DELETE FROM records WHERE rowid = ?", existing)
+                    conn.execute("DELETE FROM record_keys WHERE rowid = ?", existing)
+        finally:
+            conn.close()
+
+    def rebuild(self, rows):
+        """Replace the whole index with rows, in a single transaction."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM records")
+                conn.execute("DELETE FROM record_keys")
+                self._insert(conn, rows)
+            conn.execute("INSERT INTO records(records) VALUES ('optimize')")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def sync(self, count, get_rows):
+        """
+        Rebuild the index from get_rows() if it doesn't hold count records.
+        Returns True if it was rebuilt; the rows are only built when they are needed.
+        """
+        if self.count() == count:
+            return False
+        self.rebuild(get_rows())
+        return True
+
+    def count(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT count(*) FROM record_keys").fetchone()[0]
+        finally:
+            conn.close()
+
+    def search(self, text, limit=50):
+        """
+        Return (rows, total matches, seconds) for a free-text query, best matches first.
+        Each row has the record's fields plus a "Match" snippet with hits in bold.
+        """
+        query = build_query(text)
+        if not query:
+            return [], 0, 0.0
+        started = time.perf_counter()
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT count(*) FROM records WHERE records MATCH ?", (query,)).fetchone()[0]
+            cursor = conn.execute(
+                "SELECT record_id, " + ", ".join(list(INDEXED_FIELDS.values()) + list(STORED_FIELDS.values())) +
+                ", snippet(records, -1, '**', '**', '…', 12) FROM records WHERE records MATCH ? "
+                "ORDER BY bm25(records) LIMIT ?",
+                (query, limit)
+            )
+            fields = ["Record ID"] + list(INDEXED_FIELDS) + list(STORED_FIELDS) + ["Match"]
+            rows = [dict(zip(fields, values)) for values in cursor]
+        finally:
+            conn.close()
+        return rows, total, time.perf_counter() - started
+
+search_index = TenantScoped(lambda tenant_id: SearchIndex(tenant_path("search.db", tenant_id=tenant_id)))
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Sessions are kept in memory and mirrored to disk so a redeploy can resume them
+DATA_DIR = "data"
+SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+BOT_SESSIONS_DIR = os.path.join(DATA_DIR, "bot_sessions")
+
+SESSION_TTL = 2 * 60 * 60  # seconds of inactivity before a session is evicted
+MAX_SESSIONS = 5000  # hard cap on sessions held in memory
+EVICT_INTERVAL = 60  # seconds between sweeps for expired sessions
+
+class QuizSession:
+    """Compact, serializable snapshot of one participant's progress through the quiz."""
+
+    __slots__ = (
+        "token", "page", "participant_details", "quiz_run_id", "question_id",
+        "question_queue", "question_index", "question_results",
+        "attempt_id", "attempt_number", "attempts_total", "attempt_started_at", "quiz_started_at",
+        "answer", "previous_answer", "retake_feedback", "grading_results",
+        "answer_seconds", "answer_late", "tenant", "origin", "updated_at",
+    )
+
+    def __init__(self, token, **fields):
+        self.token = token
+        for name in self.__slots__[1:]:
+            setattr(self, name, fields.get(name))
+        if self.updated_at is None:
+            self.updated_at = time.time()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = {k: v for k, v in data.items() if k in cls.__slots__ and k != "token"}
+        return cls(data["token"], **fields)
+
+    def is_expired(self, now=None, ttl=SESSION_TTL):
+        return ((now or time.time()) - self.updated_at) > ttl
+
+    def size_bytes(self):
+        """Approximate memory held by this session."""
+        return sys.getsizeof(self) + sum(_deep_sizeof(getattr(self, name)) for name in self.__slots__)
+
+def _deep_sizeof(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_sizeof(k) + _deep_sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_deep_sizeof(v) for v in value)
+    return size
+
+class SessionStore:
+    """
+    Token-addressed quiz sessions with TTL eviction.
+    Memory is bounded by MAX_SESSIONS (least recently used sessions are dropped
+    first); a JSON copy per session on disk lets participants resume after a restart.
+    """
+
+    def __init__(self, directory=SESSIONS_DIR, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def new_token(self):
+        return secrets.token_urlsafe(16)
+
+    def get(self, token):
+        """Return the live session for a token, loading it from disk if needed."""
+        if not token:
+            return None
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None:
+                self._sessions.move_to_end(token)
+        if session is None:
+            session = self._load(token)
+        if session is None or session.is_expired(now, self.ttl):
+            self.delete(token)
+            return None
+        with self._lock:
+            self._sessions[token] = session
+            self._sessions.move_to_end(token)
+            self._trim()
+        return session
+
+    def save(self, session):
+        """Store a session in memory and persist it to disk."""
+        session.updated_at = time.time()
+        with self._lock:
+            self._sessions[session.token] = session
+            self._sessions.move_to_end(session.token)
+            self._trim()
+        self._write(session)
+        self._maybe_sweep()
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+        try:
+            os.remove(self._path(token))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return the number of live sessions and their approximate memory footprint."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        total = sum(s.size_bytes() for s in sessions)
+        return {
+            "sessions": len(sessions),
+            "bytes": total,
+            "avg_bytes": total // len(sessions) if sessions else 0,
+        }
+
+    def evict_expired(self):
+        """Drop expired sessions from memory and disk."""
+        now = time.time()
+        self._last_sweep = now
+        with self._lock:
+            expired = [t for t, s in self._sessions.items() if s.is_expired(now, self.ttl)]
+            for token in expired:
+                del self._sessions[token]
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    continue
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep > EVICT_INTERVAL:
+            self.evict_expired()
+
+    def _trim(self):
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _path(self, token):
+        # Tokens are URL-safe base64, so they are also safe as file names
+        safe = "".join(c for c in token if c.isalnum() or c in "-_")
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def _write(self, session):
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            path = self._path(session.token)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(session.to_dict(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log.error("Error saving quiz session: %s", e)
+
+    def _load(self, token):
+        try:
+            with open(self._path(token), encoding="utf-8") as f:
+                return QuizSession.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+# Shared process-wide store
+session_store = SessionStore()
+# Telegram bot sessions are keyed by chat ID, so they are kept apart from the
+# web quiz's: a ?session= link can never name one
+bot_session_store = SessionStore(BOT_SESSIONS_DIR)
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# State shared between app replicas that run on the same data directory:
+# cross-process file locks, atomic file replacement, and change generations
+# that tell every replica when to drop caches of data another replica changed.
+
+DATA_DIR = "data"
+GENERATION_PATH = os.path.join(DATA_DIR, "generation.json")
+
+# Identifies this process among the replicas; set QUIZ_REPLICA_ID for a stable name
+REPLICA_ID = os.environ.get("QUIZ_REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# --- File locks ---
+
+_held = threading.local()
+
+def _acquire(f, blocking):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if not blocking:
+                raise BlockingIOError("lock is held")
+            import time
+            time.sleep(0.05)
+
+def _release(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _open_lock_file(path):
+    lock_path = f"{path}.lock"
+    directory = os.path.dirname(lock_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    return open(lock_path, "a+")
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on path shared by every thread and process, held for the block.
+    Re-entrant within a thread, so locked helpers can call each other.
+    """
+    key = os.path.abspath(path)
+    counts = getattr(_held, "counts", None)
+    if counts is None:
+        counts = _held.counts = {}
+    if counts.get(key):
+        counts[key] += 1
+        try:
+            yield
+        finally:
+            counts[key] -= 1
+        return
+    f = _open_lock_file(path)
+    try:
+        _acquire(f, blocking=True)
+        counts[key] = 1
+        try:
+            yield
+        finally:
+            counts[key] = 0
+            _release(f)
+    finally:
+        f.close()
+
+def try_hold_lock(path):
+    """
+    Take the lock on path without waiting, keeping it until release_lock().
+    Returns a handle, or None if another process holds it.
+    """
+    f = _open_lock_file(path)
+    try:
+        _acquire(f, blocking=False)
+    except OSError:
+        f.close()
+        return None
+    try:
+        # The file may have been removed by release_lock(remove=True) after we opened it
+        if os.stat(f.name).st_ino != os.fstat(f.fileno()).st_ino:
+            release_lock(f)
+            return try_hold_lock(path)
+    except FileNotFoundError:
+        release_lock(f)
+        return try_hold_lock(path)
+    return f
+
+def release_lock(handle, remove=False):
+    """Release a lock from try_hold_lock(), optionally deleting its lock file first."""
+    try:
+        if remove:
+            os.remove(handle.name)
+    except OSError:
+        pass  # already gone, or still open elsewhere on Windows
+    finally:
+        try:
+            _release(handle)
+        finally:
+            handle.close()
+
+def atomic_write(path, data):
+    """Replace path with data (bytes or str) so readers never see a partial file."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# --- Change generations ---
+
+_listeners = {}  # topic -> [callbacks]
+_seen = {}  # topic -> generation this process has acted on
+_generation_stamp = None  # (mtime_ns, size) of the generation file when last read
+_generation_lock = threading.Lock()
+
+def _read_generations():
+    try:
+        with open(GENERATION_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def bump_generation(topic):
+    """Record that shared data under topic changed, so other replicas invalidate their caches."""
+    with file_lock(GENERATION_PATH):
+        generations = _read_generations()
+        generations[topic] = generations.get(topic, 0) + 1
+        atomic_write(GENERATION_PATH, json.dumps(generations))
+    with _generation_lock:
+        # This replica already knows about its own change
+        _seen[topic] = generations[topic]
+
+def on_change(topic, callback):
+    """
+    Call callback() whenever another replica bumps topic. Tenants' topics are
+    named "<topic>@<tenant>" (see tenants.tenant_topic); the callback runs with
+    that tenant current, so it can drop just that tenant's caches.
+    """
+    _listeners.setdefault(topic, []).append(callback)
+
+def check_for_changes():
+    """
+    Run the callbacks for every topic changed by another replica since the last check.
+    Cheap enough for every rerun: the generation file is only read when its mtime changes.
+    """
+    global _generation_stamp
+    try:
+        stat = os.stat(GENERATION_PATH)
+    except FileNotFoundError:
+        return []
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _generation_lock:
+        if stamp == _generation_stamp:
+            return []
+        _generation_stamp = stamp
+        generations = _read_generations()
+        changed = [topic for topic, generation in generations.items() if _seen.get(topic) != generation]
+        for topic in changed:
+            _seen[topic] = generations[topic]
+    from tenants import DEFAULT_TENANT, use_tenant
+    for topic in changed:
+        base, _, tenant_id = topic.partition("@")
+        with use_tenant(tenant_id or DEFAULT_TENANT):
+            for callback in _listeners.get(base, []):
+                try:
+                    callback()
+                except Exception:
+                    log.exception("Error handling %s change", topic)
+    return changed
@@ -0,0 +1,407 @@
+import atexit
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from dedup import duplicate_index, record_key
+from search_index import search_index
+from shared_state import REPLICA_ID, atomic_write, file_lock, release_lock, try_hold_lock
+from tenants import DEFAULT_TENANT, TenantScoped, set_tenant, tenant_path
+
+# Write-behind storage for participant submissions.
+# submit() makes a row durable by appending it to a small write-ahead log
+# (fsync'd) and returns; a background thread appends queued rows to the CSV
+# in batches and updates the search and duplicate indexes. The WAL is cleared
+# once everything in it has reached the CSV, and replayed on startup if the
+# process died before that happened. A batch whose CSV write fails is retried
+# with backoff by the same process.
+#
+# Several replicas can share the data directory: each has its own WAL, locked
+# for as long as the process runs, and every CSV write holds a file lock. A
+# WAL whose lock is free belongs to a dead replica and is replayed by whichever
+# replica finds it first.
+#
+# submit_many() records a whole batch as one WAL line and appends it to the CSV
+# in one write, so a bulk import is saved completely or not at all.
+#
+# Each tenant has its own CSV, WALs and writer thread (see tenants.py).
+
+DATA_DIR = "data"
+CSV_PATH = os.path.join(DATA_DIR, "participants.csv")
+WAL_DIR = os.path.join(DATA_DIR, "wal")
+
+CSV_COLUMNS = [
+    "UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle",
+    "Answer", "Score", "Strength", "Weakness", "Improvement", "Timestamp",
+    "Attempt ID", "Time Taken", "Late", "Duplicate Of", "Duplicate Similarity", "Repeated Text",
+    "Roster ID"
+]
+
+MAX_BATCH = 500
+# Seconds before retrying a batch the CSV write failed for, doubling each time up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30
+# Seconds between looks for WALs left behind by replicas that have died
+ORPHAN_SCAN_INTERVAL = 60
+# Seconds the admin page waits for queued rows before showing the CSV without them
+FLUSH_TIMEOUT = 5
+
+log = logging.getLogger(__name__)
+
+class _Retry(list):
+    """Rows being retried after a failed CSV write, with the number of failures so far."""
+
+    def __init__(self, rows, failures):
+        super().__init__(rows)
+        self.failures = failures
+
+class SubmissionQueue:
+    """Durable, batched appends of participant rows to the CSV."""
+
+    def __init__(self, csv_path=CSV_PATH, wal_dir=WAL_DIR, replica_id=REPLICA_ID, tenant_id=DEFAULT_TENANT):
+        self.csv_path = csv_path
+        self.wal_dir = wal_dir
+        self.replica_id = replica_id
+        self.tenant_id = tenant_id
+        self.wal_path = None  # set once this process holds the lock on its WAL
+        self._wal_handle = None
+        self._queue = queue.Queue()
+        self._wal_lock = threading.RLock()
+        self._pending = 0  # rows in the WAL that haven't reached the CSV yet
+        self._unsaved = 0  # rows submitted but not yet written and indexed
+        self._saved = threading.Condition(self._wal_lock)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_scan = None
+
+    # --- Public API ---
+
+    def submit(self, row):
+        """Durably record a row and queue it for the CSV. Returns once the WAL write is on disk."""
+        self._ensure_started()
+        line = json.dumps(row, default=str) + "\n"
+        with self._wal_lock:
+            if not os.path.exists(self.wal_dir):
+                os.makedirs(self.wal_dir)
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending += 1
+            self._unsaved += 1
+        self._queue.put([row])
+
+    def submit_many(self, rows):
+        """
+        Durably record a batch of rows as one unit: after a crash either all of them
+        are replayed or none are. They reach the CSV together in a single append.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        self._ensure_started()
+        line = json.dumps(rows, default=str) + "\n"
+        with self._wal_lock:
+            if not os.path.exists(self.wal_dir):
+                os.makedirs(self.wal_dir)
+            with open(self.wal_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending += len(rows)
+            self._unsaved += len(rows)
+        self._queue.put(rows)
+
+    def flush(self, timeout=None):
+        """
+        Block until every submitted row has been written to the CSV, or for at most
+        timeout seconds. Returns whether they all were.
+        """
+        if self._thread is None:
+            return True
+        with self._saved:
+            return self._saved.wait_for(lambda: self._unsaved == 0, timeout)
+
+    def unsaved(self):
+        """Rows submitted but not yet written to the CSV (e.g. while writes are failing)."""
+        return self._unsaved
+
+    def recover(self):
+        """
+        Replay rows missing from the CSV (matched by record key) from this replica's
+        WAL left by its previous run and from the WALs of replicas that have died.
+        Cheap to call on every page load: the WAL directory is scanned at most
+        once per ORPHAN_SCAN_INTERVAL. Returns the number of rows replayed.
+        """
+        with self._wal_lock:
+            now = time.monotonic()
+            if self._last_scan is not None and now - self._last_scan < ORPHAN_SCAN_INTERVAL:
+                return 0
+            first_scan = self._last_scan is None
+            self._last_scan = now
+            self._claim_wal()
+            replayed = 0
+            if first_scan:
+                replayed += self._replay(self.wal_path)
+                self._truncate_wal()
+            for name in os.listdir(self.wal_dir):
+                path = os.path.join(self.wal_dir, name)
+                if not name.endswith(".wal") or path == self.wal_path:
+                    continue
+                handle = try_hold_lock(path)
+                if handle is None:
+                    continue  # its replica is alive and will write those rows itself
+                try:
+                    replayed += self._replay(path)
+                    os.remove(path)
+                finally:
+                    release_lock(handle, remove=True)
+            return replayed
+
+    # --- Writer thread ---
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                if self._last_scan is None:
+                    self.recover()
+                self._thread = threading.Thread(target=self._run, name="submission-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Indexes updated from this thread must be this tenant's
+        set_tenant(self.tenant_id)
+        while True:
+            # Queue items are lists of rows; a bulk batch is never split across writes
+            items = [self._queue.get()]
+            batch = list(items[0])
+            # Take whatever else queued up while the last batch was written
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                batch.extend(item)
+            try:
+                # A failed write may have left some of its rows in the CSV
+                self._append(batch, skip_saved=any(isinstance(item, _Retry) for item in items))
+            except Exception:
+                # The rows are safe in the WAL; write them again after a pause
+                self._retry_later(batch, items)
+                continue
+            with self._wal_lock:
+                self._pending -= len(batch)
+                if self._pending == 0:
+                    self._truncate_wal()
+            try:
+                self._index(batch)
+            except Exception:
+                # The rows are saved; a rebuild from the admin page brings the indexes back in line
+                log.exception("Error indexing %d submission(s)", len(batch))
+            with self._saved:
+                self._unsaved -= len(batch)
+                self._saved.notify_all()
+            for _ in items:
+                self._queue.task_done()
+
+    def _retry_later(self, batch, items):
+        failures = max(getattr(item, "failures", 0) for item in items) + 1
+        delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+        log.exception("Error writing %d submission(s) to the CSV (failure %d); retrying in %.1fs",
+                      len(batch), failures, delay)
+
+        def requeue():
+            # Queued before the old items are marked done, so flush() keeps waiting for these rows
+            self._queue.put(_Retry(batch, failures))
+            for _ in items:
+                self._queue.task_done()
+
+        timer = threading.Timer(delay, requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _apply(self, rows):
+        """Append rows to the CSV and index them."""
+        self._append(rows)
+        self._index(rows)
+
+    def _append(self, rows, skip_saved=False):
+        """Append rows to the CSV, leaving out any already in it if skip_saved."""
+        with file_lock(self.csv_path):
+            if skip_saved:
+                saved = self._saved_keys()
+                rows = [row for row in rows if record_key(row) not in saved]
+                if not rows:
+                    return
+            header = self._ensure_header(rows)
+            with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=header, extrasaction="ignore")
+                writer.writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _ensure_header(self, rows):
+        """Return the CSV header, creating the file or adding new columns if rows need them."""
+        header = self._read_header()
+        if header is None:
+            header = list(CSV_COLUMNS)
+            for row in rows:
+                header.extend(k for k in row if k not in header)
+            with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(header)
+            return header
+        extra = [k for row in rows for k in row if k not in header]
+        if extra:
+            # Older files predate some columns: rewrite once with the wider header
+            import pandas as pd
+            df = pd.read_csv(self.csv_path)
+            for column in CSV_COLUMNS + extra:
+                if column not in df.columns:
+                    df[column] = None
+            atomic_write(self.csv_path, df.to_csv(index=False))
+            header = list(df.columns)
+        return header
+
+    def _read_header(self):
+        try:
+            with open(self.csv_path, newline="", encoding="utf-8") as f:
+                return next(csv.reader(f), None)
+        except FileNotFoundError:
+            return None
+
+    def _saved_keys(self):
+        try:
+            with open(self.csv_path, newline="", encoding="utf-8") as f:
+                return {record_key(row) for row in csv.DictReader(f)}
+        except FileNotFoundError:
+            return set()
+
+    def _index(self, rows):
+        if duplicate_index.exists():
+            duplicate_index.add_many(rows)
+        else:
+            with open(self.csv_path, newline="", encoding="utf-8") as f:
+                duplicate_index.rebuild(list(csv.DictReader(f)))
+        # The rows are already saved, so an index failure must not lose them
+        try:
+            search_index.add_many(rows)
+        except sqlite3.Error as e:
+            log.error("Error updating search index: %s", e)
+
+    # --- WAL ---
+
+    def _claim_wal(self):
+        """Lock this replica's WAL for the life of the process."""
+        if self._wal_handle is not None:
+            return
+        os.makedirs(self.wal_dir, exist_ok=True)
+        name = self.replica_id
+        path = os.path.join(self.wal_dir, f"submissions-{name}.wal")
+        handle = try_hold_lock(path)
+        if handle is None:
+            # Another live process was started with the same replica id
+            name = f"{self.replica_id}-{os.getpid()}"
+            path = os.path.join(self.wal_dir, f"submissions-{name}.wal")
+            handle = try_hold_lock(path)
+        self._wal_handle = handle
+        self.wal_path = path
+
+    def _replay(self, wal_path):
+        """Write rows from a WAL that are missing from the CSV."""
+        rows = self._read_wal(wal_path)
+        if not rows:
+            return 0
+        # Hold the CSV lock across check and write so no replica adds the same rows in between
+        with file_lock(self.csv_path):
+            saved = self._saved_keys()
+            missing = []
+            for row in rows:
+                key = record_key(row)
+                if key not in saved:
+                    missing.append(row)
+                    saved.add(key)
+            if missing:
+                self._apply(missing)
+        return len(missing)
+
+    @staticmethod
+    def _read_wal(wal_path):
+        rows = []
+        try:
+            with open(wal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write was never acknowledged
+                        continue
+                    # A line holds one row, or a list of rows from submit_many()
+                    if isinstance(record, list):
+                        rows.extend(record)
+                    else:
+                        rows.append(record)
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def _truncate_wal(self):
+        try:
+            with open(self.wal_path, "w"):
+                pass
+        except OSError as e:
+            log.error("Error clearing submission log: %s", e)
+
+submission_queue = TenantScoped(lambda tenant_id: SubmissionQueue(
+    tenant_path("participants.csv", tenant_id=tenant_id),
+    tenant_path("wal", tenant_id=tenant_id),
+    tenant_id=tenant_id,
+))
+
+def delete_submission(row):
+    """
+    Remove one saved row from the CSV and the indexes.
+    The CSV is re-read under the lock so rows saved since it was displayed are kept.
+    """
+    import pandas as pd
+    submission_queue.flush(FLUSH_TIMEOUT)
+    key = record_key(row)
+    csv_path = submission_queue.csv_path
+    with file_lock(csv_path):
+        df = pd.read_csv(csv_path)
+        keep = [record_key(r) != key for r in df.to_dict("records")]
+        atomic_write(csv_path, df[keep].to_csv(index=False))
+    duplicate_index.remove(row)
+    search_index.remove(row)
+
+def read_submissions(timeout=None):
+    """
+    The saved rows as a DataFrame, read under the lock so no half-written batch is seen.
+    Waits for queued rows first, for at most timeout seconds.
+    """
+    import pandas as pd
+    flush_submissions(timeout)
+    csv_path = submission_queue.csv_path
+    with file_lock(csv_path):
+        return pd.read_csv(csv_path)
+
+def flush_submissions(timeout=None):
+    """Wait until all of the current tenant's submitted rows are in its CSV (or timeout). Returns whether they are."""
+    return submission_queue.flush(timeout)
+
+def unsaved_submissions():
+    """The number of the current tenant's submitted rows not yet in its CSV."""
+    return submission_queue.unsaved()
+
+def _flush_all_tenants():
+    for tenant_queue in submission_queue.instances():
+        tenant_queue.flush()
+
+atexit.register(_flush_all_tenants)
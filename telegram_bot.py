@@ -0,0 +1,494 @@
+"""
+Telegram bot frontend for the quiz.
+
+Participants take the quiz in a Telegram chat instead of the Streamlit app.
+The bot asks for their unit details, sends each assigned question with its
+scenario image, and grades each answer. It saves passing answers through the
+same core as the quiz page (utils.grade_and_record), into the tenant's CSV.
+Their Telegram username is recorded as their Telegram Handle.
+
+One asyncio process serves every chat. Updates arrive by long polling, and
+each one is handled in its own task, in order within its chat. Blocking work
+(grading, saving, loading images) runs on a thread pool. Progress is kept in
+the session store, so a restarted bot carries on where each chat left off.
+
+Requires httpx (pip install httpx).
+
+Usage:
+    TELEGRAM_BOT_TOKEN=<token> python telegram_bot.py
+    python telegram_bot.py --token <token> --tenant 3sir
+
+A /start payload picks the tenant, e.g. https://t.me/<bot>?start=3sir.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import shared_state
+from attempt_log import log_attempt_event, new_attempt_id
+from perf import metrics
+from roster import link_roster, roster
+from session_store import QuizSession, bot_session_store
+from tenants import COYS, PLATOONS, DEFAULT_TENANT, current_tenant, resolve_tenant, tenant_units, use_tenant
+
+log = logging.getLogger(__name__)
+
+API_URL = "https://api.telegram.org"
+POLL_TIMEOUT = 30  # seconds each getUpdates call waits for new messages
+POLL_LIMIT = 100
+MAX_CONNECTIONS = 32  # Bot API requests in flight at once, besides the long poll
+THREADS = 16  # threads for grading, saving and image loading
+RETRIES = 5
+MAX_RANK_NAME = 100
+PHOTO_QUALITY = 85
+MAX_CAPTION = 1024  # Telegram's limit on photo captions
+
+# Fixed texts; benchmarks/bot_load_test.py recognises the bot's prompts by them
+PROMPTS = {
+    "unit": "Which UNIT are you from?",
+    "coy": "Which COY are you from?",
+    "platoon": "Which PLATOON are you from?",
+    "rank_name": "What is your rank and name? (e.g. PTE Tan Ah Kow)",
+    "roster": "That name isn't on your platoon's roster. Pick your name, or send yours again to keep it.",
+    "question": "Reply with your answer in one message.",
+    "retry": "Send a new answer to try again.",
+    "complete": "You have completed the SAF Safety Quiz.",
+    "start": "Send /start to take the SAF Safety Quiz.",
+    "cancelled": "Quiz cancelled. Send /start to begin again.",
+    "unknown_tenant": "Unknown unit link. Please check the quiz link with your unit.",
+    "no_questions": "No questions configured. Please contact the administrator.",
+    "error": "Something went wrong. Please send your last message again.",
+}
+
+BOT_UPDATE_SECONDS = "quiz_bot_update_seconds"
+metrics.describe(BOT_UPDATE_SECONDS, "Time to handle one Telegram message, including waiting for earlier ones in its chat")
+
+class BotApiError(Exception):
+    """A Bot API call that failed for good (not a rate limit or a transient error)."""
+
+class BotApi:
+    """Minimal async Bot API client over one pooled httpx connection set."""
+
+    def __init__(self, token, base_url=API_URL, max_connections=MAX_CONNECTIONS):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("The Telegram bot needs httpx: pip install httpx")
+        self._httpx = httpx
+        # One more connection than concurrent calls, for the long poll
+        self._client = httpx.AsyncClient(
+            base_url=f"{base_url.rstrip('/')}/bot{token}/",
+            timeout=httpx.Timeout(POLL_TIMEOUT + 10),
+            limits=httpx.Limits(max_connections=max_connections + 1, max_keepalive_connections=max_connections + 1),
+        )
+        # Calls wait here rather than in httpx's pool, whose scheduling slows down as its queue grows
+        self._slots = asyncio.Semaphore(max_connections)
+
+    async def call(self, method, files=None, **params):
+        """Call a Bot API method and return its result, waiting out rate limits and retrying transient errors."""
+        params = {k: v for k, v in params.items() if v is not None}
+        if method == "getUpdates":
+            return await self._call(method, files, params)
+        async with self._slots:
+            return await self._call(method, files, params)
+
+    async def _call(self, method, files, params):
+        delay = 0.5
+        error = ""
+        for _ in range(RETRIES):
+            try:
+                if files:
+                    # Multipart fields are strings; structured ones are sent as JSON
+                    data = {k: v if isinstance(v, str) else json.dumps(v) for k, v in params.items()}
+                    response = await self._client.post(method, data=data, files=files)
+                else:
+                    response = await self._client.post(method, json=params)
+                body = response.json()
+            except (self._httpx.TransportError, ValueError) as e:
+                error = str(e) or type(e).__name__
+            else:
+                if body.get("ok"):
+                    return body["result"]
+                error = body.get("description") or f"HTTP {response.status_code}"
+                retry_after = (body.get("parameters") or {}).get("retry_after")
+                if retry_after:
+                    await asyncio.sleep(retry_after)
+                    continue
+                if response.status_code < 500:
+                    raise BotApiError(f"{method}: {error}")
+            await asyncio.sleep(delay)
+            delay *= 2
+        raise BotApiError(f"{method}: {error}")
+
+    async def close(self):
+        await self._client.aclose()
+
+# --- Blocking work, run on the thread pool in the chat's tenant ---
+
+def _start_quiz(group):
+    """Prepare the tenant's storage and assign a participant's questions. Returns the question IDs."""
+    from question_schedule import assign_questions
+    from quiz_config import list_questions, load_quiz_config
+    from utils import initialize_data_storage
+    initialize_data_storage()
+    questions = list_questions()
+    if not questions:
+        return []
+    return assign_questions(questions, load_quiz_config().get("questions_per_participant", 1), group=group)
+
+def _load_question(question_id):
+    """(config, question) for an assigned question, or a random one if it was removed since."""
+    from quiz_config import get_question_by_id, list_questions, load_quiz_config
+    question = get_question_by_id(question_id) if question_id else None
+    if question is None:
+        questions = list_questions()
+        question = get_question_by_id(random.choice(questions)["id"]) if questions else None
+    return load_quiz_config(), question
+
+def scenario_photo(question):
+    """JPEG bytes of a question's scenario image: the saved one, else its offline scene render."""
+    from quiz_config import load_scenario_image
+    from scene_renderer import render_scene
+    image = load_scenario_image(question.get("id", "q1"))
+    if image is None:
+        image = render_scene(question)
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, "JPEG", quality=PHOTO_QUALITY)
+    return buffer.getvalue()
+
+def _telegram_handle(user):
+    username = (user or {}).get("username")
+    return f"@{username}" if username else f"tg:{(user or {}).get('id', '')}"
+
+def _feedback(results):
+    return (f"Strength: {results['Strength']}\n"
+            f"Weakness: {results['Weakness']}\n"
+            f"Improvement: {results['Improvement']}")
+
+def _match_roster(details, text):
+    """The participant's roster entry (recorded in details), else roster names in their platoon like text."""
+    entry = link_roster(details)
+    if entry is not None or not roster.exists():
+        return entry, []
+    similar = roster.suggest(text, unit=details["UNIT"], coy=details["COY"], platoon=details["PLATOON"])
+    return None, [e["Rank Name"] for e in similar]
+
+def _choices(options):
+    """A reply keyboard of options, two to a row."""
+    rows = [[{"text": option} for option in options[i:i + 2]] for i in range(0, len(options), 2)]
+    return {"keyboard": rows, "one_time_keyboard": True, "resize_keyboard": True}
+
+# --- Bot ---
+
+class QuizBot:
+    """Runs the quiz in every chat the bot is in."""
+
+    def __init__(self, api, tenant_id=DEFAULT_TENANT, poll_timeout=POLL_TIMEOUT):
+        self.api = api
+        self.tenant_id = tenant_id
+        self.poll_timeout = poll_timeout
+        self._locks = {}  # chat id -> lock that keeps its messages in order
+        self._waiting = {}  # chat id -> messages being handled or waiting for the lock
+        self._tasks = set()
+        # Telegram keeps uploaded photos, so each scenario image is uploaded once and then sent by file_id
+        self._photos = {}  # (tenant, question id) -> file_id
+        self._photo_locks = {}
+        shared_state.on_change("images", self._forget_photos)
+
+    async def run(self, stop=None):
+        """Poll for updates until stop (an asyncio.Event) is set."""
+        offset = None
+        while stop is None or not stop.is_set():
+            # Question and image edits saved from the admin page
+            shared_state.check_for_changes()
+            try:
+                updates = await self.api.call("getUpdates", offset=offset, timeout=self.poll_timeout,
+                                              limit=POLL_LIMIT, allowed_updates=["message"])
+            except BotApiError as e:
+                log.error("Error polling for updates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                self.dispatch(update)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def dispatch(self, update):
+        """Handle an update in the background; messages in one chat are handled one at a time, in order."""
+        message = update.get("message")
+        if not message or "text" not in message:
+            return
+        task = asyncio.create_task(self._handle_in_order(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_in_order(self, message):
+        chat_id = message["chat"]["id"]
+        started = time.perf_counter()
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._waiting[chat_id] = self._waiting.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                try:
+                    await self.handle(chat_id, message)
+                except Exception:
+                    log.exception("Error handling chat %s", chat_id)
+                    try:
+                        await self.send(chat_id, PROMPTS["error"])
+                    except BotApiError:
+                        pass
+        finally:
+            self._waiting[chat_id] -= 1
+            if not self._waiting[chat_id]:
+                del self._waiting[chat_id]
+                del self._locks[chat_id]
+        metrics.observe(BOT_UPDATE_SECONDS, time.perf_counter() - started)
+
+    async def send(self, chat_id, text, reply_markup=None):
+        return await self.api.call("sendMessage", chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+    async def handle(self, chat_id, message):
+        text = message["text"].strip()
+        token = f"tg-{chat_id}"
+        if text.split(maxsplit=1)[:1] == ["/start"]:
+            payload = text[len("/start"):].strip()
+            tenant_id = resolve_tenant(payload) if payload else self.tenant_id
+            if tenant_id is None:
+                await self.send(chat_id, PROMPTS["unknown_tenant"])
+                return
+            session = QuizSession(token, page="unit", participant_details={}, tenant=tenant_id, origin="telegram")
+            await asyncio.to_thread(bot_session_store.save, session)
+            with use_tenant(tenant_id):
+                await self.send(chat_id, PROMPTS["unit"], _choices(tenant_units()))
+            return
+        if text == "/cancel":
+            await asyncio.to_thread(bot_session_store.delete, token)
+            await self.send(chat_id, PROMPTS["cancelled"], {"remove_keyboard": True})
+            return
+        session = await asyncio.to_thread(bot_session_store.get, token)
+        if session is None:
+            await self.send(chat_id, PROMPTS["start"])
+            return
+        with use_tenant(session.tenant or DEFAULT_TENANT):
+            await self.STEPS[session.page](self, chat_id, session, text, message)
+
+    # --- Participant details ---
+
+    async def _choose(self, chat_id, session, text, field, options, next_page, next_prompt, next_options=None):
+        if text not in options:
+            await self.send(chat_id, PROMPTS[session.page], _choices(options))
+            return
+        session.participant_details[field] = text
+        session.page = next_page
+        await asyncio.to_thread(bot_session_store.save, session)
+        await self.send(chat_id, PROMPTS[next_prompt], _choices(next_options) if next_options else {"remove_keyboard": True})
+
+    async def on_unit(self, chat_id, session, text, message):
+        await self._choose(chat_id, session, text, "UNIT", tenant_units(), "coy", "coy", COYS)
+
+    async def on_coy(self, chat_id, session, text, message):
+        await self._choose(chat_id, session, text, "COY", COYS, "platoon", "platoon", PLATOONS)
+
+    async def on_platoon(self, chat_id, session, text, message):
+        await self._choose(chat_id, session, text, "PLATOON", PLATOONS, "rank_name", "rank_name")
+
+    async def on_rank_name(self, chat_id, session, text, message):
+        if not text or text.startswith("/") or len(text) > MAX_RANK_NAME:
+            await self.send(chat_id, PROMPTS["rank_name"])
+            return
+        details = session.participant_details
+        # Sending the same unlisted name twice keeps it
+        kept = details.get("Rank Name") == text
+        details["Rank Name"] = text
+        details["Telegram Handle"] = _telegram_handle(message.get("from"))
+        entry, similar = await asyncio.to_thread(_match_roster, details, text)
+        if entry is None and similar and not kept:
+            await asyncio.to_thread(bot_session_store.save, session)
+            await self.send(chat_id, PROMPTS["roster"], _choices(similar + [text]))
+            return
+        session.quiz_run_id = new_attempt_id()
+        queue = await asyncio.to_thread(_start_quiz, f"{details['UNIT']}/{details['COY']}")
+        if not queue:
+            await self.send(chat_id, PROMPTS["no_questions"])
+            return
+        session.question_queue = queue
+        session.question_index = 0
+        session.question_results = []
+        session.attempts_total = 0
+        await self.send_question(chat_id, session)
+
+    # --- Questions ---
+
+    def _label(self, session):
+        """Identify the participant in attempt events, as the quiz page does."""
+        details = session.participant_details or {}
+        return {
+            "run_id": session.quiz_run_id,
+            "telegram_handle": details.get("Telegram Handle"),
+            "unit": details.get("UNIT"),
+            "coy": details.get("COY"),
+            "tenant": current_tenant(),
+            "channel": "telegram",
+        }
+
+    def _start_attempt(self, session):
+        session.attempt_id = new_attempt_id()
+        session.attempt_started_at = time.time()
+        session.attempt_number = (session.attempt_number or 0) + 1
+        session.attempts_total = (session.attempts_total or 0) + 1
+        if session.quiz_started_at is None:
+            session.quiz_started_at = session.attempt_started_at
+        log_attempt_event("start", session.attempt_id, question_id=session.question_id,
+                          attempt_number=session.attempt_number, **self._label(session))
+
+    async def send_question(self, chat_id, session):
+        question_id = session.question_queue[session.question_index]
+        config, question = await asyncio.to_thread(_load_question, question_id)
+        if question is None:
+            await asyncio.to_thread(bot_session_store.delete, session.token)
+            await self.send(chat_id, PROMPTS["no_questions"])
+            return
+        session.question_id = question["id"]
+        session.attempt_number = 0
+        self._start_attempt(session)
+        session.page = "quiz_question"
+        await asyncio.to_thread(bot_session_store.save, session)
+
+        title = question.get("scenario_title", "Safety Scenario Question")
+        lines = [title, "", question.get("question_text", "")]
+        if len(session.question_queue) > 1:
+            lines.insert(1, f"Question {session.question_index + 1} of {len(session.question_queue)}")
+        time_limit = config.get("time_limit", 0) or 0
+        if time_limit:
+            lines += ["", f"You have {time_limit} seconds."]
+        lines += ["", PROMPTS["question"]]
+        text = "\n".join(lines)
+        if not question.get("image_enabled", True):
+            await self.send(chat_id, text)
+        elif len(text) <= MAX_CAPTION:
+            # One message instead of two
+            await self.send_photo(chat_id, question, text)
+        else:
+            await self.send_photo(chat_id, question, title)
+            await self.send(chat_id, text)
+
+    async def send_photo(self, chat_id, question, caption):
+        key = (current_tenant(), question["id"])
+        if await self._send_known_photo(chat_id, key, caption):
+            return
+        # One upload per image: chats asking for it meanwhile wait, then reuse its file_id
+        lock = self._photo_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if await self._send_known_photo(chat_id, key, caption):
+                return
+            photo = await asyncio.to_thread(scenario_photo, question)
+            sent = await self.api.call("sendPhoto", files={"photo": ("scenario.jpg", photo, "image/jpeg")},
+                                       chat_id=chat_id, caption=caption)
+            self._photos[key] = max(sent["photo"], key=lambda size: size.get("width", 0))["file_id"]
+
+    async def _send_known_photo(self, chat_id, key, caption):
+        file_id = self._photos.get(key)
+        if file_id is None:
+            return False
+        try:
+            await self.api.call("sendPhoto", chat_id=chat_id, photo=file_id, caption=caption)
+            return True
+        except BotApiError:
+            # Telegram no longer has it: upload again
+            self._photos.pop(key, None)
+            return False
+
+    def _forget_photos(self):
+        """A tenant's images changed: upload them again when next sent."""
+        tenant_id = current_tenant()
+        for key in [key for key in self._photos if key[0] == tenant_id]:
+            self._photos.pop(key, None)
+
+    async def on_answer(self, chat_id, session, text, message):
+        from utils import SUBMIT_GRACE_SECONDS, grade_and_record
+        if not text or text.startswith("/"):
+            await self.send(chat_id, PROMPTS["question"])
+            return
+        config, question = await asyncio.to_thread(_load_question, session.question_id)
+        time_limit = config.get("time_limit", 0) or 0
+        elapsed = time.time() - session.attempt_started_at
+        late = bool(time_limit) and elapsed > time_limit + SUBMIT_GRACE_SECONDS
+        label = self._label(session)
+        log_attempt_event("submit", session.attempt_id, question_id=session.question_id,
+                          attempt_number=session.attempt_number, answer=text, answer_seconds=round(elapsed, 3),
+                          time_limit=time_limit, late=late, **label)
+        results, passed = await asyncio.to_thread(
+            grade_and_record, text, question, session.participant_details, config, session.attempt_id,
+            attempt_number=session.attempt_number, answer_seconds=round(elapsed, 3), late=late, label=label)
+
+        if not passed:
+            passing_score = config.get("passing_score", 9)
+            await self.send(chat_id, f"Your score was {results['Score']}/10. You need a score of {passing_score} "
+                                     f"or higher to pass.\n\n{_feedback(results)}\n\n{PROMPTS['retry']}")
+            log_attempt_event("retry", session.attempt_id, question_id=session.question_id,
+                              attempt_number=session.attempt_number, **label)
+            self._start_attempt(session)
+            await asyncio.to_thread(bot_session_store.save, session)
+            return
+
+        title = question.get("scenario_title", session.question_id)
+        session.question_results = (session.question_results or []) + [{"Question": title, **results}]
+        await self.send(chat_id, f"{title}: {results['Score']}/10\n\n{_feedback(results)}")
+        if session.question_index + 1 < len(session.question_queue):
+            session.question_index += 1
+            await self.send_question(chat_id, session)
+            return
+        log_attempt_event("complete", session.attempt_id, question_id=session.question_id,
+                          questions=len(session.question_results), attempts=session.attempts_total,
+                          total_seconds=round(time.time() - session.quiz_started_at, 3), **label)
+        await asyncio.to_thread(bot_session_store.delete, session.token)
+        total = sum(result["Score"] for result in session.question_results)
+        await self.send(chat_id, f"{PROMPTS['complete']} Your total score is: "
+                                 f"{total}/{10 * len(session.question_results)}")
+
+    STEPS = {
+        "unit": on_unit,
+        "coy": on_coy,
+        "platoon": on_platoon,
+        "rank_name": on_rank_name,
+        "quiz_question": on_answer,
+    }
+
+async def serve(token, api_url=API_URL, tenant_id=DEFAULT_TENANT, stop=None, poll_timeout=POLL_TIMEOUT):
+    """Run the bot until stop is set (or forever)."""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(THREADS, thread_name_prefix="quiz-bot"))
+    api = BotApi(token, api_url)
+    try:
+        await QuizBot(api, tenant_id, poll_timeout).run(stop)
+    finally:
+        await api.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--token", help="bot token (default: TELEGRAM_BOT_TOKEN)")
+    parser.add_argument("--api-url", default=API_URL, help="Bot API server")
+    parser.add_argument("--tenant", default="", help="tenant for /start without a payload")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    token = args.token or os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        sys.exit("Set TELEGRAM_BOT_TOKEN or pass --token")
+    tenant_id = resolve_tenant(args.tenant)
+    if tenant_id is None:
+        sys.exit(f"Unknown tenant: {args.tenant}")
+    try:
+        asyncio.run(serve(token, args.api_url, tenant_id))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
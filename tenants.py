@@ -0,0 +1,169 @@
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from shared_state import atomic_write, file_lock
+
+# Tenants (one per battalion) each have their own quiz config, question bank,
+# scenario images and submission shard, in their own data directory, so one
+# unit's quiz drop or data size never touches another's files, caches or locks.
+# The default tenant uses data/ itself; others live in data/tenants/<id>/.
+# Requests are routed by the ?tenant=<id> URL parameter, and the tenant is held
+# in a context variable for the rest of the rerun.
+
+DATA_DIR = "data"
+TENANTS_DIR = os.path.join(DATA_DIR, "tenants")
+REGISTRY_PATH = os.path.join(DATA_DIR, "tenants.json")
+
+DEFAULT_TENANT = "default"
+DEFAULT_UNITS = ["1 SIR", "2 SIR", "3 SIR"]
+# Companies and platoons are organised the same way in every unit
+COYS = ["Alpha", "Bravo", "Charlie"]
+PLATOONS = ["1", "2", "3", "4"]
+
+TENANT_ID_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+_current = contextvars.ContextVar("quiz_tenant", default=DEFAULT_TENANT)
+
+# --- Current tenant ---
+
+def current_tenant():
+    return _current.get()
+
+def set_tenant(tenant_id):
+    """Make tenant_id the current tenant for the rest of this thread's work."""
+    _current.set(tenant_id)
+
+@contextmanager
+def use_tenant(tenant_id):
+    """Run a block as tenant_id, restoring the previous tenant afterwards."""
+    token = _current.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def tenant_dir(tenant_id=None):
+    """Data directory of a tenant (the current one by default)."""
+    tenant_id = tenant_id or current_tenant()
+    if tenant_id == DEFAULT_TENANT:
+        return DATA_DIR
+    return os.path.join(TENANTS_DIR, tenant_id)
+
+def tenant_path(*parts, tenant_id=None):
+    return _tenant_path(tenant_id or current_tenant(), parts)
+
+@functools.lru_cache(maxsize=4096)
+def _tenant_path(tenant_id, parts):
+    # Resolved once per tenant and path: hot paths (config, images) look theirs up on every call
+    return os.path.join(tenant_dir(tenant_id), *parts)
+
+def tenant_topic(topic, tenant_id=None):
+    """Change-generation topic for a tenant's data (see shared_state.bump_generation)."""
+    tenant_id = tenant_id or current_tenant()
+    return topic if tenant_id == DEFAULT_TENANT else f"{topic}@{tenant_id}"
+
+# --- Registry ---
+
+_registry_lock = threading.Lock()
+_registry = None
+_registry_stamp = None  # (inode, mtime_ns, size) of the registry when last read
+
+def list_tenants():
+    """{tenant id: {"name", "units"}} for every tenant, the default one first."""
+    global _registry, _registry_stamp
+    try:
+        stat = os.stat(REGISTRY_PATH)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+    with _registry_lock:
+        if _registry is not None and stamp == _registry_stamp:
+            return _registry
+    stored = {}
+    if stamp is not None:
+        try:
+            with open(REGISTRY_PATH) as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            stored = {}
+    registry = {DEFAULT_TENANT: {"name": "Default", "units": list(DEFAULT_UNITS)}}
+    registry.update(stored)
+    with _registry_lock:
+        _registry, _registry_stamp = registry, stamp
+    return registry
+
+def get_tenant(tenant_id):
+    return list_tenants().get(tenant_id)
+
+def resolve_tenant(requested):
+    """The tenant ID for a ?tenant= value: the default when absent, None if there is no such tenant."""
+    if not requested:
+        return DEFAULT_TENANT
+    requested = str(requested).strip().lower()
+    return requested if requested in list_tenants() else None
+
+def tenant_units(tenant_id=None):
+    """Units that participants of a tenant choose from."""
+    tenant = get_tenant(tenant_id or current_tenant()) or {}
+    return tenant.get("units") or list(DEFAULT_UNITS)
+
+def save_tenant(tenant_id, name, units):
+    """Add or update a tenant and create its data directory. Raises ValueError for a bad ID or no units."""
+    tenant_id = str(tenant_id).strip().lower()
+    if not TENANT_ID_RE.match(tenant_id):
+        raise ValueError("Tenant ID must be 1-32 lowercase letters, digits, '-' or '_'")
+    units = [unit.strip() for unit in units if unit and unit.strip()]
+    if not units:
+        raise ValueError("A tenant needs at least one unit")
+    with file_lock(REGISTRY_PATH):
+        try:
+            with open(REGISTRY_PATH) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            stored = {}
+        stored[tenant_id] = {"name": name.strip() or tenant_id, "units": units}
+        atomic_write(REGISTRY_PATH, json.dumps(stored, indent=2))
+    os.makedirs(tenant_dir(tenant_id), exist_ok=True)
+
+# --- Per-tenant objects ---
+
+class TenantScoped:
+    """
+    Stands in for a stateful object (a cache, an index, a writer queue) with one
+    instance per tenant, made by factory(tenant_id) on first use. Attribute
+    access goes to the current tenant's instance, so callers use it like the
+    single object it replaces.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instances", {})
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def for_tenant(self, tenant_id):
+        instance = self._instances.get(tenant_id)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(tenant_id)
+                if instance is None:
+                    instance = self._instances[tenant_id] = self._factory(tenant_id)
+        return instance
+
+    def instances(self):
+        """Every tenant's instance created so far in this process."""
+        with self._lock:
+            return list(self._instances.values())
+
+    def __getattr__(self, name):
+        return getattr(self.for_tenant(current_tenant()), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.for_tenant(current_tenant()), name, value)
+
+    def __len__(self):
+        return len(self.for_tenant(current_tenant()))
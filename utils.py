@@ -1,70 +1,104 @@
 import streamlit as st
-import pandas as pd
 import os
+import time
+from datetime import datetime
 from io import BytesIO
+import grading
+from attempt_log import log_attempt_event
+from dedup import check_answer
+from assets import get_css_tag
+from perf import timed
+from shared_state import file_lock
+from submissions import submission_queue, CSV_COLUMNS
+from tenants import tenant_dir
 
 # --- Constants ---
 DATA_DIR = "data"
-CSV_PATH = os.path.join(DATA_DIR, "participants.csv")
+CSV_PATH = os.path.join(DATA_DIR, "participants.csv")  # the default tenant's
+# Seconds allowed past the time limit for network and rerun latency before an answer is flagged late
+SUBMIT_GRACE_SECONDS = 5
 
 # --- Helper Functions ---
 
 def initialize_data_storage():
-    """Creates the data directory and CSV file if they don't exist."""
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-    if not os.path.exists(CSV_PATH):
-        df = pd.DataFrame(columns=[
-            "UNIT", "COY", "PLATOON", "Rank Name", "Telegram Handle", 
-            "Answer", "Score", "Strength", "Weakness", "Improvement", "Timestamp"
-        ])
-        df.to_csv(CSV_PATH, index=False)
+    """Creates the current tenant's data directory and CSV file if they don't exist."""
+    os.makedirs(tenant_dir(), exist_ok=True)
+    csv_path = submission_queue.csv_path
+    if not os.path.exists(csv_path):
+        # Checked again under the lock: another replica may be creating it too
+        with file_lock(csv_path):
+            if not os.path.exists(csv_path):
+                import pandas as pd
+                df = pd.DataFrame(columns=CSV_COLUMNS)
+                df.to_csv(csv_path, index=False)
+    # Replay submissions a crashed process acknowledged but never wrote to the CSV
+    submission_queue.recover()
 
 def load_custom_css():
-    """Loads and injects custom CSS for styling."""
-    try:
-        with open("styles.css") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
-    except FileNotFoundError:
+    """Injects the custom CSS, read and minified once per process by the asset layer."""
+    css_tag = get_css_tag("styles.css")
+    if css_tag:
+        st.markdown(css_tag, unsafe_allow_html=True)
+    else:
         st.warning("styles.css not found. Using default styles.")
 
-def grade_answer(answer: str) -> dict:
+@timed()
+def grade_answer(answer: str, question: dict = None, config: dict = None) -> dict:
     """
-    Grades the user's answer critically.
-    This is a placeholder for a more advanced grading model.
+    Grades the user's answer with the backend selected in the quiz config.
+    Without a config the original keyword rules are used (see grading.py).
     """
-    # Simple keyword-based grading for demonstration
-    score = 0
-    strength = "No specific strengths identified."
-    weakness = "Lacked detail on critical safety procedures."
-    improvement = "A better answer would include checking for consciousness, calling for a medic, and not moving the injured person."
+    return grading.grade(answer, question, config)
 
-    if "medic" in answer.lower() or "call for help" in answer.lower():
-        score += 4
-    if "check" in answer.lower() or "assess" in answer.lower():
-        score += 3
-    if "conscious" in answer.lower() or "breathing" in answer.lower():
-        score += 3
-    
-    if score >= 7:
-        strength = "Good identification of initial response steps."
-        weakness = "Could be more specific on who to call and what to check."
-    if score >= 4:
-        improvement = "Specify calling the platoon medic or section commander and checking for breathing and responsiveness."
+@timed()
+def save_participant_data(data: dict):
+    """
+    Saves participant data. Returns once the row is durable in the submission log;
+    it reaches the CSV shortly after on a background thread (see submissions.py).
+    """
+    submission_queue.submit(data)
 
-    return {
-        "Score": score,
-        "Strength": strength,
-        "Weakness": weakness,
-        "Improvement": improvement
-    }
+def grade_and_record(answer, question, details, config, attempt_id, attempt_number=1,
+                     answer_seconds=None, late=False, label=None):
+    """
+    Grade an answer, log the grade event and save the participant's row if it passes.
+    Shared by the quiz page and the Telegram bot. Returns (grading results, passed).
+    """
+    grade_started = time.perf_counter()
+    grading_results = grade_answer(answer, question, config)
+    grade_ms = (time.perf_counter() - grade_started) * 1000
 
-def save_participant_data(data: dict):
-    """Saves participant data to the CSV file."""
-    df = pd.read_csv(CSV_PATH)
-    new_entry = pd.DataFrame([data])
-    df = pd.concat([df, new_entry], ignore_index=True)
-    df.to_csv(CSV_PATH, index=False)
+    passing_score = config.get("passing_score", 9)
+    passed = grading_results["Score"] >= passing_score
+    # Flag answers that nearly copy someone else's, or repeat themselves
+    duplicate = check_answer(answer, details)
+    log_attempt_event(
+        "grade", attempt_id,
+        question_id=question.get("id", "q1"),
+        attempt_number=attempt_number,
+        score=grading_results["Score"],
+        passing_score=passing_score,
+        passed=passed,
+        grade_ms=round(grade_ms, 3),
+        duplicate_of=duplicate["duplicate_of"],
+        duplicate_similarity=duplicate["similarity"],
+        repeated_passages=len(duplicate["repeated"]),
+        **(label or {})
+    )
+    if passed:
+        save_participant_data({
+            **details,
+            "Answer": answer,
+            **grading_results,
+            "Timestamp": datetime.now().isoformat(),
+            "Attempt ID": attempt_id,
+            "Time Taken": answer_seconds,
+            "Late": late,
+            "Duplicate Of": duplicate["duplicate_of"],
+            "Duplicate Similarity": duplicate["similarity"],
+            "Repeated Text": " | ".join(duplicate["repeated"])
+        })
+    return grading_results, passed
 
 def send_telegram_message(telegram_handle: str, message: str):
     """Placeholder function to simulate sending a Telegram message."""